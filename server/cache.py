@@ -0,0 +1,99 @@
+"""Size-bounded in-process caches."""
+
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+from typing import Generic, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+
+class LruCache(Generic[K, V]):
+    """Least-recently-used cache bounded by entry count and by size.
+
+    ``sizeof`` estimates the bytes an entry holds. A value read before an
+    invalidation may be outdated by it, so ``put`` takes the ``version``
+    observed before the read and ignores the value if any invalidation
+    happened since.
+    """
+
+    def __init__(
+        self, max_entries: int, max_bytes: int, sizeof: Callable[[V], int]
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.stats = CacheStats()
+        self.version = 0
+        self._entries: OrderedDict[K, tuple[V, int]] = OrderedDict()
+
+    def get(self, key: K) -> V | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return entry[0]
+
+    def peek(self, key: K) -> V | None:
+        """Cached value, without counting a hit or refreshing its recency"""
+        entry = self._entries.get(key)
+        return None if entry is None else entry[0]
+
+    def refresh(self, key: K, value: V) -> bool:
+        """Replace a value after a write, outdating values still being read"""
+        self.version += 1
+        return self.put(key, value)
+
+    def put(self, key: K, value: V, version: int | None = None) -> bool:
+        """Cache value; returns False if it was outdated or does not fit"""
+        if version is not None and version != self.version:
+            return False
+
+        size = self.sizeof(value)
+        if self.max_entries < 1 or size > self.max_bytes:
+            return False
+
+        self._discard(key)
+        self._entries[key] = (value, size)
+        self.stats.bytes += size
+        while (
+            len(self._entries) > self.max_entries or self.stats.bytes > self.max_bytes
+        ):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.stats.bytes -= evicted_size
+            self.stats.evictions += 1
+        self.stats.entries = len(self._entries)
+        return True
+
+    def invalidate(self, key: K) -> None:
+        self.version += 1
+        if self._discard(key):
+            self.stats.invalidations += 1
+        self.stats.entries = len(self._entries)
+
+    def clear(self) -> None:
+        self.version += 1
+        self.stats.invalidations += len(self._entries)
+        self._entries.clear()
+        self.stats.entries = 0
+        self.stats.bytes = 0
+
+    def _discard(self, key: K) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self.stats.bytes -= entry[1]
+        return True
@@ -0,0 +1,202 @@
+"""Resumable change-stream consumption."""
+
+import asyncio
+import logging
+from asyncio import FIRST_COMPLETED
+from collections.abc import Awaitable, Callable, Mapping
+from contextlib import suppress
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from typing import Any
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# the oplog no longer holds the resume point, so the events in between are lost
+CHANGE_STREAM_HISTORY_LOST = 286
+
+
+@dataclass
+class ChangeStreamStats:
+    events: int = 0
+    reconnects: int = 0
+    restarts: int = 0
+    gaps: int = 0
+    checkpoints: int = 0
+    lag_seconds: float = 0.0
+    max_lag_seconds: float = 0.0
+
+
+@dataclass
+class Backoff:
+    initial: float = 0.5
+    maximum: float = 30.0
+
+    def next(self, delay: float) -> float:
+        return min(delay * 2, self.maximum)
+
+
+class ResumeTokenStore:
+    """Persists the resume token of one change-stream consumer.
+
+    Saves are throttled to one write per ``interval`` seconds, so a restart
+    may replay the events of that interval; consumers must be idempotent.
+    """
+
+    def __init__(
+        self,
+        checkpoints: AsyncIOMotorCollection[Any],
+        consumer_id: str,
+        interval: float = 1.0,
+    ) -> None:
+        self.checkpoints = checkpoints
+        self.consumer_id = consumer_id
+        self.interval = interval
+        self._saved_at = 0.0
+
+    async def load(self) -> Mapping[str, Any] | None:
+        checkpoint = await self.checkpoints.find_one({"_id": self.consumer_id})
+        if not checkpoint:
+            return None
+        token: Mapping[str, Any] | None = checkpoint.get("resume_token")
+        return token
+
+    async def save(self, token: Mapping[str, Any] | None, force: bool = False) -> bool:
+        now = asyncio.get_running_loop().time()
+        if token is None or (not force and now - self._saved_at < self.interval):
+            return False
+
+        await self.checkpoints.update_one(
+            {"_id": self.consumer_id},
+            {"$set": {"resume_token": token, "updated_at": datetime.now()}},
+            upsert=True,
+        )
+        self._saved_at = now
+        return True
+
+
+class ChangeStreamWatcher:
+    """Feeds the changes of a collection to ``handle``, surviving failovers.
+
+    The stream is reopened with exponential backoff after any error and
+    resumes after the last handled event, or the last oplog position the
+    server scanned if that is later, from the persisted token on a fresh
+    start. If the oplog no longer covers that token, the watcher
+    counts a gap and starts over from the current time. ``restart`` reopens
+    the stream without backoff so that a changed ``pipeline`` takes effect.
+    Without ``tokens`` the watcher always starts from the current time and
+    only resumes within its own lifetime.
+    """
+
+    # lets a burst of restart requests settle into a single reopen
+    restart_delay = 0.1
+
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection[Any],
+        handle: Callable[[dict[str, Any]], Awaitable[None]],
+        tokens: ResumeTokenStore | None,
+        pipeline: Callable[[], list[dict[str, Any]]] | None = None,
+        backoff: Backoff | None = None,
+    ) -> None:
+        self.collection = collection
+        self.handle = handle
+        self.tokens = tokens
+        self.pipeline = pipeline or (lambda: [])
+        self.backoff = backoff or Backoff()
+        self.stats = ChangeStreamStats()
+        self._token: Mapping[str, Any] | None = None
+        self._restart = asyncio.Event()
+
+    async def run(self) -> None:
+        self._token = await self.tokens.load() if self.tokens else None
+        delay = self.backoff.initial
+        try:
+            while True:
+                self._restart.clear()
+                try:
+                    if await self._consume_until_restart():
+                        self.stats.restarts += 1
+                        await asyncio.sleep(self.restart_delay)
+                        continue
+                    delay = self.backoff.initial
+                except OperationFailure as e:
+                    if e.code != CHANGE_STREAM_HISTORY_LOST:
+                        logger.error(f"Error watching {self.collection.name}: {e}")
+                    else:
+                        logger.error(f"Change stream history lost: {e}")
+                        self._history_lost()
+                except Exception as e:
+                    logger.error(f"Error watching {self.collection.name}: {e}")
+
+                self.stats.reconnects += 1
+                await asyncio.sleep(delay)
+                delay = self.backoff.next(delay)
+        finally:
+            await self._checkpoint(force=True)
+
+    def restart(self) -> None:
+        """Reopen the stream with a fresh pipeline, resuming where it stopped"""
+        self._restart.set()
+
+    def _history_lost(self) -> None:
+        """Start over from the current time; the events in between are lost"""
+        self.stats.gaps += 1
+        self._token = None
+
+    async def _consume_until_restart(self) -> bool:
+        consume = asyncio.create_task(self._consume())
+        restart = asyncio.create_task(self._restart.wait())
+        try:
+            await asyncio.wait({consume, restart}, return_when=FIRST_COMPLETED)
+        finally:
+            restart.cancel()
+            if not consume.done():
+                consume.cancel()
+                with suppress(asyncio.CancelledError):
+                    await consume
+
+        if consume.cancelled():
+            return True
+        consume.result()
+        return False
+
+    async def _consume(self) -> None:
+        logger.info(f"watching {self.collection.name}")
+        async with self._watch() as stream:
+            while stream.alive:
+                change = await stream.try_next()
+                if change is not None:
+                    try:
+                        await self.handle(change)
+                    except Exception as e:
+                        logger.error(f"Error handling change: {e}")
+                    self._record_lag(change)
+
+                # the post-batch token also moves past the changes the
+                # pipeline filtered out, so a quiet stream does not fall behind
+                self._token = stream.resume_token
+                await self._checkpoint()
+
+    def _watch(self) -> Any:
+        return self.collection.watch(self.pipeline(), start_after=self._token)
+
+    def _record_lag(self, change: dict[str, Any]) -> None:
+        self.stats.events += 1
+        cluster_time = change.get("clusterTime")
+        if cluster_time is None:
+            return
+        lag = (datetime.now(UTC) - cluster_time.as_datetime()).total_seconds()
+        self.stats.lag_seconds = lag
+        self.stats.max_lag_seconds = max(self.stats.max_lag_seconds, lag)
+
+    async def _checkpoint(self, force: bool = False) -> None:
+        if self.tokens is None:
+            return
+        try:
+            if await self.tokens.save(self._token, force=force):
+                self.stats.checkpoints += 1
+        except Exception as e:
+            logger.error(f"Error saving resume token: {e}")
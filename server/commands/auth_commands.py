@@ -4,6 +4,7 @@ from server.services.validation_service import ValidationService
 
 
 class SignInCommand(Command):
+    exclusive = True
 
     async def _validate(self) -> None:
         if len(self.context.params) != 1:
@@ -19,10 +20,13 @@ class SignInCommand(Command):
         await self.container.session_service().set(
             peer_id=self.context.peer_id, user_id=self.context.params[0]
         )
+        # a replay of the previous user's backlog must not go on
+        self.container.backlog_service().stop(self.context.peer_id)
         return Response(request_id=self.context.request_id).serialize()
 
 
 class SignOutCommand(Command):
+    exclusive = True
 
     async def _validate(self) -> None:
         pass
@@ -32,6 +36,8 @@ class SignOutCommand(Command):
             self.context.peer_id
         )
         await self.container.session_service().delete(peer_id=self.context.peer_id)
+        if self.context.peer_id is not None:
+            self.container.backlog_service().stop(self.context.peer_id)
         return Response(request_id=self.context.request_id).serialize()
 
 
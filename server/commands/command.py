@@ -1,10 +1,18 @@
 from abc import abstractmethod
-from typing import final
+from collections.abc import AsyncIterator
+from typing import ClassVar, final
 
 from server.commands.command_context import CommandContext
 
 
 class Command:
+    # exclusive commands change the connection's session, so a pipelined
+    # connection runs them alone, after everything sent before them
+    exclusive: ClassVar[bool] = False
+    # streaming commands write their response in chunks as they produce it
+    # and are only started once it is their turn to write
+    streaming: ClassVar[bool] = False
+
     def __init__(self, context: CommandContext):
         self.context = context
         self.container = context.container
@@ -19,8 +27,19 @@ class Command:
         """execution logic to be implemented by derived classes"""
         pass
 
+    async def _stream_impl(self) -> AsyncIterator[str]:
+        """chunked execution, to be overridden by streaming commands"""
+        yield await self._execute_impl()
+
     @final
     async def execute(self) -> str:
         """Final method that executes validation before implementation"""
         await self._validate()
         return await self._execute_impl()
+
+    @final
+    async def execute_stream(self) -> AsyncIterator[str]:
+        """Like execute, but yields the response in chunks"""
+        await self._validate()
+        async for chunk in self._stream_impl():
+            yield chunk
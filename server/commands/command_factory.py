@@ -7,7 +7,18 @@ from server.commands.discussion_commands import (
     CreateDiscussionCommand,
     CreateReplyCommand,
     GetDiscussionCommand,
+    GetDiscussionPageCommand,
+    GetDiscussionSinceCommand,
     ListDiscussionsCommand,
+    ListDiscussionsPageCommand,
+    ListDiscussionsRangeCommand,
+    ListDiscussionsSummaryCommand,
+    NextPageCommand,
+)
+from server.commands.push_commands import (
+    AckBacklogCommand,
+    ReplayBacklogCommand,
+    SetPushFormatCommand,
 )
 
 
@@ -16,10 +27,19 @@ class CommandFactory:
         "SIGN_IN": SignInCommand,
         "SIGN_OUT": SignOutCommand,
         "WHOAMI": WhoAmICommand,
+        "SET_PUSH_FORMAT": SetPushFormatCommand,
+        "REPLAY_BACKLOG": ReplayBacklogCommand,
+        "ACK_BACKLOG": AckBacklogCommand,
         "CREATE_DISCUSSION": CreateDiscussionCommand,
         "CREATE_REPLY": CreateReplyCommand,
         "GET_DISCUSSION": GetDiscussionCommand,
         "LIST_DISCUSSIONS": ListDiscussionsCommand,
+        "LIST_DISCUSSIONS_PAGE": ListDiscussionsPageCommand,
+        "LIST_DISCUSSIONS_RANGE": ListDiscussionsRangeCommand,
+        "LIST_DISCUSSIONS_SUMMARY": ListDiscussionsSummaryCommand,
+        "GET_DISCUSSION_PAGE": GetDiscussionPageCommand,
+        "GET_DISCUSSION_SINCE": GetDiscussionSinceCommand,
+        "NEXT_PAGE": NextPageCommand,
     }
 
     @classmethod
@@ -1,6 +1,18 @@
+from collections.abc import AsyncIterator
+
 from server.commands.command import Command
+from server.di import Container
+from server.entities.discussion import Discussion
+from server.entities.page_cursor import PageCursor, PageKind
 from server.response import Response
+from server.services.cursor_service import CursorService
 from server.services.validation_service import ValidationService
+from server.wire_format import (
+    format_discussion,
+    format_replies,
+    format_reply,
+    format_summary,
+)
 
 
 class CreateDiscussionCommand(Command):
@@ -63,41 +75,212 @@ class GetDiscussionCommand(Command):
             raise ValueError("action requires one parameter")
 
     async def _execute_impl(self) -> str:
-        discussion = await self.container.discussion_service().get_discussion(
+        discussion = await self.container.discussion_service().get_encoded_discussion(
             self.context.params[0]
         )
-        if discussion is None:
-            raise ValueError("Discussion not found")
+        return Response(
+            request_id=self.context.request_id, params=[discussion]
+        ).serialize()
+
+
+class GetDiscussionSinceCommand(Command):
+    """Only the replies a client has not seen, from the given reply index on.
 
-        replies = []
-        for reply in discussion.replies:
-            replies.append(f"{reply.client_id}|{reply.comment}")
+    Responds with the discussion id, the index to pass next time and the
+    new replies.
+    """
+
+    async def _validate(self) -> None:
+        if len(self.context.params) != 2:
+            raise ValueError("action requires two parameters")
+
+        if not self.context.params[1].isdigit():
+            raise ValueError("reply index must be a non-negative integer")
+        self.index = int(self.context.params[1])
+
+    async def _execute_impl(self) -> str:
+        discussion_id = self.context.params[0]
+        (
+            replies,
+            next_index,
+        ) = await self.container.discussion_service().get_replies_since(
+            discussion_id, self.index
+        )
         params = [
-            discussion.discussion_id,
-            f"{discussion.reference_prefix}.{discussion.time_marker}",
-            "(" + ",".join(replies) + ")",
+            discussion_id,
+            str(next_index),
+            "(" + ",".join(format_reply(reply) for reply in replies) + ")",
         ]
         return Response(request_id=self.context.request_id, params=params).serialize()
 
 
 class ListDiscussionsCommand(Command):
+    streaming = True
 
     async def _validate(self) -> None:
         if len(self.context.params) > 1:
             raise ValueError("action can't have more than one parameter")
 
+        self.reference_prefix = None
+        if self.context.params:
+            self.reference_prefix = self.context.params[0]
+            if not ValidationService.validate_alphanumeric(self.reference_prefix):
+                raise ValueError("reference prefix must be alphanumeric")
+
     async def _execute_impl(self) -> str:
-        discussions = await self.container.discussion_service().list_discussions()
+        return "".join([chunk async for chunk in self._stream_impl()])
+
+    def _discussions(self) -> AsyncIterator[Discussion]:
+        return self.container.discussion_service().iter_discussions(
+            reference_prefix=self.reference_prefix,
+            batch_size=self.container.config.list_batch_size(),
+        )
+
+    def _entries(self) -> AsyncIterator[str]:
+        return (
+            format_discussion(discussion) async for discussion in self._discussions()
+        )
+
+    async def _stream_impl(self) -> AsyncIterator[str]:
+        response = Response(request_id=self.context.request_id)
+        async for chunk in response.serialize_list_stream(self._entries()):
+            yield chunk
+
 
-        discussion_list = []
-        for discussion in discussions:
-            replies = []
-            for reply in discussion.replies:
-                replies.append(f"{reply.client_id}|{reply.comment}")
+class ListDiscussionsSummaryCommand(ListDiscussionsCommand):
+    """LIST_DISCUSSIONS with counts and the opening comment instead of replies"""
+
+    def _entries(self) -> AsyncIterator[str]:
+        summaries = self.container.discussion_service().iter_discussion_summaries(
+            reference_prefix=self.reference_prefix,
+            batch_size=self.container.config.list_batch_size(),
+        )
+        return (format_summary(summary) async for summary in summaries)
+
+
+class ListDiscussionsRangeCommand(ListDiscussionsCommand):
+    """Discussions of one video with a time marker in [start, end)"""
+
+    async def _validate(self) -> None:
+        if len(self.context.params) != 3:
+            raise ValueError("action requires three parameters")
 
-            discussion_list.append(
-                f"{discussion.discussion_id}|{discussion.reference_prefix}.{discussion.time_marker}|({','.join(replies)})"
+        self.reference_prefix, start, end = self.context.params
+        if not ValidationService.validate_alphanumeric(self.reference_prefix):
+            raise ValueError("reference prefix must be alphanumeric")
+
+        try:
+            self.time_range = (
+                ValidationService.time_marker_seconds(start),
+                ValidationService.time_marker_seconds(end),
             )
-        return Response(
-            request_id=self.context.request_id, params=discussion_list
-        ).serialize_list()
+        except ValueError:
+            raise ValueError("time range must be two time markers") from None
+
+    def _discussions(self) -> AsyncIterator[Discussion]:
+        return self.container.discussion_service().iter_discussions(
+            reference_prefix=self.reference_prefix,
+            batch_size=self.container.config.list_batch_size(),
+            time_range=self.time_range,
+        )
+
+
+async def _list_discussions_page(
+    container: Container, request_id: str, cursor: PageCursor
+) -> str:
+    after = None
+    if cursor.created_at is not None and cursor.discussion_id is not None:
+        after = (cursor.created_at, cursor.discussion_id)
+    (
+        discussions,
+        next_after,
+    ) = await container.discussion_service().list_discussions_page(
+        cursor.page_size, reference_prefix=cursor.reference_prefix, after=after
+    )
+
+    params = ["(" + ",".join(format_discussion(d) for d in discussions) + ")"]
+    if next_after is not None:
+        cursor.created_at, cursor.discussion_id = next_after
+        params.append(CursorService.encode(cursor))
+    return Response(request_id=request_id, params=params).serialize()
+
+
+async def _get_discussion_page(
+    container: Container, request_id: str, cursor: PageCursor
+) -> str:
+    if cursor.discussion_id is None:
+        raise ValueError("Invalid cursor")
+    discussion, next_offset = await container.discussion_service().get_discussion_page(
+        cursor.discussion_id, cursor.offset, cursor.page_size
+    )
+
+    params = [
+        discussion.discussion_id,
+        f"{discussion.reference_prefix}.{discussion.time_marker}",
+        f"({format_replies(discussion)})",
+    ]
+    if next_offset is not None:
+        cursor.offset = next_offset
+        params.append(CursorService.encode(cursor))
+    return Response(request_id=request_id, params=params).serialize()
+
+
+class ListDiscussionsPageCommand(Command):
+
+    async def _validate(self) -> None:
+        if not 1 <= len(self.context.params) <= 2:
+            raise ValueError("action requires one or two parameters")
+
+        self.page_size = CursorService.parse_page_size(self.context.params[0])
+        self.reference_prefix = None
+        if len(self.context.params) == 2:
+            self.reference_prefix = self.context.params[1]
+            if not ValidationService.validate_alphanumeric(self.reference_prefix):
+                raise ValueError("reference prefix must be alphanumeric")
+
+    async def _execute_impl(self) -> str:
+        cursor = PageCursor(
+            kind=PageKind.DISCUSSIONS,
+            page_size=self.page_size,
+            reference_prefix=self.reference_prefix,
+        )
+        return await _list_discussions_page(
+            self.container, self.context.request_id, cursor
+        )
+
+
+class GetDiscussionPageCommand(Command):
+
+    async def _validate(self) -> None:
+        if len(self.context.params) != 2:
+            raise ValueError("action requires two parameters")
+
+        self.page_size = CursorService.parse_page_size(self.context.params[1])
+
+    async def _execute_impl(self) -> str:
+        cursor = PageCursor(
+            kind=PageKind.REPLIES,
+            page_size=self.page_size,
+            discussion_id=self.context.params[0],
+        )
+        return await _get_discussion_page(
+            self.container, self.context.request_id, cursor
+        )
+
+
+class NextPageCommand(Command):
+
+    async def _validate(self) -> None:
+        if len(self.context.params) != 1:
+            raise ValueError("action requires one parameter")
+
+        self.cursor = CursorService.decode(self.context.params[0])
+
+    async def _execute_impl(self) -> str:
+        if self.cursor.kind is PageKind.DISCUSSIONS:
+            return await _list_discussions_page(
+                self.container, self.context.request_id, self.cursor
+            )
+        return await _get_discussion_page(
+            self.container, self.context.request_id, self.cursor
+        )
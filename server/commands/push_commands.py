@@ -0,0 +1,80 @@
+from server.commands.command import Command
+from server.entities.session import PushFormat
+from server.response import Response
+
+
+class SetPushFormatCommand(Command):
+    """Choose how notifications are pushed to this connection"""
+
+    async def _validate(self) -> None:
+        if len(self.context.params) != 1:
+            raise ValueError("action requires one parameter")
+
+        if self.context.peer_id is None:
+            raise ValueError("peer_id is required")
+
+        try:
+            self.push_format = PushFormat(self.context.params[0])
+        except ValueError:
+            formats = ", ".join(push_format.value for push_format in PushFormat)
+            raise ValueError(f"push format must be one of {formats}") from None
+
+    async def _execute_impl(self) -> str:
+        self.container.session_service().set_push_format(
+            self.context.peer_id, self.push_format  # type: ignore
+        )
+        return Response(request_id=self.context.request_id).serialize()
+
+
+class ReplayBacklogCommand(Command):
+    """Replay the notifications stored while the user was offline.
+
+    Streamed, so the first NOTIFICATION_BACKLOG batch, held back by the
+    outbound buffer like any push, always follows the response.
+    """
+
+    streaming = True
+
+    async def _validate(self) -> None:
+        if self.context.params:
+            raise ValueError("action takes no parameter")
+
+        if self.context.peer_id is None:
+            raise ValueError("peer_id is required")
+
+    async def _execute_impl(self) -> str:
+        user_id = await self.container.session_service().get_client_id(
+            self.context.peer_id
+        )
+        if user_id is None:
+            raise ValueError("sign in to replay the backlog")
+
+        self.container.backlog_service().start(
+            self.context.peer_id, user_id  # type: ignore
+        )
+        return Response(request_id=self.context.request_id).serialize()
+
+
+class AckBacklogCommand(Command):
+    """Acknowledge a NOTIFICATION_BACKLOG batch, marking it as read.
+
+    Streamed like REPLAY_BACKLOG, so the next batch follows the response.
+    """
+
+    streaming = True
+
+    async def _validate(self) -> None:
+        if len(self.context.params) != 1:
+            raise ValueError("action requires one parameter")
+
+        if self.context.peer_id is None:
+            raise ValueError("peer_id is required")
+
+        if not self.context.params[0].isdigit():
+            raise ValueError("batch id must be a number")
+
+    async def _execute_impl(self) -> str:
+        await self.container.backlog_service().acknowledge(
+            self.context.peer_id, int(self.context.params[0])  # type: ignore
+        )
+        return Response(request_id=self.context.request_id).serialize()
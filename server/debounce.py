@@ -0,0 +1,52 @@
+"""Collapsing of repeated pushes for the same recipient and discussion."""
+
+import asyncio
+from collections.abc import Callable
+from dataclasses import dataclass
+
+
+@dataclass
+class DebounceStats:
+    pushes: int = 0
+    collapsed: int = 0
+
+
+class PushDebouncer:
+    """Delivers one push per (recipient, discussion) and ``window`` seconds.
+
+    The first event for a pair opens the window and the push goes out when
+    it closes, so the REPLY and MENTION notifications of one reply, or a
+    burst of replies in a busy thread, reach the recipient as a single
+    ``DISCUSSION_UPDATED``. A window of 0 delivers every event immediately.
+    """
+
+    def __init__(self, deliver: Callable[[str, str], None], window: float) -> None:
+        self.deliver = deliver
+        self.window = window
+        self.stats = DebounceStats()
+        self._pending: dict[tuple[str, str], asyncio.TimerHandle] = {}
+
+    def submit(self, recipient_id: str, discussion_id: str) -> None:
+        key = (recipient_id, discussion_id)
+        if key in self._pending:
+            self.stats.collapsed += 1
+            return
+
+        if self.window <= 0:
+            self._fire(key)
+            return
+
+        self._pending[key] = asyncio.get_running_loop().call_later(
+            self.window, self._fire, key
+        )
+
+    def _fire(self, key: tuple[str, str]) -> None:
+        self._pending.pop(key, None)
+        self.stats.pushes += 1
+        self.deliver(*key)
+
+    def close(self) -> None:
+        """Drop pushes that are still waiting for their window to close"""
+        for handle in self._pending.values():
+            handle.cancel()
+        self._pending.clear()
@@ -5,9 +5,18 @@ from typing import Any, cast
 from dependency_injector import containers, providers
 from motor.motor_asyncio import AsyncIOMotorClient
 
+from server.cache import LruCache
+from server.indexes import IndexManager
+from server.notification_bus import (
+    ChangeStreamNotificationBus,
+    InProcessNotificationBus,
+    NotificationBus,
+)
+from server.services.backlog_service import BacklogService
 from server.services.discussion_service import DiscussionService
 from server.services.notification_service import NotificationService
 from server.services.session_service import SessionService
+from server.wire_format import EncodedDiscussion, encoded_size
 
 
 class Container(containers.DeclarativeContainer):
@@ -17,6 +26,49 @@ class Container(containers.DeclarativeContainer):
         default={
             "mongo_uri": "mongodb://localhost:27017",
             "db_name": "test_db",
+            # commands a single connection may run concurrently
+            "max_in_flight": 1,
+            # write responses in request order instead of as they complete
+            "ordered_responses": True,
+            # pushes queued per connection before push_overflow applies
+            "max_pushes": 256,
+            # drop_oldest, coalesce or disconnect
+            "push_overflow": "drop_oldest",
+            # refuse to start when a hot query is planned as a collection
+            # scan, instead of logging an error
+            "strict_query_plans": False,
+            # change_stream delivers pushes across nodes through a replica
+            # set; in_process serves a single node without one
+            "notification_bus": "change_stream",
+            # identifies this process; defaults to hostname:port
+            "node_id": None,
+            # seconds between two saves of a change stream resume token
+            "checkpoint_interval": 1.0,
+            # seconds during which pushes for one recipient and discussion
+            # are collapsed into one
+            "push_debounce_window": 0.05,
+            # discussions fetched per cursor batch when streaming a list
+            "list_batch_size": 100,
+            # notification events waiting to be written before CREATE_REPLY
+            # waits for room
+            "notification_queue_size": 1000,
+            # seconds after which notifications expire, read or not; 0 keeps
+            # them until they are read
+            "notification_ttl": 30 * 24 * 3600,
+            # seconds between two merges of the notifications of each
+            # recipient and discussion; 0 disables them
+            "notification_compaction_interval": 3600.0,
+            # participants to notify from which a thread switches from one
+            # notification per participant to one event per reply
+            "fanout_on_read_participants": 500,
+            # discussions per NOTIFICATION_BACKLOG batch of a REPLAY_BACKLOG
+            "backlog_batch_size": 50,
+            # seconds between two log lines of the outbound, push, cache and
+            # change stream counters; 0 disables them
+            "stats_log_interval": 60.0,
+            # bounds of the GET_DISCUSSION cache; 0 entries disables it
+            "discussion_cache_entries": 10_000,
+            "discussion_cache_bytes": 64 * 1024 * 1024,
         }
     )
 
@@ -32,12 +84,54 @@ class Container(containers.DeclarativeContainer):
         lambda client, db_name: client[db_name], mongo_client, config.db_name
     )
 
-    notification_service = providers.Singleton(NotificationService, db)
+    index_manager = providers.Singleton(
+        IndexManager, db, strict=config.strict_query_plans
+    )
 
     session_service = providers.Singleton(SessionService, db)
 
+    notification_bus = cast(
+        providers.Provider[NotificationBus],
+        providers.Selector(
+            config.notification_bus,
+            change_stream=providers.Singleton(
+                ChangeStreamNotificationBus,
+                db,
+                session_service,
+                config.checkpoint_interval,
+            ),
+            in_process=providers.Singleton(InProcessNotificationBus),
+        ),
+    )
+
+    notification_service = providers.Singleton(
+        NotificationService,
+        db,
+        bus=notification_bus,
+        queue_size=config.notification_queue_size,
+        ttl=config.notification_ttl,
+    )
+
+    backlog_service = providers.Singleton(
+        BacklogService,
+        notification_service,
+        batch_size=config.backlog_batch_size,
+    )
+
+    discussion_cache = cast(
+        providers.Provider[LruCache[str, EncodedDiscussion]],
+        providers.Singleton(
+            LruCache,
+            config.discussion_cache_entries,
+            config.discussion_cache_bytes,
+            sizeof=encoded_size,
+        ),
+    )
+
     discussion_service = providers.Singleton(
         DiscussionService,
         db,
         notification_service=notification_service,
+        cache=discussion_cache,
+        fanout_on_read_participants=config.fanout_on_read_participants,
     )
@@ -0,0 +1,61 @@
+"""Cross-node invalidation of the discussion cache."""
+
+from typing import Any
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from server.cache import LruCache
+from server.change_stream import ChangeStreamWatcher
+from server.wire_format import EncodedDiscussion
+
+# every write to a discussion, including a reply, updates its document
+DISCUSSION_CHANGES: list[dict[str, Any]] = [
+    {"$match": {"operationType": {"$in": ["update", "replace"]}}},
+    {
+        "$project": {
+            "clusterTime": 1,
+            "fullDocument.discussion_id": 1,
+            "fullDocument.reply_count": 1,
+        }
+    },
+]
+
+
+class DiscussionCacheInvalidator(ChangeStreamWatcher):
+    """Evicts cached discussions as any node changes them.
+
+    Update events only carry the ObjectId of the document, so the stream
+    looks up the discussion_id of the changed document. An entry that
+    already holds every reply of the document, such as one this node
+    appended to, is kept. The stream starts from the current time, as the
+    cache starts out empty, and drops the whole cache if it ever loses
+    events.
+    """
+
+    def __init__(
+        self,
+        discussions: AsyncIOMotorCollection[Any],
+        cache: LruCache[str, EncodedDiscussion],
+    ) -> None:
+        super().__init__(
+            discussions, self._invalidate, None, pipeline=lambda: DISCUSSION_CHANGES
+        )
+        self.cache = cache
+
+    async def _invalidate(self, change: dict[str, Any]) -> None:
+        # None when the discussion was deleted before the lookup
+        document = change.get("fullDocument")
+        if document is None:
+            return
+        cached = self.cache.peek(document["discussion_id"])
+        if cached is not None and cached.reply_count < document.get("reply_count", 0):
+            self.cache.invalidate(document["discussion_id"])
+
+    def _watch(self) -> Any:
+        return self.collection.watch(
+            self.pipeline(), start_after=self._token, full_document="updateLookup"
+        )
+
+    def _history_lost(self) -> None:
+        super()._history_lost()
+        self.cache.clear()
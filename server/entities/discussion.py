@@ -7,6 +7,8 @@ class Reply:
     client_id: str
     comment: str
     created_at: datetime
+    # position in the discussion, the opening comment being 0
+    index: int = 0
 
 
 @dataclass
@@ -17,3 +19,15 @@ class Discussion:
     client_id: str
     created_at: datetime
     replies: list[Reply]
+    # replies in the whole discussion, which may be more than were loaded
+    reply_count: int = 0
+
+
+@dataclass
+class DiscussionSummary:
+    discussion_id: str
+    reference_prefix: str
+    time_marker: str
+    reply_count: int
+    last_activity_at: datetime
+    first_comment: str
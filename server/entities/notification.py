@@ -2,6 +2,8 @@ from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
 
+from server.entities.discussion import Reply
+
 
 class NotificationType(Enum):
     REPLY = "reply"
@@ -15,3 +17,19 @@ class Notification:
     sender_id: str
     notification_type: NotificationType
     created_at: datetime
+    # the reply that caused the notification
+    reply: Reply | None = None
+    # notifications merged into this one by compaction, itself included
+    count: int = 1
+
+
+@dataclass
+class BacklogEntry:
+    """The stored notifications of one recipient and discussion, collapsed"""
+
+    discussion_id: str
+    # MENTION if any of them is one
+    notification_type: NotificationType
+    count: int
+    # index of the newest reply among them, -1 if none has one
+    read_index: int = -1
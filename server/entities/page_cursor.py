@@ -0,0 +1,20 @@
+from dataclasses import dataclass
+from datetime import datetime
+from enum import Enum
+
+
+class PageKind(Enum):
+    DISCUSSIONS = "discussions"
+    REPLIES = "replies"
+
+
+@dataclass
+class PageCursor:
+    kind: PageKind
+    page_size: int
+    # discussions: optional filter, resume after (created_at, discussion_id)
+    reference_prefix: str | None = None
+    created_at: datetime | None = None
+    # replies: the discussion and the position of the first reply to return
+    discussion_id: str | None = None
+    offset: int = 0
@@ -1,5 +1,13 @@
 from dataclasses import dataclass
 from datetime import datetime
+from enum import Enum
+
+
+class PushFormat(Enum):
+    # DISCUSSION_UPDATED|<discussion_id>
+    BASIC = "basic"
+    # DISCUSSION_REPLY|<discussion_id>|<index>|<client_id>|<comment>
+    RICH = "rich"
 
 
 @dataclass
@@ -0,0 +1,132 @@
+"""Index bootstrap and query-plan checks for the collections of the services."""
+
+import logging
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from typing import Any, Protocol
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# create_index error for an existing index with other options
+INDEX_OPTIONS_CONFLICT = 85
+
+
+@dataclass
+class IndexSpec:
+    collection: str
+    keys: list[tuple[str, int]]
+    # passed to create_index, e.g. unique or expireAfterSeconds
+    options: dict[str, Any] = field(default_factory=dict)
+    # no longer wanted: dropped if it exists, by the name in options
+    drop: bool = False
+
+
+@dataclass
+class QueryShape:
+    """A query run on a hot path, which must be served by an index"""
+
+    collection: str
+    filter: dict[str, Any]
+    sort: list[tuple[str, int]] | None = None
+
+
+class IndexedService(Protocol):
+    def indexes(self) -> list[IndexSpec]: ...
+
+    def hot_queries(self) -> list[QueryShape]: ...
+
+
+class IndexManager:
+    """Builds the indexes services declare and checks their queries use them.
+
+    ``bootstrap`` creates every missing index, updates the expiry of a TTL
+    index whose ttl changed, drops the indexes declared as dropped, then
+    explains each hot query. A query planned
+    as a collection scan is logged as an error, or stops the startup when
+    ``strict``. Queries the server cannot explain, as with mongomock, only
+    get a warning.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase[Any], strict: bool = False) -> None:
+        self.db = db
+        self.strict = strict
+
+    async def bootstrap(self, services: Iterable[IndexedService]) -> None:
+        services = list(services)
+        for service in services:
+            for index in service.indexes():
+                await self.ensure(index)
+
+        scans = [
+            query
+            for service in services
+            for query in service.hot_queries()
+            if await self.scans_collection(query)
+        ]
+        if not scans:
+            return
+
+        shapes = "; ".join(f"{query.collection} {query.filter}" for query in scans)
+        message = f"Queries planned as collection scans: {shapes}"
+        if self.strict:
+            raise RuntimeError(message)
+        logger.error(message)
+
+    async def ensure(self, index: IndexSpec) -> None:
+        """Create the index, or update its expiry if only that changed"""
+        collection = self.db[index.collection]
+        if index.drop:
+            if index.options["name"] in await collection.index_information():
+                await collection.drop_index(index.options["name"])
+            return
+        try:
+            await collection.create_index(index.keys, **index.options)
+        except OperationFailure as e:
+            if (
+                e.code != INDEX_OPTIONS_CONFLICT
+                or "expireAfterSeconds" not in index.options
+            ):
+                raise
+            await self.db.command(
+                "collMod",
+                index.collection,
+                index={
+                    "keyPattern": dict(index.keys),
+                    "expireAfterSeconds": index.options["expireAfterSeconds"],
+                },
+            )
+
+    async def scans_collection(self, query: QueryShape) -> bool:
+        explain = await self._explain(query)
+        if explain is None:
+            return False
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        return "COLLSCAN" in _stages(winning_plan)
+
+    async def _explain(self, query: QueryShape) -> dict[str, Any] | None:
+        cursor = self.db[query.collection].find(query.filter)
+        if query.sort:
+            cursor = cursor.sort(query.sort)
+        try:
+            explain: dict[str, Any] = await cursor.explain()
+        except Exception as e:
+            logger.warning(
+                "Cannot check the plan of %s %s: %s", query.collection, query.filter, e
+            )
+            return None
+        return explain
+
+
+def _stages(plan: Any) -> Iterator[str]:
+    """Every stage name of a plan, including those of nested input stages"""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _stages(item)
@@ -0,0 +1,161 @@
+"""Delivery of written notifications to the nodes that push them."""
+
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Any, ClassVar, Protocol
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from server.change_stream import ChangeStreamWatcher, ResumeTokenStore
+from server.services.session_service import SessionService
+
+
+class NotificationSubscriber(Protocol):
+    def deliver(self, notification: dict[str, Any]) -> None: ...
+
+    async def deliver_discussion_event(self, event: dict[str, Any]) -> None: ...
+
+
+class NotificationBus(ABC):
+    """Hands notifications and discussion events to the subscriber of each node.
+
+    ``NotificationService`` publishes every document as it queues it for
+    writing, and ``run`` feeds the subscriber until it is cancelled.
+    ``distributed`` tells whether other nodes see what this node writes.
+    """
+
+    distributed: ClassVar[bool]
+
+    @abstractmethod
+    async def publish_notifications(self, notifications: list[dict[str, Any]]) -> None:
+        pass
+
+    @abstractmethod
+    async def publish_discussion_events(self, events: list[dict[str, Any]]) -> None:
+        pass
+
+    @abstractmethod
+    async def run(self, subscriber: NotificationSubscriber, node_id: str) -> None:
+        pass
+
+    def stats(self) -> dict[str, Any]:
+        """Counters of the delivery machinery, by component"""
+        return {}
+
+
+class InProcessNotificationBus(NotificationBus):
+    """Dispatches published documents straight to this process's subscriber.
+
+    Only valid when every client connects to this one node, but it needs
+    no replica set and adds no database round trip to a push.
+    """
+
+    distributed = False
+
+    def __init__(self) -> None:
+        self._subscriber: NotificationSubscriber | None = None
+        self._deliveries: set[asyncio.Task[None]] = set()
+
+    async def publish_notifications(self, notifications: list[dict[str, Any]]) -> None:
+        if self._subscriber is None:
+            return
+        for notification in notifications:
+            self._subscriber.deliver(notification)
+
+    async def publish_discussion_events(self, events: list[dict[str, Any]]) -> None:
+        if self._subscriber is None:
+            return
+        # looking up the participants must not hold up the publisher
+        for event in events:
+            task = asyncio.create_task(self._subscriber.deliver_discussion_event(event))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    async def run(self, subscriber: NotificationSubscriber, node_id: str) -> None:
+        self._subscriber = subscriber
+        try:
+            await asyncio.Event().wait()
+        finally:
+            self._subscriber = None
+
+
+class ChangeStreamNotificationBus(NotificationBus):
+    """Picks the written documents up from change streams, on every node.
+
+    The notification stream only matches the users signed in on this node
+    and is restarted whenever that set changes.
+    """
+
+    distributed = True
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase[Any],
+        session_service: SessionService,
+        checkpoint_interval: float = 1.0,
+    ) -> None:
+        self.db = db
+        self.session_service = session_service
+        self.checkpoint_interval = checkpoint_interval
+        self.notification_watcher: ChangeStreamWatcher | None = None
+        self.discussion_event_watcher: ChangeStreamWatcher | None = None
+
+    async def publish_notifications(self, notifications: list[dict[str, Any]]) -> None:
+        # every node reads them back from the stream once written
+        pass
+
+    async def publish_discussion_events(self, events: list[dict[str, Any]]) -> None:
+        pass
+
+    def _notification_pipeline(self) -> list[dict[str, Any]]:
+        """Only watch notifications for users connected to this node"""
+        recipient_ids = sorted(self.session_service.get_present_user_ids())
+        return [
+            {
+                "$match": {
+                    "operationType": "insert",
+                    "fullDocument.recipient_id": {"$in": recipient_ids},
+                }
+            }
+        ]
+
+    async def run(self, subscriber: NotificationSubscriber, node_id: str) -> None:
+        async def deliver(change: dict[str, Any]) -> None:
+            subscriber.deliver(change["fullDocument"])
+
+        async def deliver_discussion_event(change: dict[str, Any]) -> None:
+            await subscriber.deliver_discussion_event(change["fullDocument"])
+
+        self.notification_watcher = ChangeStreamWatcher(
+            self.db.notifications,
+            deliver,
+            self._tokens(f"notifications:{node_id}"),
+            pipeline=self._notification_pipeline,
+        )
+        self.session_service.add_presence_listener(self.notification_watcher.restart)
+        # replies to threads that are notified on read
+        self.discussion_event_watcher = ChangeStreamWatcher(
+            self.db.discussion_events,
+            deliver_discussion_event,
+            self._tokens(f"discussion_events:{node_id}"),
+            pipeline=lambda: [{"$match": {"operationType": "insert"}}],
+        )
+        await asyncio.gather(
+            self.notification_watcher.run(), self.discussion_event_watcher.run()
+        )
+
+    def stats(self) -> dict[str, Any]:
+        watchers = {
+            "notification_stream": self.notification_watcher,
+            "discussion_event_stream": self.discussion_event_watcher,
+        }
+        return {
+            name: watcher.stats
+            for name, watcher in watchers.items()
+            if watcher is not None
+        }
+
+    def _tokens(self, consumer_id: str) -> ResumeTokenStore:
+        return ResumeTokenStore(
+            self.db.change_stream_checkpoints, consumer_id, self.checkpoint_interval
+        )
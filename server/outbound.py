@@ -0,0 +1,199 @@
+"""Per-connection outbound queues for client connections."""
+
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST = "drop_oldest"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
+
+
+@dataclass
+class OutboundStats:
+    messages: int = 0
+    bytes: int = 0
+    flushes: int = 0
+    dropped: int = 0
+    coalesced: int = 0
+    disconnects: int = 0
+
+
+class OutboundBuffer:
+    """Outbound queue of one connection, drained by its own writer task.
+
+    Everything queued while the writer task is waiting (at least one
+    event-loop tick) is joined and handed to the transport with a single
+    ``write``. Responses are never dropped and ``send`` applies backpressure
+    to the command pipeline. Pushes are fire-and-forget: at most
+    ``max_pushes`` of them wait in the queue, and ``overflow`` decides what
+    happens to a push that does not fit, so a slow reader never blocks the
+    code that fans notifications out. Notices are unsolicited messages the
+    client has to answer, so unlike pushes they are never dropped. Between
+    ``begin_response`` and ``end_response`` a response is written in
+    several chunks, so pushes and notices are held back until its last
+    chunk is queued.
+    """
+
+    def __init__(
+        self,
+        writer: asyncio.StreamWriter,
+        stats: OutboundStats | None = None,
+        max_pushes: int = 256,
+        overflow: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+    ) -> None:
+        if max_pushes < 1:
+            raise ValueError("max_pushes must be at least 1")
+
+        self.writer = writer
+        self.stats = stats if stats is not None else OutboundStats()
+        self.max_pushes = max_pushes
+        self.overflow = overflow
+        # (message, is_push) in the order they go out
+        self._pending: deque[tuple[str, bool]] = deque()
+        self._queued_pushes = 0
+        # (message, is_push) held back while a chunked response is written
+        self._held: deque[tuple[str, bool]] = deque()
+        self._response_open = False
+        self._ready = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._closed = False
+        self._error: Exception | None = None
+        self._writer_task = asyncio.create_task(self._write_pending())
+
+    def write(self, message: str) -> None:
+        """Queue a message that must not be dropped"""
+        if self._closed:
+            return
+        self._pending.append((message, False))
+        self._ready.set()
+
+    async def send(self, message: str) -> None:
+        """Queue a response and wait while the transport is over its high-water mark"""
+        if self._error is not None:
+            raise self._error
+        self.write(message)
+        await self._writable.wait()
+        if self._error is not None:
+            raise self._error
+
+    def push(self, message: str) -> bool:
+        """Queue a push without waiting; returns False if it was not queued"""
+        if self._closed:
+            return False
+
+        if self._queued_pushes >= self.max_pushes and not self._make_room(message):
+            return False
+
+        self._queued_pushes += 1
+        self._queue_unsolicited(message, True)
+        return True
+
+    def notice(self, message: str) -> None:
+        """Queue an unsolicited message that must not be dropped, like a push"""
+        if self._closed:
+            return
+        self._queue_unsolicited(message, False)
+
+    def _queue_unsolicited(self, message: str, is_push: bool) -> None:
+        if self._response_open:
+            self._held.append((message, is_push))
+            return
+        self._pending.append((message, is_push))
+        self._ready.set()
+
+    def begin_response(self) -> None:
+        """Hold pushes and notices back until end_response, as a response is
+        written in chunks
+        """
+        self._response_open = True
+
+    def end_response(self) -> None:
+        """Queue what was held back behind the last chunk of the response"""
+        self._response_open = False
+        self._pending.extend(self._held)
+        self._held.clear()
+        self._ready.set()
+
+    def _make_room(self, message: str) -> bool:
+        if self.overflow is OverflowPolicy.DISCONNECT:
+            logger.warning("Disconnecting slow consumer")
+            self.stats.disconnects += 1
+            self.abort()
+            return False
+
+        if self.overflow is OverflowPolicy.COALESCE and (
+            (message, True) in self._pending or (message, True) in self._held
+        ):
+            self.stats.coalesced += 1
+            return False
+
+        if not _drop_first_push(self._pending):
+            # every queued push is held back behind the open response
+            _drop_first_push(self._held)
+        self._queued_pushes -= 1
+        self.stats.dropped += 1
+        return True
+
+    async def _write_pending(self) -> None:
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                self.flush()
+
+                self._writable.clear()
+                try:
+                    await self.writer.drain()
+                finally:
+                    self._writable.set()
+        except Exception as e:
+            self._error = e
+            logger.info("Outbound writer stopped: %s", e)
+
+    def flush(self) -> None:
+        """Write everything queued so far with a single transport write"""
+        if not self._pending:
+            return
+
+        data = "".join(message for message, _ in self._pending).encode()
+        self.stats.messages += len(self._pending)
+        self.stats.bytes += len(data)
+        self.stats.flushes += 1
+        self._pending.clear()
+        self._queued_pushes = sum(is_push for _, is_push in self._held)
+        self.writer.write(data)
+
+    def close(self) -> None:
+        """Flush what is left and close the underlying writer"""
+        if self._closed:
+            return
+        self._closed = True
+        self._writer_task.cancel()
+        self.end_response()
+        self.flush()
+        self.writer.close()
+
+    def abort(self) -> None:
+        """Drop the connection without flushing, e.g. for a stalled reader"""
+        self._closed = True
+        self._writer_task.cancel()
+        self._pending.clear()
+        self._held.clear()
+        self._queued_pushes = 0
+        self.writer.transport.abort()
+
+
+def _drop_first_push(queue: deque[tuple[str, bool]]) -> bool:
+    for index, (_, is_push) in enumerate(queue):
+        if is_push:
+            del queue[index]
+            return True
+    return False
@@ -0,0 +1,216 @@
+"""Pipelined command execution for a single client connection."""
+
+import asyncio
+import logging
+from typing import Any
+
+from server.commands.command import Command
+from server.commands.command_context import CommandContext
+from server.commands.command_factory import CommandFactory
+from server.di import Container
+from server.outbound import OutboundBuffer
+
+logger = logging.getLogger(__name__)
+
+
+class CommandPipeline:
+    """Runs up to ``max_in_flight`` commands of one connection concurrently.
+
+    In ordered mode responses are written in request order. With
+    ``ordered=False`` each response is written as soon as its command
+    completes; every response line starts with its request_id, so clients can
+    match them up. Exclusive commands (SIGN_IN, SIGN_OUT) wait for everything
+    in flight and block the commands behind them, since those depend on the
+    session they change. Streaming commands (LIST_DISCUSSIONS) are started
+    only once their response is due, so their chunks never interleave with
+    other responses and are written with backpressure; pushes are held
+    back by the outbound buffer until the last chunk is queued.
+    """
+
+    def __init__(
+        self,
+        container: Container,
+        peer_id: str,
+        outbound: OutboundBuffer,
+        max_in_flight: int = 1,
+        ordered: bool = True,
+    ) -> None:
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        self.container = container
+        self.peer_id = peer_id
+        self.outbound = outbound
+        self.ordered = ordered
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._executing: set[asyncio.Future[Any]] = set()
+        # ordered mode: the pending response of every command, in request
+        # order; streaming commands are queued as is and run when due
+        self._responses: asyncio.Queue[asyncio.Future[str] | Command | None] = (
+            asyncio.Queue()
+        )
+        self._write_lock = asyncio.Lock()
+        self._reading: asyncio.Task[None] | None = None
+        self._error: Exception | None = None
+
+    async def serve(self, reader: asyncio.StreamReader) -> None:
+        """Read and run commands until EOF; re-raise the first command error"""
+        responder = (
+            asyncio.create_task(self._write_in_order()) if self.ordered else None
+        )
+        self._reading = asyncio.create_task(self._read_commands(reader))
+        try:
+            try:
+                await self._reading
+            except asyncio.CancelledError:
+                if self._error is None:
+                    raise
+
+            if self._error is None:
+                if responder is not None:
+                    self._responses.put_nowait(None)
+                    await responder
+                elif self._executing:
+                    await asyncio.wait(self._executing)
+        finally:
+            await self._finish(responder)
+
+        if self._error is not None:
+            raise self._error
+
+    async def _finish(self, responder: asyncio.Task[None] | None) -> None:
+        """Stop reading and writing, and wait for the commands still running.
+
+        A command cancelled halfway may leave its writes half done, such as
+        a reply counted but not stored, so every command already started
+        runs to completion and only its response is discarded. Streaming
+        commands still waiting for their turn have not started and are
+        dropped.
+        """
+        for task in (self._reading, responder):
+            if task is not None and not task.done():
+                task.cancel()
+
+        settled: list[asyncio.Future[Any]] = []
+        while not self._responses.empty():
+            queued = self._responses.get_nowait()
+            if isinstance(queued, asyncio.Future) and queued.done():
+                settled.append(queued)
+        running = [*self._executing]
+        if running:
+            await asyncio.wait(running)
+
+        for future in settled + running:
+            if not future.cancelled():
+                future.exception()  # already reported through self._error
+
+    async def _read_commands(self, reader: asyncio.StreamReader) -> None:
+        while True:
+            data = await reader.readline()
+            if not data:
+                return
+
+            await self._slots.acquire()
+            try:
+                command = self._parse(data)
+            except Exception as e:
+                self._submit_error(e)
+                continue
+
+            if command.exclusive:
+                await self._wait_for_earlier_commands()
+
+            task = self._submit(command)
+            if command.exclusive and task is not None:
+                await asyncio.wait({task})
+
+    def _parse(self, data: bytes) -> Command:
+        context = CommandContext.from_line(self.container, data.decode(), self.peer_id)
+        return CommandFactory.create_command(context)
+
+    async def _wait_for_earlier_commands(self) -> None:
+        if self.ordered:
+            await self._responses.join()
+        elif self._executing:
+            await asyncio.wait(self._executing)
+
+    def _submit(self, command: Command) -> asyncio.Future[Any] | None:
+        task: asyncio.Future[Any]
+        if self.ordered and command.streaming:
+            self._responses.put_nowait(command)
+            return None
+
+        if self.ordered:
+            task = asyncio.create_task(command.execute())
+            self._responses.put_nowait(task)
+        else:
+            task = asyncio.create_task(self._run_unordered(command))
+
+        self._executing.add(task)
+        task.add_done_callback(self._executing.discard)
+        return task
+
+    def _submit_error(self, error: Exception) -> None:
+        if not self.ordered:
+            self._fail(error)
+            return
+
+        failed: asyncio.Future[str] = asyncio.get_running_loop().create_future()
+        failed.set_exception(error)
+        self._responses.put_nowait(failed)
+
+    async def _write_in_order(self) -> None:
+        while True:
+            response = await self._responses.get()
+            if response is None:
+                return
+
+            try:
+                if isinstance(response, Command):
+                    await self._stream(response)
+                else:
+                    await self._send(await response)
+            except Exception as e:
+                self._fail(e)
+                return
+
+            self._slots.release()
+            self._responses.task_done()
+
+    async def _run_unordered(self, command: Command) -> None:
+        try:
+            if command.streaming:
+                # a streamed response must not interleave with other responses
+                async with self._write_lock:
+                    if self._error is None:
+                        await self._stream(command)
+            else:
+                response = await command.execute()
+                async with self._write_lock:
+                    if self._error is None:
+                        await self._send(response)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._slots.release()
+
+    async def _stream(self, command: Command) -> None:
+        # pushes must not land between the chunks of the response
+        self.outbound.begin_response()
+        try:
+            async for chunk in command.execute_stream():
+                await self._send(chunk)
+        finally:
+            self.outbound.end_response()
+
+    async def _send(self, response: str) -> None:
+        logger.info("response: %s", response)
+        await self.outbound.send(response)
+
+    def _fail(self, error: Exception) -> None:
+        if self._error is not None:
+            return
+
+        self._error = error
+        if self._reading is not None:
+            self._reading.cancel()
@@ -1,3 +1,5 @@
+from collections.abc import AsyncIterator
+
 from server.services.validation_service import ValidationService
 
 INVALID_REQUEST_ID = "Invalid request_id. Must be 7 lowercase letters (a-z)"
@@ -25,3 +27,17 @@ class Response:
             raise ValueError(INVALID_REQUEST_ID)
 
         return self.request_id + "|(" + ",".join(self.params) + ")\n"
+
+    async def serialize_list_stream(
+        self, params: AsyncIterator[str]
+    ) -> AsyncIterator[str]:
+        """serialize_list for params that are produced one at a time"""
+        if not ValidationService.validate_request_id(self.request_id):
+            raise ValueError(INVALID_REQUEST_ID)
+
+        separator = ""
+        yield self.request_id + "|("
+        async for param in params:
+            yield separator + param
+            separator = ","
+        yield ")\n"
@@ -2,10 +2,18 @@
 
 import asyncio
 import logging
+import socket
+from dataclasses import asdict
+from typing import Any
 
-from server.commands.command_context import CommandContext
-from server.commands.command_factory import CommandFactory
+from server.debounce import PushDebouncer
 from server.di import Container
+from server.discussion_cache import DiscussionCacheInvalidator
+from server.entities.discussion import Reply
+from server.entities.session import PushFormat
+from server.outbound import OutboundBuffer, OutboundStats, OverflowPolicy
+from server.pipeline import CommandPipeline
+from server.wire_format import format_reply_push
 
 logger = logging.getLogger(__name__)
 
@@ -21,61 +29,179 @@ class Server:
     ) -> None:
         self.host = host
         self.port = port
-        self._notification_task: asyncio.Task[None] | None = None
-        self._peer_writers: dict[str, asyncio.StreamWriter] = {}
+        self._watcher_tasks: list[asyncio.Task[None]] = []
+        self._peer_buffers: dict[str, OutboundBuffer] = {}
+        self.outbound_stats = OutboundStats()
 
         self.container = container
+        self.max_in_flight: int = self.container.config.max_in_flight()
+        self.ordered_responses: bool = self.container.config.ordered_responses()
+        self.max_pushes: int = self.container.config.max_pushes()
+        self.push_overflow = OverflowPolicy(self.container.config.push_overflow())
         self.session_service = self.container.session_service()
         self.notification_service = self.container.notification_service()
+        self.backlog_service = self.container.backlog_service()
+        self.discussion_service = self.container.discussion_service()
         self.mongo_client = self.container.mongo_client()
-        self.db = self.mongo_client
+        self.db = self.container.db()
 
-    async def _watch_notifications(self) -> None:
-        """Single watcher for all notifications"""
+        self.node_id: str = (
+            self.container.config.node_id() or f"{socket.gethostname()}:{self.port}"
+        )
+        self.notification_bus = self.container.notification_bus()
+        # invalidation lag is tracked by discussion_cache_invalidator.stats
+        self.discussion_cache = self.container.discussion_cache()
+        self.discussion_cache_invalidator = DiscussionCacheInvalidator(
+            self.db.discussions, self.discussion_cache
+        )
+        # replies to push to rich-format connections once the debounce window
+        # closes; None when a notification without its reply came in
+        self._pending_replies: dict[tuple[str, str], dict[int, Reply] | None] = {}
+        # pending pushes that include replies of threads notified on read
+        self._pending_events: set[tuple[str, str]] = set()
+        self._delivery_marks: set[asyncio.Task[None]] = set()
+        self.push_debouncer = PushDebouncer(
+            self._push_discussion_updated,
+            self.container.config.push_debounce_window(),
+        )
+        self.compaction_interval: float = (
+            self.container.config.notification_compaction_interval()
+        )
+        self.stats_log_interval: float = self.container.config.stats_log_interval()
+
+    async def deliver_discussion_event(self, event: dict[str, Any]) -> None:
+        """Push a reply to the local users taking part in its thread"""
+        present = self.session_service.get_present_user_ids()
+        if not present:
+            return
+        participants = await self.discussion_service.get_participants_among(
+            event["discussion_id"], present
+        )
+        for recipient_id in sorted(participants - {event["sender_id"]}):
+            self._pending_events.add((recipient_id, event["discussion_id"]))
+            self.deliver(
+                {
+                    "recipient_id": recipient_id,
+                    "discussion_id": event["discussion_id"],
+                    "reply": event["reply"],
+                }
+            )
+
+    def deliver(self, notification: dict[str, Any]) -> None:
+        """Push a notification to its recipient, if connected to this node"""
+        logger.info(f"notification: {notification}")
+        key = (notification["recipient_id"], notification["discussion_id"])
+        replies = self._pending_replies.setdefault(key, {})
+        if replies is not None:
+            if "reply" in notification:
+                reply = Reply(**notification["reply"])
+                # the REPLY and MENTION notifications of one reply share it
+                replies[reply.index] = reply
+            else:
+                self._pending_replies[key] = None
+        self.push_debouncer.submit(*key)
+
+    def _push_discussion_updated(self, recipient_id: str, discussion_id: str) -> None:
+        """Push an update to every local connection of the recipient"""
+        replies = self._pending_replies.pop((recipient_id, discussion_id), None)
+        fanout_on_read = (recipient_id, discussion_id) in self._pending_events
+        self._pending_events.discard((recipient_id, discussion_id))
+        peer_ids = self.session_service.get_peer_ids(recipient_id)
+        if not peer_ids:
+            logger.info(f"User is offline: {recipient_id}")
+            return
+
+        basic = f"DISCUSSION_UPDATED|{discussion_id}\n"
+        rich = basic
+        if replies:
+            rich = "".join(
+                format_reply_push(discussion_id, replies[index])
+                for index in sorted(replies)
+            )
+        delivered = False
+        for peer_id in peer_ids:
+            peer_buffer = self._peer_buffers.get(peer_id)
+            if peer_buffer is None:
+                logger.info(f"User is offline: {peer_id}")
+                continue
+            push_format = self.session_service.get_push_format(peer_id)
+            message = rich if push_format is PushFormat.RICH else basic
+            logger.info(f"Notification sending to {peer_id}: {message}")
+            if peer_buffer.push(message):
+                logger.info(f"Notification queued for {peer_id}")
+                delivered = True
+
+        if delivered:
+            # the backlog replayed on the next sign-in leaves them out
+            task = asyncio.create_task(
+                self._mark_delivered(
+                    recipient_id,
+                    discussion_id,
+                    max(replies) if replies else None,
+                    fanout_on_read,
+                )
+            )
+            self._delivery_marks.add(task)
+            task.add_done_callback(self._delivery_marks.discard)
+
+    async def _mark_delivered(
+        self,
+        recipient_id: str,
+        discussion_id: str,
+        read_index: int | None,
+        fanout_on_read: bool,
+    ) -> None:
         try:
-            logger.info("watching notifications")
-            collection = self.db.notifications
-            async with collection.watch(
-                [{"$match": {"operationType": "insert"}}]
-            ) as stream:
-                async for change in stream:
-                    try:
-                        notification = change["fullDocument"]
-                        logger.info(f"notification: {notification}")
-                        recipient_id = notification["recipient_id"]
-                        peer_id = await self.session_service.get_by_user_id(
-                            recipient_id
-                        )
-                        if peer_id is None:
-                            logger.info(f"User is offline: {recipient_id}")
-                            continue
-                        peer_writer = self._peer_writers.get(peer_id)
-                        if peer_writer is None:
-                            logger.info(f"User is offline: {peer_id}")
-                            continue
-                        message = (
-                            f"DISCUSSION_UPDATED|{notification['discussion_id']}\n"
-                        )
-                        logger.info(f"Notification sending to {peer_id}: {message}")
-                        peer_writer.write(message.encode())
-                        logger.info(f"Notification sent to {peer_id}")
-                        await peer_writer.drain()
-                    except Exception as e:
-                        logger.error(f"Error sending notification: {e}")
+            await self.notification_service.mark_delivered(
+                recipient_id, discussion_id, read_index, fanout_on_read
+            )
         except Exception as e:
-            logger.error(f"Error watching notifications: {e}")
+            logger.error("Error marking notifications as delivered: %s", e)
 
     async def _send_to_peer(self, peer_id: str, message: str) -> None:
         """Send a message to a specific peer if they are connected."""
-        peer_writer = self._peer_writers.get(peer_id)
-        if peer_writer is None:
+        peer_buffer = self._peer_buffers.get(peer_id)
+        if peer_buffer is None:
             logger.info("User is offline: %s", peer_id)
             return
 
         logger.info("Sending message to %s: %s", peer_id, message)
-        peer_writer.write(message.encode())
-        await peer_writer.drain()
-        logger.info("Message sent to %s", peer_id)
+        if peer_buffer.push(message):
+            logger.info("Message queued for %s", peer_id)
+
+    async def _compact_notifications(self) -> None:
+        """Merge the stored notifications every compaction_interval seconds"""
+        while True:
+            await asyncio.sleep(self.compaction_interval)
+            try:
+                deleted = await self.notification_service.compact()
+                if deleted:
+                    logger.info("Compacted %d notifications", deleted)
+            except Exception as e:
+                logger.error("Error compacting notifications: %s", e)
+
+    def stats(self) -> dict[str, Any]:
+        """The counters of this node, by component"""
+        return {
+            "outbound": self.outbound_stats,
+            "push_debouncer": self.push_debouncer.stats,
+            "discussion_cache": self.discussion_cache.stats,
+            "discussion_cache_stream": self.discussion_cache_invalidator.stats,
+            **self.notification_bus.stats(),
+        }
+
+    def log_stats(self) -> None:
+        for component, stats in self.stats().items():
+            counters = " ".join(
+                f"{name}={value}" for name, value in asdict(stats).items()
+            )
+            logger.info("stats %s: %s", component, counters)
+
+    async def _log_stats_periodically(self) -> None:
+        """Log the counters every stats_log_interval seconds"""
+        while True:
+            await asyncio.sleep(self.stats_log_interval)
+            self.log_stats()
 
     async def handle_client(
         self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
@@ -83,42 +209,64 @@ class Server:
         peer_info = writer.get_extra_info("peername")
         peer_id = f"{peer_info[0]}:{peer_info[1]}"
         logger.info("New connection from %s", peer_id)
+        outbound = OutboundBuffer(
+            writer,
+            self.outbound_stats,
+            max_pushes=self.max_pushes,
+            overflow=self.push_overflow,
+        )
         try:
-            self._peer_writers[peer_id] = writer
+            self._peer_buffers[peer_id] = outbound
+            self.backlog_service.attach(peer_id, outbound.notice)
 
-            while True:
-                data = await reader.readline()
-                if not data:
-                    break
-
-                context = CommandContext.from_line(
-                    self.container, data.decode(), peer_id
-                )
-                command = CommandFactory.create_command(context)
-                response = await command.execute()
-                logger.info("response: %s", response)
-
-                writer.write(response.encode())
-                await writer.drain()
+            pipeline = CommandPipeline(
+                self.container,
+                peer_id,
+                outbound,
+                max_in_flight=self.max_in_flight,
+                ordered=self.ordered_responses,
+            )
+            await pipeline.serve(reader)
 
         except Exception as e:
-            writer.write(str(e).encode())
+            outbound.write(str(e))
             logger.error("Error handling client %s: %s", peer_id, e)
         finally:
-            self._peer_writers.pop(peer_id, None)
-            writer.close()
-            await self.session_service.delete(peer_id)
+            self._peer_buffers.pop(peer_id, None)
+            self.backlog_service.detach(peer_id)
+            outbound.close()
+            await self.session_service.close(peer_id)
             await writer.wait_closed()
             logger.info("Connection closed from %s", peer_id)
 
     async def start(self) -> None:
+        await self.container.index_manager().bootstrap(
+            [self.session_service, self.discussion_service, self.notification_service]
+        )
+        await self.discussion_service.migrate()
+
         self._server = await asyncio.start_server(
             self.handle_client,
             self.host,
             self.port,
         )
 
-        self._notification_task = asyncio.create_task(self._watch_notifications())
+        self._watcher_tasks = [
+            asyncio.create_task(self.notification_bus.run(self, self.node_id))
+        ]
+        # a single node invalidates its cache as it writes
+        if self.notification_bus.distributed:
+            self._watcher_tasks.append(
+                asyncio.create_task(self.discussion_cache_invalidator.run())
+            )
+        if self.compaction_interval > 0:
+            self._watcher_tasks.append(
+                asyncio.create_task(self._compact_notifications())
+            )
+        if self.stats_log_interval > 0:
+            self._watcher_tasks.append(
+                asyncio.create_task(self._log_stats_periodically())
+            )
 
         # For testing, the container might not have a config attribute
         db_name = self.container.config.db_name
@@ -135,6 +283,17 @@ class Server:
             self._server.close()
             await self._server.wait_closed()
 
+        self.push_debouncer.close()
+        self.backlog_service.close()
+        self._pending_replies.clear()
+        for task in self._watcher_tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        await self.notification_service.close()
         self.mongo_client.close()
 
 
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from server.services.notification_service import NotificationService
+from server.wire_format import format_backlog_push
+
+
+@dataclass
+class BacklogReplay:
+    user_id: str
+    # id of the last batch pushed, and the newest reply it showed of each
+    # discussion, until acknowledged
+    batch_id: int = 0
+    read_indexes: dict[str, int] = field(default_factory=dict)
+    acknowledged: asyncio.Event = field(default_factory=asyncio.Event)
+    task: asyncio.Task[None] | None = None
+
+
+class BacklogService:
+    """Replays the notifications stored while a user was offline.
+
+    A signed-in client asks for a replay with ``REPLAY_BACKLOG``: the
+    unread notifications that were not pushed live, including the replies
+    of threads notified on read, are collapsed per discussion and pushed
+    ``batch_size`` discussions at a time as ``NOTIFICATION_BACKLOG`` lines.
+    The next batch is only read once the client acknowledged the previous
+    one, which marks the notifications of that batch as read, so a
+    connection never holds more than one batch and a replay cut short
+    resumes on the next request.
+    Batches are notices: held back behind streamed responses like pushes,
+    but never dropped, since the replay waits for their acknowledgement.
+    """
+
+    def __init__(
+        self, notification_service: NotificationService, batch_size: int = 50
+    ) -> None:
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        self.notification_service = notification_service
+        self.batch_size = batch_size
+        self._writers: dict[str, Callable[[str], None]] = {}
+        self._replays: dict[str, BacklogReplay] = {}
+
+    def attach(self, peer_id: str, notice: Callable[[str], None]) -> None:
+        """Make a connection available for replays"""
+        self._writers[peer_id] = notice
+
+    def detach(self, peer_id: str) -> None:
+        self.stop(peer_id)
+        self._writers.pop(peer_id, None)
+
+    def start(self, peer_id: str, user_id: str) -> None:
+        """Replay the backlog of user_id on the connection, replacing any other"""
+        self.stop(peer_id)
+        notice = self._writers.get(peer_id)
+        if notice is None:
+            return
+
+        replay = BacklogReplay(user_id)
+        replay.task = asyncio.create_task(self._replay(peer_id, replay, notice))
+        self._replays[peer_id] = replay
+
+    def stop(self, peer_id: str) -> None:
+        replay = self._replays.pop(peer_id, None)
+        if replay is not None and replay.task is not None:
+            replay.task.cancel()
+
+    async def acknowledge(self, peer_id: str, batch_id: int) -> None:
+        """Mark the notifications of a pushed batch as read and push the next.
+
+        Notifications stored after the batch was read are left unread.
+        """
+        replay = self._replays.get(peer_id)
+        if (
+            replay is None
+            or replay.batch_id != batch_id
+            or replay.acknowledged.is_set()
+        ):
+            raise ValueError(f"no backlog batch {batch_id} to acknowledge")
+
+        await self.notification_service.mark_many_as_read(
+            replay.user_id, replay.read_indexes
+        )
+        replay.acknowledged.set()
+
+    async def _replay(
+        self, peer_id: str, replay: BacklogReplay, notice: Callable[[str], None]
+    ) -> None:
+        after = None
+        try:
+            while True:
+                entries = await self.notification_service.get_backlog(
+                    replay.user_id, self.batch_size, after
+                )
+                if not entries:
+                    return
+
+                replay.batch_id += 1
+                replay.read_indexes = {
+                    entry.discussion_id: entry.read_index for entry in entries
+                }
+                replay.acknowledged.clear()
+                notice(format_backlog_push(replay.batch_id, entries))
+                await replay.acknowledged.wait()
+                after = entries[-1].discussion_id
+        except Exception as e:
+            logging.error(f"Error replaying the backlog of {replay.user_id}: {e}")
+        finally:
+            if self._replays.get(peer_id) is replay:
+                del self._replays[peer_id]
+
+    def close(self) -> None:
+        """Stop every replay"""
+        for peer_id in [*self._replays]:
+            self.stop(peer_id)
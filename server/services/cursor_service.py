@@ -0,0 +1,61 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any
+
+from server.entities.page_cursor import PageCursor, PageKind
+
+INVALID_CURSOR = "Invalid cursor"
+
+
+class CursorService:
+    """Opaque continuation tokens for paginated commands.
+
+    Tokens are unpadded url-safe base64, so they never contain the ``|`` or
+    ``,`` separators of the wire format.
+    """
+
+    MAX_PAGE_SIZE = 100
+
+    @classmethod
+    def parse_page_size(cls, value: str) -> int:
+        if not value.isdigit() or not 0 < int(value) <= cls.MAX_PAGE_SIZE:
+            raise ValueError(f"page size must be between 1 and {cls.MAX_PAGE_SIZE}")
+        return int(value)
+
+    @classmethod
+    def encode(cls, cursor: PageCursor) -> str:
+        fields: dict[str, Any] = {"k": cursor.kind.value, "n": cursor.page_size}
+        if cursor.reference_prefix is not None:
+            fields["r"] = cursor.reference_prefix
+        if cursor.created_at is not None:
+            fields["t"] = cursor.created_at.isoformat()
+        if cursor.discussion_id is not None:
+            fields["d"] = cursor.discussion_id
+        if cursor.offset:
+            fields["o"] = cursor.offset
+
+        data = json.dumps(fields, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+    @classmethod
+    def decode(cls, token: str) -> PageCursor:
+        try:
+            padded = token + "=" * (-len(token) % 4)
+            fields = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            created_at = fields.get("t")
+            cursor = PageCursor(
+                kind=PageKind(fields["k"]),
+                page_size=int(fields["n"]),
+                reference_prefix=fields.get("r"),
+                created_at=(datetime.fromisoformat(created_at) if created_at else None),
+                discussion_id=fields.get("d"),
+                offset=int(fields.get("o", 0)),
+            )
+        except (binascii.Error, ValueError, KeyError, TypeError, AttributeError) as e:
+            raise ValueError(INVALID_CURSOR) from e
+
+        if not 0 < cursor.page_size <= cls.MAX_PAGE_SIZE or cursor.offset < 0:
+            raise ValueError(INVALID_CURSOR)
+        return cursor
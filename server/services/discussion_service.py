@@ -1,25 +1,64 @@
+import logging
 import random
 import re
 import string
-from datetime import datetime
-from typing import Any
+from collections.abc import AsyncIterator, Iterable
+from datetime import datetime, timedelta
+from operator import itemgetter
+from typing import Any, ClassVar
 
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
-from server.entities.discussion import Discussion, Reply
+from server.cache import LruCache
+from server.entities.discussion import Discussion, DiscussionSummary, Reply
+from server.indexes import IndexSpec, QueryShape
 from server.services.notification_service import NotificationService
+from server.services.validation_service import ValidationService
+from server.wire_format import EncodedDiscussion
 
 
 class DiscussionService:
     MENTION_PATTERN = re.compile(r"(?<!@)@(\w+)(?=[\s,.!?]|$)")
+    PAGE_SORT: ClassVar[list[tuple[str, int]]] = [
+        ("created_at", ASCENDING),
+        ("discussion_id", ASCENDING),
+    ]
+    # per-video listing, in playback order
+    LIST_SORT: ClassVar[list[tuple[str, int]]] = [
+        ("reference_prefix", ASCENDING),
+        ("time_marker_seconds", ASCENDING),
+        ("discussion_id", ASCENDING),
+    ]
+    SUMMARY_FIELDS: ClassVar[dict[str, int]] = {
+        "discussion_id": 1,
+        "reference_prefix": 1,
+        "time_marker": 1,
+        "reply_count": 1,
+        "last_activity_at": 1,
+        "first_comment": 1,
+    }
+    # replies live in reply_buckets documents of at most this many replies
+    REPLY_BUCKET_SIZE = 100
+    # a reply counted this long ago but still missing from its bucket was
+    # lost to a failed write, and its position is filled with a tombstone
+    LOST_REPLY_AGE = timedelta(minutes=1)
 
     def __init__(
         self,
         db: AsyncIOMotorDatabase[Any],
         notification_service: NotificationService,
+        cache: LruCache[str, EncodedDiscussion] | None = None,
+        fanout_on_read_participants: int = 500,
     ) -> None:
         self.db = db
+        self.cache = cache
+        # threads with more participants record one event per reply instead
+        # of one notification per participant
+        self.fanout_on_read_participants = fanout_on_read_participants
         self.discussions = self.db.discussions
+        self.reply_buckets = self.db.reply_buckets
         self.notification_service = notification_service
 
     def _sanitize_comment(self, comment: str) -> str:
@@ -28,13 +67,40 @@ class DiscussionService:
             return f'"{escaped_comment}"'
         return comment
 
-    def _get_unique_participants(self, discussion_doc: dict[str, Any]) -> set[str]:
+    def _get_unique_participants(
+        self, discussion_doc: dict[str, Any], replies: list[dict[str, Any]]
+    ) -> set[str]:
         """Get unique client_ids from a discussion's replies"""
         participants = {discussion_doc["client_id"]}
-        for reply in discussion_doc["replies"]:
-            participants.add(reply["client_id"])
+        for reply in replies:
+            if not reply.get("lost"):
+                participants.add(reply["client_id"])
         return participants
 
+    async def _backfill_participants(self, discussion_id: str) -> set[str]:
+        """Build the participants set of a discussion created before it existed"""
+        discussion_doc = await self.discussions.find_one(
+            {"discussion_id": discussion_id}, {"_id": 0}
+        )
+        if not discussion_doc:
+            raise ValueError(f"Discussion {discussion_id} not found")
+
+        participants = self._get_unique_participants(
+            discussion_doc, await self._load_replies(discussion_id)
+        )
+        await self.discussions.update_one(
+            {"discussion_id": discussion_id},
+            {"$addToSet": {"participants": {"$each": sorted(participants)}}},
+        )
+        return participants
+
+    def _time_marker_seconds(self, time_marker: str) -> int | None:
+        """Sortable offset of a time marker; None sorts unparseable ones first"""
+        try:
+            return ValidationService.time_marker_seconds(time_marker)
+        except ValueError:
+            return None
+
     def _extract_mentions(self, comment: str) -> set[str]:
         """Extract mentioned client_ids from a comment"""
         return set(self.MENTION_PATTERN.findall(comment))
@@ -48,101 +114,604 @@ class DiscussionService:
             random.choices(string.ascii_lowercase + string.digits, k=7)
         )
 
+        first_reply = self._new_reply(client_id, comment, 0)
+        # the bucket goes first so that a discussion is never seen without it
+        await self.reply_buckets.insert_one(
+            {"discussion_id": discussion_id, "bucket": 0, "replies": [first_reply]}
+        )
         discussion_doc = {
             "discussion_id": discussion_id,
             "reference_prefix": reference_prefix,
             "time_marker": time_marker,
+            "time_marker_seconds": self._time_marker_seconds(time_marker),
             "client_id": client_id,
-            "created_at": datetime.now(),
-            "replies": [
-                {
-                    "client_id": client_id,
-                    "comment": self._sanitize_comment(comment),
-                    "created_at": datetime.now(),
-                }
-            ],
+            "created_at": first_reply["created_at"],
+            "participants": [client_id],
+            # denormalized for LIST_DISCUSSIONS_SUMMARY
+            "reply_count": 1,
+            "last_activity_at": first_reply["created_at"],
+            "first_comment": first_reply["comment"],
         }
 
         await self.discussions.insert_one(discussion_doc)
 
-        mentioned_users = self._extract_mentions(comment)
-        if mentioned_users:
-            await self.notification_service.create_mention_notifications(
-                discussion_id=discussion_id,
-                sender_id=client_id,
-                mentioned_ids=list(mentioned_users),
-            )
+        await self.notification_service.notify(
+            discussion_id=discussion_id,
+            sender_id=client_id,
+            reply=first_reply,
+            recipient_ids=(),
+            mentioned_ids=self._extract_mentions(comment),
+        )
 
         return discussion_id
 
     async def create_reply(
         self, discussion_id: str, comment: str, client_id: str
     ) -> str:
-        discussion_doc = await self.discussions.find_one(
-            {"discussion_id": discussion_id}, {"_id": 0}
+        created_at = datetime.now()
+        discussion_doc = await self.discussions.find_one_and_update(
+            {"discussion_id": discussion_id},
+            {
+                "$inc": {"reply_count": 1},
+                "$max": {"last_activity_at": created_at},
+                "$addToSet": {"participants": client_id},
+            },
+            projection={
+                "_id": 0,
+                "participants": 1,
+                "reply_count": 1,
+                "fanout_on_read": 1,
+            },
+            return_document=ReturnDocument.BEFORE,
         )
-        if not discussion_doc:
+        if discussion_doc is None:
             raise ValueError(f"Discussion {discussion_id} not found")
 
-        participants = self._get_unique_participants(discussion_doc) - {client_id}
-
-        new_reply = {
-            "client_id": client_id,
-            "comment": self._sanitize_comment(comment),
-            "created_at": datetime.now(),
-        }
-        await self.discussions.update_one(
-            {"discussion_id": discussion_id}, {"$push": {"replies": new_reply}}
-        )
+        index = discussion_doc["reply_count"]
+        new_reply = self._new_reply(client_id, comment, index, created_at)
+        # an upsert racing on the unique (discussion_id, bucket) index is
+        # retried by the server, so concurrent replies share the new bucket
+        try:
+            await self.reply_buckets.update_one(
+                {
+                    "discussion_id": discussion_id,
+                    "bucket": index // self.REPLY_BUCKET_SIZE,
+                },
+                {"$push": {"replies": new_reply}},
+                upsert=True,
+            )
+        except Exception:
+            await self._release_reply_index(discussion_id, index, created_at)
+            raise
+        self._append_to_cache(discussion_id, Reply(**new_reply))
 
-        await self.notification_service.create_reply_notifications(
-            discussion_id=discussion_id,
-            sender_id=client_id,
-            recipient_ids=list(participants),
-        )
+        if "participants" in discussion_doc:
+            participants = set(discussion_doc["participants"]) - {client_id}
+        else:
+            participants = await self._backfill_participants(discussion_id)
+            participants -= {client_id}
 
-        mentioned_users = self._extract_mentions(comment)
-        if mentioned_users:
-            await self.notification_service.create_mention_notifications(
+        mentioned_ids = self._extract_mentions(comment)
+        if (
+            discussion_doc.get("fanout_on_read")
+            or len(participants) >= self.fanout_on_read_participants
+        ):
+            await self._notify_on_read(discussion_doc, discussion_id, new_reply)
+            await self.notification_service.notify_discussion(
+                discussion_id=discussion_id,
+                sender_id=client_id,
+                reply=new_reply,
+                mentioned_ids=mentioned_ids,
+            )
+        else:
+            await self.notification_service.notify(
                 discussion_id=discussion_id,
                 sender_id=client_id,
-                mentioned_ids=list(mentioned_users),
+                reply=new_reply,
+                recipient_ids=participants,
+                mentioned_ids=mentioned_ids,
             )
 
         return discussion_id
 
+    async def _release_reply_index(
+        self, discussion_id: str, index: int, created_at: datetime
+    ) -> None:
+        """Give back the index of a reply whose bucket write failed"""
+        released = await self.discussions.update_one(
+            {"discussion_id": discussion_id, "reply_count": index + 1},
+            {"$inc": {"reply_count": -1}},
+        )
+        if released.modified_count == 0:
+            # a later reply already took the next index
+            await self._fill_lost_reply(discussion_id, index, created_at)
+
+    async def _fill_lost_reply(
+        self, discussion_id: str, index: int, created_at: datetime
+    ) -> dict[str, Any]:
+        """Store a tombstone at a position no reply will ever be written to"""
+        tombstone = {"index": index, "created_at": created_at, "lost": True}
+        try:
+            await self.reply_buckets.update_one(
+                {
+                    "discussion_id": discussion_id,
+                    "bucket": index // self.REPLY_BUCKET_SIZE,
+                    "replies.index": {"$ne": index},
+                },
+                {"$push": {"replies": tombstone}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            pass  # the bucket already holds that position
+        return tombstone
+
+    async def _fill_lost_replies(
+        self,
+        discussion_doc: dict[str, Any],
+        replies: list[dict[str, Any]],
+        first_bucket: int = 0,
+        last_bucket: int | None = None,
+    ) -> list[dict[str, Any]]:
+        """Replies of the buckets read, with the positions of lost ones filled.
+
+        A position counted in reply_count may still be in the middle of its
+        write, so it is only filled once a later reply, or the last
+        activity, is older than LOST_REPLY_AGE.
+        """
+        start = first_bucket * self.REPLY_BUCKET_SIZE
+        end = discussion_doc["reply_count"]
+        if last_bucket is not None:
+            end = min(end, (last_bucket + 1) * self.REPLY_BUCKET_SIZE)
+        if len(replies) >= end - start:
+            return replies
+
+        present = {reply["index"]: reply for reply in replies}
+        lost_before = datetime.now() - self.LOST_REPLY_AGE
+        written_after = discussion_doc.get("last_activity_at", datetime.min)
+        for index in reversed(range(start, end)):
+            if index in present:
+                written_after = present[index]["created_at"]
+            elif written_after < lost_before:
+                present[index] = await self._fill_lost_reply(
+                    discussion_doc["discussion_id"], index, written_after
+                )
+        return sorted(present.values(), key=itemgetter("index"))
+
+    async def _notify_on_read(
+        self, discussion_doc: dict[str, Any], discussion_id: str, reply: dict[str, Any]
+    ) -> None:
+        """Switch the thread to fan-out-on-read and keep the sender's read mark"""
+        if not discussion_doc.get("fanout_on_read"):
+            await self.discussions.update_one(
+                {"discussion_id": discussion_id}, {"$set": {"fanout_on_read": True}}
+            )
+        if reply["client_id"] not in discussion_doc.get("participants", ()):
+            # a new participant has read the thread up to their own reply
+            await self.notification_service.set_read_mark(
+                reply["client_id"], discussion_id, reply["index"]
+            )
+
+    async def get_participants_among(
+        self, discussion_id: str, user_ids: Iterable[str]
+    ) -> set[str]:
+        """Which of user_ids take part in the discussion, filtered by the server"""
+        docs = await self.discussions.aggregate(
+            [
+                {"$match": {"discussion_id": discussion_id}},
+                {
+                    "$project": {
+                        "_id": 0,
+                        "participants": {
+                            "$filter": {
+                                "input": "$participants",
+                                "as": "participant",
+                                "cond": {"$in": ["$$participant", list(user_ids)]},
+                            }
+                        },
+                    }
+                },
+            ]
+        ).to_list(length=1)
+        return set(docs[0]["participants"]) if docs else set()
+
+    async def get_encoded_discussion(self, discussion_id: str) -> str:
+        """The GET_DISCUSSION response parameters, rendered once and cached"""
+        cached = self.cache.get(discussion_id) if self.cache is not None else None
+        if cached is not None:
+            return cached.params
+
+        version = self.cache.version if self.cache is not None else 0
+        discussion_doc, replies = await self._find_discussion(discussion_id)
+        encoded = EncodedDiscussion.of(
+            self._to_discussion(discussion_doc, replies), len(replies)
+        )
+        # a reply counted but not yet appended to its bucket would be missing
+        if self.cache is not None and len(replies) == discussion_doc["reply_count"]:
+            self.cache.put(discussion_id, encoded, version)
+        return encoded.params
+
+    def _append_to_cache(self, discussion_id: str, reply: Reply) -> None:
+        if self.cache is None:
+            return
+        cached = self.cache.peek(discussion_id)
+        if cached is None:
+            return
+        # replies appended concurrently may be written out of order
+        if cached.reply_count == reply.index:
+            self.cache.refresh(discussion_id, cached.append(reply))
+        else:
+            self.cache.invalidate(discussion_id)
+
     async def get_discussion(self, discussion_id: str) -> Discussion:
+        return self._to_discussion(*await self._find_discussion(discussion_id))
+
+    async def _find_discussion(
+        self, discussion_id: str
+    ) -> tuple[dict[str, Any], list[dict[str, Any]]]:
         discussion_doc = await self.discussions.find_one(
             {"discussion_id": discussion_id}, {"_id": 0}
         )
         if not discussion_doc:
             raise ValueError(f"Discussion {discussion_id} not found")
 
-        return Discussion(
-            discussion_id=discussion_doc["discussion_id"],
-            reference_prefix=discussion_doc["reference_prefix"],
-            time_marker=discussion_doc["time_marker"],
-            client_id=discussion_doc["client_id"],
-            created_at=discussion_doc["created_at"],
-            replies=[Reply(**reply) for reply in discussion_doc["replies"]],
+        replies = await self._fill_lost_replies(
+            discussion_doc, await self._load_replies(discussion_id)
         )
+        return discussion_doc, replies
 
     async def list_discussions(
         self, reference_prefix: str | None = None
     ) -> list[Discussion]:
+        return [
+            discussion
+            async for discussion in self.iter_discussions(
+                reference_prefix=reference_prefix
+            )
+        ]
+
+    async def iter_discussions(
+        self,
+        reference_prefix: str | None = None,
+        batch_size: int = 100,
+        time_range: tuple[int, int] | None = None,
+    ) -> AsyncIterator[Discussion]:
+        """Yield discussions in time marker order, batch_size at a time.
+
+        time_range limits them to the markers in [start, end) seconds.
+        """
+        query: dict[str, Any] = (
+            {"reference_prefix": reference_prefix} if reference_prefix else {}
+        )
+        if time_range is not None:
+            start, end = time_range
+            query["time_marker_seconds"] = {"$gte": start, "$lt": end}
+        cursor = (
+            self.discussions.find(query, {"_id": 0})
+            .sort(self.LIST_SORT)
+            .batch_size(batch_size)
+        )
+        batch = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                for discussion in await self._with_replies(batch):
+                    yield discussion
+                batch = []
+        for discussion in await self._with_replies(batch):
+            yield discussion
+
+    async def iter_discussion_summaries(
+        self, reference_prefix: str | None = None, batch_size: int = 100
+    ) -> AsyncIterator[DiscussionSummary]:
+        """Like iter_discussions, reading only the denormalized summary fields"""
         query = {"reference_prefix": reference_prefix} if reference_prefix else {}
-        discussion_docs = await self.discussions.find(query, {"_id": 0}).to_list(
-            length=None
+        cursor = (
+            self.discussions.find(query, {"_id": 0, **self.SUMMARY_FIELDS})
+            .sort(self.LIST_SORT)
+            .batch_size(batch_size)
+        )
+        async for doc in cursor:
+            yield DiscussionSummary(**doc)
+
+    async def list_discussions_page(
+        self,
+        page_size: int,
+        reference_prefix: str | None = None,
+        after: tuple[datetime, str] | None = None,
+    ) -> tuple[list[Discussion], tuple[datetime, str] | None]:
+        """One page of discussions in (created_at, discussion_id) order.
+
+        Returns the page and the key to resume after, or None on the last page.
+        """
+        query: dict[str, Any] = (
+            {"reference_prefix": reference_prefix} if reference_prefix else {}
+        )
+        if after is not None:
+            created_at, discussion_id = after
+            query["$or"] = [
+                {"created_at": {"$gt": created_at}},
+                {"created_at": created_at, "discussion_id": {"$gt": discussion_id}},
+            ]
+
+        docs = (
+            await self.discussions.find(query, {"_id": 0})
+            .sort(self.PAGE_SORT)
+            .limit(page_size + 1)
+            .to_list(length=page_size + 1)
+        )
+        discussions = await self._with_replies(docs[:page_size])
+        if len(docs) <= page_size:
+            return discussions, None
+
+        last = discussions[-1]
+        return discussions, (last.created_at, last.discussion_id)
+
+    async def get_discussion_page(
+        self, discussion_id: str, offset: int, page_size: int
+    ) -> tuple[Discussion, int | None]:
+        """A discussion with page_size of its replies, starting at offset.
+
+        Returns the discussion and the offset of the next page, or None on the
+        last page.
+        """
+        discussion_doc = await self.discussions.find_one(
+            {"discussion_id": discussion_id}, {"_id": 0}
         )
+        if not discussion_doc:
+            raise ValueError(f"Discussion {discussion_id} not found")
+
+        end = offset + page_size
+        first_bucket = offset // self.REPLY_BUCKET_SIZE
+        last_bucket = (end - 1) // self.REPLY_BUCKET_SIZE
+        replies = await self._fill_lost_replies(
+            discussion_doc,
+            await self._load_replies(discussion_id, first_bucket, last_bucket),
+            first_bucket,
+            last_bucket,
+        )
+        page = [reply for reply in replies if offset <= reply["index"] < end]
+        next_offset = end if end < discussion_doc["reply_count"] else None
+        return self._to_discussion(discussion_doc, page), next_offset
+
+    async def get_replies_since(
+        self, discussion_id: str, index: int
+    ) -> tuple[list[Reply], int]:
+        """Replies from position index on, read from their buckets only.
+
+        Returns them with the index to ask for next time. A reply that is
+        counted but still being appended ends the run, so nothing is skipped.
+        """
+        discussion_doc = await self.discussions.find_one(
+            {"discussion_id": discussion_id},
+            {"_id": 0, "discussion_id": 1, "reply_count": 1, "last_activity_at": 1},
+        )
+        if not discussion_doc:
+            raise ValueError(f"Discussion {discussion_id} not found")
+        if index >= discussion_doc["reply_count"]:
+            return [], index
+
+        first_bucket = index // self.REPLY_BUCKET_SIZE
+        replies: list[Reply] = []
+        next_index = index
+        for reply in await self._fill_lost_replies(
+            discussion_doc,
+            await self._load_replies(discussion_id, first_bucket),
+            first_bucket,
+        ):
+            if reply["index"] < index:
+                continue
+            if reply["index"] != next_index:
+                break
+            next_index += 1
+            if not reply.get("lost"):
+                replies.append(Reply(**reply))
+        return replies, next_index
+
+    def indexes(self) -> list[IndexSpec]:
+        discussions = self.discussions.name
+        return [
+            IndexSpec(discussions, [("discussion_id", ASCENDING)], {"unique": True}),
+            IndexSpec(discussions, self.PAGE_SORT),
+            IndexSpec(discussions, [("reference_prefix", ASCENDING), *self.PAGE_SORT]),
+            IndexSpec(discussions, self.LIST_SORT),
+            IndexSpec(
+                self.reply_buckets.name,
+                [("discussion_id", ASCENDING), ("bucket", ASCENDING)],
+                {"unique": True},
+            ),
+            # the participant index of fan-out-on-read threads
+            IndexSpec(
+                discussions,
+                [("participants", ASCENDING)],
+                {"partialFilterExpression": {"fanout_on_read": True}},
+            ),
+        ]
 
+    def hot_queries(self) -> list[QueryShape]:
+        discussions = self.discussions.name
         return [
-            Discussion(
-                discussion_id=doc["discussion_id"],
-                reference_prefix=doc["reference_prefix"],
-                time_marker=doc["time_marker"],
-                client_id=doc["client_id"],
-                created_at=doc["created_at"],
-                replies=[Reply(**reply) for reply in doc["replies"]],
+            QueryShape(discussions, {"discussion_id": ""}),
+            QueryShape(discussions, {}, self.PAGE_SORT),
+            QueryShape(discussions, {"reference_prefix": ""}, self.LIST_SORT),
+            QueryShape(discussions, {"participants": "", "fanout_on_read": True}),
+            QueryShape(
+                self.reply_buckets.name, {"discussion_id": "", "bucket": {"$gte": 0}}
+            ),
+        ]
+
+    async def migrate(self) -> None:
+        """Bring documents written by earlier versions up to date.
+
+        Each migration scans the discussions once: the number of migrations
+        applied is recorded in schema_versions, and later startups only run
+        the ones added since. New migrations go at the end of the list.
+        """
+        migrations = [
+            (self.migrate_reply_buckets, "Moved the replies of %d discussions"),
+            (self.backfill_time_markers, "Backfilled time markers of %d discussions"),
+            (self.backfill_summaries, "Backfilled summaries of %d discussions"),
+        ]
+        schema = await self.db.schema_versions.find_one({"_id": "discussions"})
+        applied = schema["version"] if schema else 0
+        for version, (migration, message) in enumerate(migrations, start=1):
+            if version <= applied:
+                continue
+            migrated = await migration()
+            if migrated:
+                logging.info(message, migrated)
+            await self.db.schema_versions.update_one(
+                {"_id": "discussions"}, {"$set": {"version": version}}, upsert=True
+            )
+
+    async def backfill_summaries(self) -> int:
+        """Set last_activity_at and first_comment where they are missing"""
+        updated = 0
+        cursor = self.discussions.find(
+            {"first_comment": {"$exists": False}},
+            {"_id": 1, "discussion_id": 1, "reply_count": 1},
+        )
+        async for doc in cursor:
+            last_bucket = (doc["reply_count"] - 1) // self.REPLY_BUCKET_SIZE
+            first = await self._load_replies(doc["discussion_id"], 0, 0)
+            last = await self._load_replies(
+                doc["discussion_id"], last_bucket, last_bucket
+            )
+            await self.discussions.update_one(
+                {"_id": doc["_id"]},
+                {
+                    "$set": {
+                        "first_comment": first[0]["comment"],
+                        "last_activity_at": max(reply["created_at"] for reply in last),
+                    }
+                },
+            )
+            updated += 1
+        return updated
+
+    async def migrate_reply_buckets(self) -> int:
+        """Move replies embedded in discussion documents to reply buckets.
+
+        Buckets are overwritten rather than appended to, so an interrupted
+        run can simply be repeated.
+        """
+        migrated = 0
+        cursor = self.discussions.find(
+            {"replies": {"$exists": True}},
+            {"_id": 1, "discussion_id": 1, "replies": 1},
+        )
+        async for doc in cursor:
+            replies = [
+                {**reply, "index": index} for index, reply in enumerate(doc["replies"])
+            ]
+            for start in range(0, len(replies), self.REPLY_BUCKET_SIZE):
+                await self.reply_buckets.update_one(
+                    {
+                        "discussion_id": doc["discussion_id"],
+                        "bucket": start // self.REPLY_BUCKET_SIZE,
+                    },
+                    {
+                        "$set": {
+                            "replies": replies[start : start + self.REPLY_BUCKET_SIZE]
+                        }
+                    },
+                    upsert=True,
+                )
+            await self.discussions.update_one(
+                {"_id": doc["_id"]},
+                {"$set": {"reply_count": len(replies)}, "$unset": {"replies": ""}},
+            )
+            migrated += 1
+        return migrated
+
+    async def backfill_time_markers(self) -> int:
+        """Parse time_marker_seconds for discussions created before it existed"""
+        updated = 0
+        cursor = self.discussions.find(
+            {"time_marker_seconds": {"$exists": False}},
+            {"_id": 1, "time_marker": 1},
+        )
+        async for doc in cursor:
+            await self.discussions.update_one(
+                {"_id": doc["_id"]},
+                {
+                    "$set": {
+                        "time_marker_seconds": self._time_marker_seconds(
+                            doc["time_marker"]
+                        )
+                    }
+                },
             )
-            for doc in discussion_docs
+            updated += 1
+        return updated
+
+    def _new_reply(
+        self,
+        client_id: str,
+        comment: str,
+        index: int,
+        created_at: datetime | None = None,
+    ) -> dict[str, Any]:
+        return {
+            "client_id": client_id,
+            "comment": self._sanitize_comment(comment),
+            "created_at": created_at or datetime.now(),
+            "index": index,
+        }
+
+    async def _load_replies(
+        self, discussion_id: str, first_bucket: int = 0, last_bucket: int | None = None
+    ) -> list[dict[str, Any]]:
+        """Replies of a discussion in order, read from the given buckets only"""
+        bucket_range: dict[str, int] = {"$gte": first_bucket}
+        if last_bucket is not None:
+            bucket_range["$lte"] = last_bucket
+        cursor = self.reply_buckets.find(
+            {"discussion_id": discussion_id, "bucket": bucket_range},
+            {"_id": 0, "replies": 1},
+        )
+        replies = [reply async for bucket in cursor for reply in bucket["replies"]]
+        # concurrent appends may land in a bucket out of order
+        return self._ordered_replies(replies)
+
+    @staticmethod
+    def _ordered_replies(replies: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Replies by index, a reply written after all winning over its tombstone"""
+        by_index: dict[int, dict[str, Any]] = {}
+        for reply in replies:
+            if reply["index"] not in by_index or not reply.get("lost"):
+                by_index[reply["index"]] = reply
+        return [by_index[index] for index in sorted(by_index)]
+
+    async def _with_replies(self, docs: list[dict[str, Any]]) -> list[Discussion]:
+        """Attach the replies of several discussions with a single query"""
+        if not docs:
+            return []
+        replies: dict[str, list[dict[str, Any]]] = {
+            doc["discussion_id"]: [] for doc in docs
+        }
+        cursor = self.reply_buckets.find(
+            {"discussion_id": {"$in": list(replies)}},
+            {"_id": 0, "discussion_id": 1, "replies": 1},
+        )
+        async for bucket in cursor:
+            replies[bucket["discussion_id"]].extend(bucket["replies"])
+        return [
+            self._to_discussion(
+                doc,
+                self._ordered_replies(replies[doc["discussion_id"]]),
+            )
+            for doc in docs
         ]
+
+    def _to_discussion(
+        self, doc: dict[str, Any], replies: list[dict[str, Any]]
+    ) -> Discussion:
+        return Discussion(
+            discussion_id=doc["discussion_id"],
+            reference_prefix=doc["reference_prefix"],
+            time_marker=doc["time_marker"],
+            client_id=doc["client_id"],
+            created_at=doc["created_at"],
+            replies=[Reply(**reply) for reply in replies if not reply.get("lost")],
+            reply_count=doc["reply_count"],
+        )
@@ -1,87 +1,618 @@
+import asyncio
 import logging
+from collections.abc import Iterable, Mapping
+from contextlib import suppress
 from datetime import datetime
 from typing import Any
 
-from motor.motor_asyncio import AsyncIOMotorDatabase
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING
 
-from server.entities.notification import Notification, NotificationType
+from server.entities.discussion import Reply
+from server.entities.notification import (
+    BacklogEntry,
+    Notification,
+    NotificationType,
+)
+from server.indexes import IndexSpec, QueryShape
+from server.notification_bus import NotificationBus
 
 
 class NotificationService:
-    def __init__(self, db: AsyncIOMotorDatabase[Any]) -> None:
+    """Writes notifications from a bounded background queue.
+
+    ``notify`` returns once the notifications of an event are queued, so
+    the command that caused them does not wait for their insert. A worker
+    task inserts everything queued so far with one ``insert_many``. Reads
+    through this service first wait for the queue to drain.
+
+    Threads with many participants are notified on read instead:
+    ``notify_discussion`` records a single discussion event, and the
+    unread replies of a participant are derived from those events and the
+    participant's read mark, the index of the last reply they have read.
+
+    Notifications and discussion events expire ``ttl`` seconds after they
+    were created, read or not, and ``compact`` merges the notifications of
+    a recipient and discussion into one. What was pushed to a connected
+    recipient is flagged by ``mark_delivered`` and left out of
+    ``get_backlog``, the replay of what happened while they were offline.
+    """
+
+    TTL_INDEX = "created_at_ttl"
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase[Any],
+        bus: NotificationBus | None = None,
+        queue_size: int = 1000,
+        ttl: int = 30 * 24 * 3600,
+    ) -> None:
         self.db = db
+        self.bus = bus
+        self.ttl = ttl
         self.notifications = self.db.notifications
+        self.discussion_events = self.db.discussion_events
+        self.read_marks = self.db.read_marks
+        self._queue: asyncio.Queue[
+            tuple[AsyncIOMotorCollection[Any], list[dict[str, Any]]]
+        ] = asyncio.Queue(queue_size)
+        self._worker: asyncio.Task[None] | None = None
 
-    async def create_reply_notifications(
-        self, discussion_id: str, sender_id: str, recipient_ids: list[str]
+    async def notify(
+        self,
+        discussion_id: str,
+        sender_id: str,
+        reply: dict[str, Any],
+        recipient_ids: Iterable[str],
+        mentioned_ids: Iterable[str] = (),
     ) -> None:
-        """Create reply notifications for all recipients except the sender"""
-        if not recipient_ids:
-            return
+        """Queue one notification per user the reply concerns, except its sender.
 
+        A mentioned recipient gets a single MENTION notification. reply is
+        stored with every notification so that it can be pushed without
+        reading the discussion again.
+        """
+        mentioned = set(mentioned_ids)
         notifications = [
             {
                 "discussion_id": discussion_id,
                 "recipient_id": recipient_id,
                 "sender_id": sender_id,
-                "notification_type": NotificationType.REPLY.value,
+                "notification_type": (
+                    NotificationType.MENTION.value
+                    if recipient_id in mentioned
+                    else NotificationType.REPLY.value
+                ),
                 "created_at": datetime.now(),
+                "reply": reply,
             }
-            for recipient_id in recipient_ids
+            for recipient_id in sorted(mentioned.union(recipient_ids))
             if recipient_id != sender_id  # Don't notify the sender
         ]
+        await self._enqueue(self.notifications, notifications)
+        if self.bus is not None and notifications:
+            await self.bus.publish_notifications(notifications)
 
-        if notifications:
-            await self.notifications.insert_many(notifications)
-            logging.info(
-                f"Created {len(notifications)} reply notifications for discussion {discussion_id}"
-            )
-
-    async def create_mention_notifications(
-        self, discussion_id: str, sender_id: str, mentioned_ids: list[str]
+    async def notify_discussion(
+        self,
+        discussion_id: str,
+        sender_id: str,
+        reply: dict[str, Any],
+        mentioned_ids: Iterable[str] = (),
     ) -> None:
-        """Create mention notifications for all mentioned users except the sender"""
-        if not mentioned_ids:
-            return
+        """Queue a single event for all participants of a large thread.
 
-        notifications = [
+        Mentioned users are still notified individually.
+        """
+        events = [
             {
                 "discussion_id": discussion_id,
-                "recipient_id": recipient_id,
                 "sender_id": sender_id,
-                "notification_type": NotificationType.MENTION.value,
                 "created_at": datetime.now(),
+                "reply": reply,
             }
-            for recipient_id in mentioned_ids
-            if recipient_id != sender_id
         ]
+        await self._enqueue(self.discussion_events, events)
+        if self.bus is not None:
+            await self.bus.publish_discussion_events(events)
+        await self.notify(discussion_id, sender_id, reply, (), mentioned_ids)
 
-        if notifications:
-            await self.notifications.insert_many(notifications)
-            logging.info(
-                f"Created {len(notifications)} mention notifications for discussion {discussion_id}"
-            )
+    async def _enqueue(
+        self, collection: AsyncIOMotorCollection[Any], documents: list[dict[str, Any]]
+    ) -> None:
+        if not documents:
+            return
+
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._insert_queued())
+        await self._queue.put((collection, documents))
+
+    async def _insert_queued(self) -> None:
+        while True:
+            batches = [await self._queue.get()]
+            while not self._queue.empty():
+                batches.append(self._queue.get_nowait())
+            # one insert_many per collection for everything queued so far
+            pending: dict[str, tuple[AsyncIOMotorCollection[Any], list[Any]]] = {}
+            for collection, documents in batches:
+                _, queued = pending.setdefault(collection.name, (collection, []))
+                queued.extend(documents)
+            try:
+                for collection, queued in pending.values():
+                    await self._insert(collection, queued)
+            finally:
+                for _ in batches:
+                    self._queue.task_done()
+
+    async def _insert(
+        self, collection: AsyncIOMotorCollection[Any], documents: list[dict[str, Any]]
+    ) -> None:
+        try:
+            await collection.insert_many(documents)
+            logging.info(f"Created {len(documents)} {collection.name}")
+        except Exception as e:
+            logging.error(f"Error creating {len(documents)} {collection.name}: {e}")
+
+    async def flush(self) -> None:
+        """Wait until every queued notification has been written"""
+        if self._worker is not None and not self._worker.done():
+            await self._queue.join()
+
+    async def close(self) -> None:
+        """Flush the queue and stop the worker"""
+        await self.flush()
+        if self._worker is not None:
+            self._worker.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
 
     async def get_notifications(self, recipient_id: str) -> list[Notification]:
         """Get all notifications for a recipient"""
+        await self.flush()
         notification_docs = (
-            await self.notifications.find({"recipient_id": recipient_id}, {"_id": 0})
+            await self.notifications.find(
+                {"recipient_id": recipient_id}, {"_id": 0, "delivered": 0}
+            )
             .sort("created_at", -1)
             .to_list(length=None)
         )
 
-        return [
+        notifications = [
             Notification(
                 **{
                     **doc,
                     "notification_type": NotificationType(doc["notification_type"]),
+                    "reply": Reply(**doc["reply"]) if "reply" in doc else None,
                 }
             )
             for doc in notification_docs
         ]
+        notifications += await self._unread_discussion_events(
+            recipient_id,
+            {(n.discussion_id, n.reply.index) for n in notifications if n.reply},
+        )
+        # replies written within the same millisecond, newest first
+        notifications.sort(
+            key=lambda n: (n.created_at, n.reply.index if n.reply else -1),
+            reverse=True,
+        )
+        return notifications
+
+    async def get_backlog(
+        self, recipient_id: str, limit: int, after: str | None = None
+    ) -> list[BacklogEntry]:
+        """Unread notifications not pushed yet, collapsed per discussion.
+
+        The replies of threads notified on read are derived from their
+        events, as in ``get_notifications``. At most limit discussions are
+        returned, in discussion_id order, starting after ``after``.
+        """
+        await self.flush()
+        match: dict[str, Any] = {
+            "recipient_id": recipient_id,
+            "delivered": {"$ne": True},
+        }
+        if after is not None:
+            match["discussion_id"] = {"$gt": after}
+        docs = await self.notifications.aggregate(
+            [
+                {"$match": match},
+                {
+                    "$group": {
+                        "_id": "$discussion_id",
+                        "count": {"$sum": {"$ifNull": ["$count", 1]}},
+                        "types": {"$addToSet": "$notification_type"},
+                        "read_index": {"$max": "$reply.index"},
+                    }
+                },
+                {"$sort": {"_id": 1}},
+                {"$limit": limit},
+            ]
+        ).to_list(length=None)
+        entries = {
+            doc["_id"]: BacklogEntry(
+                discussion_id=doc["_id"],
+                notification_type=(
+                    NotificationType.MENTION
+                    if NotificationType.MENTION.value in doc["types"]
+                    else NotificationType.REPLY
+                ),
+                count=doc["count"],
+                read_index=(-1 if doc.get("read_index") is None else doc["read_index"]),
+            )
+            for doc in docs
+        }
+        for entry in await self._discussion_event_backlog(recipient_id, limit, after):
+            merged = entries.setdefault(entry.discussion_id, entry)
+            if merged is not entry:
+                merged.count += entry.count
+                merged.read_index = max(merged.read_index, entry.read_index)
+        return [entries[discussion_id] for discussion_id in sorted(entries)[:limit]]
+
+    async def _discussion_event_backlog(
+        self, recipient_id: str, limit: int, after: str | None
+    ) -> list[BacklogEntry]:
+        """Unread events of large threads not pushed yet, collapsed per discussion"""
+        discussion_ids = [
+            discussion_id
+            for discussion_id in await self._fanout_discussion_ids(recipient_id)
+            if after is None or discussion_id > after
+        ]
+        if not discussion_ids:
+            return []
+
+        marks = {
+            doc["discussion_id"]: max(
+                doc.get("read_index", -1), doc.get("delivered_index", -1)
+            )
+            async for doc in self.read_marks.find(
+                {"recipient_id": recipient_id, "discussion_id": {"$in": discussion_ids}}
+            )
+        }
+        # replies also notified individually, i.e. mentions, count once
+        notified: dict[str, list[int]] = {}
+        async for doc in self.notifications.find(
+            {
+                "recipient_id": recipient_id,
+                "discussion_id": {"$in": discussion_ids},
+                "reply.index": {"$exists": True},
+            },
+            {"discussion_id": 1, "reply.index": 1},
+        ):
+            notified.setdefault(doc["discussion_id"], []).append(doc["reply"]["index"])
+
+        docs = await self.discussion_events.aggregate(
+            [
+                {
+                    "$match": {
+                        "$or": [
+                            {
+                                "discussion_id": discussion_id,
+                                "reply.index": {
+                                    "$gt": marks.get(discussion_id, -1),
+                                    "$nin": notified.get(discussion_id, []),
+                                },
+                            }
+                            for discussion_id in discussion_ids
+                        ],
+                        "sender_id": {"$ne": recipient_id},
+                    }
+                },
+                {
+                    "$group": {
+                        "_id": "$discussion_id",
+                        "count": {"$sum": 1},
+                        "read_index": {"$max": "$reply.index"},
+                    }
+                },
+                {"$sort": {"_id": 1}},
+                {"$limit": limit},
+            ]
+        ).to_list(length=None)
+        return [
+            BacklogEntry(
+                discussion_id=doc["_id"],
+                notification_type=NotificationType.REPLY,
+                count=doc["count"],
+                read_index=doc["read_index"],
+            )
+            for doc in docs
+        ]
+
+    async def _fanout_discussion_ids(self, recipient_id: str) -> list[str]:
+        """The threads recipient_id takes part in that are notified on read"""
+        return [
+            doc["discussion_id"]
+            async for doc in self.db.discussions.find(
+                {"participants": recipient_id, "fanout_on_read": True},
+                {"_id": 0, "discussion_id": 1},
+            )
+        ]
+
+    async def _unread_discussion_events(
+        self, recipient_id: str, notified: set[tuple[str, int]]
+    ) -> list[Notification]:
+        """REPLY notifications derived from the events of large threads"""
+        discussion_ids = await self._fanout_discussion_ids(recipient_id)
+        if not discussion_ids:
+            return []
+
+        read_marks = {
+            doc["discussion_id"]: doc.get("read_index", -1)
+            async for doc in self.read_marks.find(
+                {"recipient_id": recipient_id, "discussion_id": {"$in": discussion_ids}}
+            )
+        }
+        # only the unread events are read, each range from the index
+        cursor = self.discussion_events.find(
+            {
+                "$or": [
+                    {
+                        "discussion_id": discussion_id,
+                        "reply.index": {"$gt": read_marks.get(discussion_id, -1)},
+                    }
+                    for discussion_id in discussion_ids
+                ],
+                "sender_id": {"$ne": recipient_id},
+            }
+        )
+        return [
+            Notification(
+                discussion_id=event["discussion_id"],
+                recipient_id=recipient_id,
+                sender_id=event["sender_id"],
+                notification_type=NotificationType.REPLY,
+                created_at=event["created_at"],
+                reply=Reply(**event["reply"]),
+            )
+            async for event in cursor
+            if (event["discussion_id"], event["reply"]["index"]) not in notified
+        ]
 
-    async def mark_as_read(self, recipient_id: str, discussion_id: str) -> None:
+    async def set_read_mark(
+        self, recipient_id: str, discussion_id: str, read_index: int
+    ) -> None:
+        """Treat the replies up to read_index as read by the recipient"""
+        await self.read_marks.update_one(
+            {"recipient_id": recipient_id, "discussion_id": discussion_id},
+            {"$max": {"read_index": read_index}},
+            upsert=True,
+        )
+
+    async def mark_delivered(
+        self,
+        recipient_id: str,
+        discussion_id: str,
+        read_index: int | None,
+        fanout_on_read: bool = False,
+    ) -> None:
+        """Keep what was pushed to a connected recipient out of their backlog.
+
+        read_index is the newest reply pushed, None when the push did not
+        carry replies, which counts every notification of the discussion
+        as delivered. The notifications stay unread.
+        """
+        # a queued notification must be written before it is flagged
+        await self.flush()
+        match: dict[str, Any] = {
+            "recipient_id": recipient_id,
+            "discussion_id": discussion_id,
+        }
+        if read_index is not None:
+            match["reply.index"] = {"$not": {"$gt": read_index}}
+        await self.notifications.update_many(match, {"$set": {"delivered": True}})
+        if fanout_on_read and read_index is not None:
+            await self.read_marks.update_one(
+                {"recipient_id": recipient_id, "discussion_id": discussion_id},
+                {"$max": {"delivered_index": read_index}},
+                upsert=True,
+            )
+
+    async def mark_as_read(
+        self, recipient_id: str, discussion_id: str, read_index: int | None = None
+    ) -> None:
         """Mark notifications as read for a specific discussion"""
+        await self.mark_many_as_read(recipient_id, {discussion_id: read_index})
+
+    async def mark_many_as_read(
+        self, recipient_id: str, read_indexes: Mapping[str, int | None]
+    ) -> None:
+        """Mark notifications as read for several discussions at once.
+
+        read_indexes maps each discussion to the index of the last reply
+        the recipient saw. None stands for the last reply the recipient
+        was notified of, as a reply that is counted but not notified yet
+        has not been seen.
+        """
+        if not read_indexes:
+            return
+
+        # a queued notification must not be written after it was read
+        await self.flush()
+        read_indexes = {
+            **await self._notified_indexes(recipient_id, list(read_indexes)),
+            **{
+                discussion_id: index
+                for discussion_id, index in read_indexes.items()
+                if index is not None
+            },
+        }
+        conditions: list[dict[str, Any]] = [
+            {"discussion_id": discussion_id}
+            for discussion_id in read_indexes
+            if read_indexes[discussion_id] is None
+        ]
+        conditions += [
+            # notifications stored without their reply are read as well
+            {"discussion_id": discussion_id, "reply.index": {"$not": {"$gt": index}}}
+            for discussion_id, index in read_indexes.items()
+            if index is not None
+        ]
         await self.notifications.delete_many(
-            {"recipient_id": recipient_id, "discussion_id": discussion_id}
+            {"recipient_id": recipient_id, "$or": conditions}
+        )
+        # reply indexes order replies exactly, unlike millisecond timestamps
+        await asyncio.gather(
+            *[
+                self.set_read_mark(recipient_id, discussion_id, index)
+                for discussion_id, index in read_indexes.items()
+                if index is not None
+            ]
         )
+
+    async def _notified_indexes(
+        self, recipient_id: str, discussion_ids: list[str]
+    ) -> dict[str, int | None]:
+        """Index of the last reply notified to the recipient, per discussion"""
+        notified: dict[str, int | None] = dict.fromkeys(discussion_ids)
+        for collection, match in [
+            (self.notifications, {"recipient_id": recipient_id}),
+            (self.discussion_events, {}),
+        ]:
+            docs = await collection.aggregate(
+                [
+                    {"$match": {**match, "discussion_id": {"$in": discussion_ids}}},
+                    {
+                        "$group": {
+                            "_id": "$discussion_id",
+                            "index": {"$max": "$reply.index"},
+                        }
+                    },
+                ]
+            ).to_list(length=None)
+            for doc in docs:
+                if doc["index"] is not None:
+                    notified[doc["_id"]] = max(notified[doc["_id"]] or -1, doc["index"])
+        return notified
+
+    async def compact(self) -> int:
+        """Merge the notifications of each recipient and discussion into one.
+
+        Recipients are compacted one at a time, in the order of the
+        ``(recipient_id, discussion_id)`` index, so a run reads a single
+        recipient's notifications at once and goes through all of them.
+        Returns the number of notifications deleted.
+        """
+        await self.flush()
+        deleted = 0
+        recipient_id = None
+        while True:
+            doc = await self.notifications.find_one(
+                {} if recipient_id is None else {"recipient_id": {"$gt": recipient_id}},
+                {"recipient_id": 1},
+                sort=[("recipient_id", ASCENDING), ("discussion_id", ASCENDING)],
+            )
+            if doc is None:
+                return deleted
+            recipient_id = doc["recipient_id"]
+            deleted += await self.compact_recipient(recipient_id)
+
+    async def compact_recipient(self, recipient_id: str) -> int:
+        """Merge the notifications of recipient_id per discussion.
+
+        The newest notification of a discussion is kept, as a MENTION if
+        any of them is one, and counts the others, which are deleted. Only
+        the documents read by the aggregation are touched, so notifications
+        written or read meanwhile are left alone. Discussions notified on
+        read are skipped: their notifications are mentions whose reply
+        indexes tell ``get_notifications`` which events were notified.
+        """
+        fanout_ids = await self._fanout_discussion_ids(recipient_id)
+        groups = await self.notifications.aggregate(
+            [
+                {
+                    "$match": {
+                        "recipient_id": recipient_id,
+                        "discussion_id": {"$nin": fanout_ids},
+                    }
+                },
+                {"$sort": {"discussion_id": ASCENDING, "created_at": ASCENDING}},
+                {
+                    "$group": {
+                        # delivered notifications are merged apart, so the
+                        # backlog still counts the others
+                        "_id": {
+                            "discussion_id": "$discussion_id",
+                            "delivered": "$delivered",
+                        },
+                        "ids": {"$push": "$_id"},
+                        "count": {"$sum": {"$ifNull": ["$count", 1]}},
+                        "types": {"$addToSet": "$notification_type"},
+                    }
+                },
+                {"$match": {"ids.1": {"$exists": True}}},
+            ]
+        ).to_list(length=None)
+
+        deleted = 0
+        for group in groups:
+            *merged_ids, kept_id = group["ids"]
+            notification_type = (
+                NotificationType.MENTION
+                if NotificationType.MENTION.value in group["types"]
+                else NotificationType.REPLY
+            )
+            await self.notifications.update_one(
+                {"_id": kept_id},
+                {
+                    "$set": {
+                        "count": group["count"],
+                        "notification_type": notification_type.value,
+                    }
+                },
+            )
+            result = await self.notifications.delete_many({"_id": {"$in": merged_ids}})
+            deleted += result.deleted_count
+        return deleted
+
+    def indexes(self) -> list[IndexSpec]:
+        notifications = self.notifications.name
+        indexes = [
+            IndexSpec(
+                notifications, [("recipient_id", ASCENDING), ("created_at", DESCENDING)]
+            ),
+            IndexSpec(
+                notifications,
+                [("recipient_id", ASCENDING), ("discussion_id", ASCENDING)],
+            ),
+            IndexSpec(
+                self.discussion_events.name,
+                [("discussion_id", ASCENDING), ("reply.index", ASCENDING)],
+            ),
+            IndexSpec(
+                self.read_marks.name,
+                [("recipient_id", ASCENDING), ("discussion_id", ASCENDING)],
+                {"unique": True},
+            ),
+        ]
+        # a ttl of 0 disables expiry, dropping a TTL index built before
+        indexes += [
+            IndexSpec(
+                collection.name,
+                [("created_at", ASCENDING)],
+                {"name": self.TTL_INDEX, "expireAfterSeconds": self.ttl},
+                drop=self.ttl <= 0,
+            )
+            for collection in (self.notifications, self.discussion_events)
+        ]
+        return indexes
+
+    def hot_queries(self) -> list[QueryShape]:
+        notifications = self.notifications.name
+        return [
+            QueryShape(
+                notifications, {"recipient_id": ""}, [("created_at", DESCENDING)]
+            ),
+            QueryShape(
+                notifications, {"recipient_id": "", "discussion_id": {"$gt": ""}}
+            ),
+            QueryShape(
+                self.discussion_events.name,
+                {"$or": [{"discussion_id": "", "reply.index": {"$gt": -1}}]},
+            ),
+            QueryShape(
+                self.read_marks.name,
+                {"recipient_id": "", "discussion_id": {"$in": [""]}},
+            ),
+        ]
@@ -1,53 +1,107 @@
 import logging
+from collections.abc import Callable
 from datetime import datetime
 from typing import Any
 
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING
 
-from server.entities.session import Session
+from server.entities.session import PushFormat, Session
+from server.indexes import IndexSpec, QueryShape
 
 
 class SessionService:
+    """Sessions of the connections served by this process.
+
+    Every session is written through to the ``sessions`` collection, which
+    stays the durable copy, but lookups are served from memory only: a peer
+    can only ever be connected to the process that signed it in.
+    """
+
     def __init__(self, db: AsyncIOMotorDatabase[Any]) -> None:
         self.sessions = db.sessions
+        self._sessions: dict[str, Session] = {}
+        self._peers_by_user: dict[str, set[str]] = {}
+        self._presence_listeners: list[Callable[[], None]] = []
+        # connection options, which outlive sign-outs
+        self._push_formats: dict[str, PushFormat] = {}
 
     async def set(self, peer_id: str, user_id: str) -> None:
         logging.info(f"Setting session for {peer_id} to {user_id}")
-        session_doc = {
-            "peer_id": peer_id,
-            "user_id": user_id,
-            "created_at": datetime.now(),
-        }
+        session = Session(peer_id=peer_id, user_id=user_id, created_at=datetime.now())
         await self.sessions.update_one(
-            {"peer_id": peer_id}, {"$set": session_doc}, upsert=True
+            {"peer_id": peer_id}, {"$set": vars(session)}, upsert=True
         )
+        self._forget_peer(peer_id)
+        self._sessions[peer_id] = session
+        if user_id not in self._peers_by_user:
+            self._peers_by_user[user_id] = set()
+            self._presence_changed()
+        self._peers_by_user[user_id].add(peer_id)
 
     async def get_client_id(self, peer_id: str | None) -> str | None:
-        if peer_id is None:
-            return None
-        session_doc = await self.sessions.find_one({"peer_id": peer_id}, {"_id": 0})
-        if not session_doc:
+        session = await self.get_session(peer_id)
+        if session is None:
             return None
-        session = Session(**session_doc)
         return session.user_id
 
     async def get_by_user_id(self, user_id: str | None) -> str | None:
         if user_id is None:
             return None
-        session_doc = await self.sessions.find_one({"user_id": user_id}, {"_id": 0})
-        if not session_doc:
-            return None
-        session = Session(**session_doc)
-        return session.peer_id
+        return next(iter(self.get_peer_ids(user_id)), None)
+
+    def get_peer_ids(self, user_id: str) -> frozenset[str]:
+        """Local peers the user is signed in on"""
+        return frozenset(self._peers_by_user.get(user_id, ()))
+
+    def get_present_user_ids(self) -> frozenset[str]:
+        """Users signed in on at least one local peer"""
+        return frozenset(self._peers_by_user)
+
+    def add_presence_listener(self, listener: Callable[[], None]) -> None:
+        """Call listener whenever a user comes online or goes offline locally"""
+        self._presence_listeners.append(listener)
+
+    def _presence_changed(self) -> None:
+        for listener in self._presence_listeners:
+            listener()
+
+    def _forget_peer(self, peer_id: str) -> None:
+        session = self._sessions.pop(peer_id, None)
+        if session is None:
+            return
+        peer_ids = self._peers_by_user[session.user_id]
+        peer_ids.discard(peer_id)
+        if not peer_ids:
+            del self._peers_by_user[session.user_id]
+            self._presence_changed()
 
     async def get_session(self, peer_id: str | None) -> Session | None:
         if peer_id is None:
             return None
-        session_doc = await self.sessions.find_one({"peer_id": peer_id}, {"_id": 0})
-        if not session_doc:
-            return None
-        return Session(**session_doc)
+        return self._sessions.get(peer_id)
 
     async def delete(self, peer_id: str | None) -> None:
         if peer_id is not None:
+            self._forget_peer(peer_id)
             await self.sessions.delete_one({"peer_id": peer_id})
+
+    async def close(self, peer_id: str) -> None:
+        """Forget the session and the options of a closed connection"""
+        self._push_formats.pop(peer_id, None)
+        await self.delete(peer_id)
+
+    def indexes(self) -> list[IndexSpec]:
+        return [
+            IndexSpec(self.sessions.name, [("peer_id", ASCENDING)], {"unique": True})
+        ]
+
+    def hot_queries(self) -> list[QueryShape]:
+        # the writes every sign-in and disconnection make
+        return [QueryShape(self.sessions.name, {"peer_id": ""})]
+
+    def set_push_format(self, peer_id: str, push_format: PushFormat) -> None:
+        self._push_formats[peer_id] = push_format
+
+    def get_push_format(self, peer_id: str) -> PushFormat:
+        return self._push_formats.get(peer_id, PushFormat.BASIC)
@@ -4,6 +4,7 @@ from re import compile
 class ValidationService:
     REQUEST_ID_PATTERN = compile(r"^[a-z]{7}$")
     ALPHANUMERIC_PATTERN = compile(r"^[a-zA-Z0-9]+$")
+    TIME_MARKER_PATTERN = compile(r"^(?:(\d+)m)?(?:(\d+)s)$")
 
     @classmethod
     def validate_request_id(cls, request_id: str) -> bool:
@@ -21,5 +22,13 @@ class ValidationService:
 
         if not cls.validate_alphanumeric(parts[0]):
             return False
-        time_pattern = compile(r"^(?:\d+m)?(?:\d+s)$")
-        return bool(time_pattern.match(parts[1]))
+        return bool(cls.TIME_MARKER_PATTERN.match(parts[1]))
+
+    @classmethod
+    def time_marker_seconds(cls, time_marker: str) -> int:
+        """Offset in seconds of a time marker such as 1m30s"""
+        match = cls.TIME_MARKER_PATTERN.match(time_marker)
+        if not match:
+            raise ValueError(f"Invalid time marker {time_marker}")
+        minutes, seconds = match.groups()
+        return int(minutes or 0) * 60 + int(seconds)
@@ -0,0 +1,77 @@
+"""Rendering of discussions into response parameters."""
+
+from dataclasses import dataclass
+
+from server.entities.discussion import Discussion, DiscussionSummary, Reply
+from server.entities.notification import BacklogEntry
+
+
+def format_reply(reply: Reply) -> str:
+    return f"{reply.client_id}|{reply.comment}"
+
+
+def format_replies(discussion: Discussion) -> str:
+    return ",".join(format_reply(reply) for reply in discussion.replies)
+
+
+def format_discussion(discussion: Discussion) -> str:
+    return (
+        f"{discussion.discussion_id}|{discussion.reference_prefix}.{discussion.time_marker}"
+        f"|({format_replies(discussion)})"
+    )
+
+
+def format_reply_push(discussion_id: str, reply: Reply) -> str:
+    return f"DISCUSSION_REPLY|{discussion_id}|{reply.index}|{format_reply(reply)}\n"
+
+
+def format_backlog_push(batch_id: int, entries: list[BacklogEntry]) -> str:
+    collapsed = ",".join(
+        f"{entry.discussion_id}|{entry.notification_type.value}|{entry.count}"
+        for entry in entries
+    )
+    return f"NOTIFICATION_BACKLOG|{batch_id}|({collapsed})\n"
+
+
+def format_summary(summary: DiscussionSummary) -> str:
+    last_activity_at = summary.last_activity_at.isoformat(timespec="seconds")
+    return (
+        f"{summary.discussion_id}|{summary.reference_prefix}.{summary.time_marker}"
+        f"|{summary.reply_count}|{last_activity_at}|{summary.first_comment}"
+    )
+
+
+@dataclass(frozen=True)
+class EncodedDiscussion:
+    """A discussion rendered once, to which new replies are appended.
+
+    ``head`` is ``format_discussion`` without its closing parenthesis and
+    ``reply_count`` the number of reply positions rendered into it, which
+    includes the positions of replies lost to a failed write.
+    """
+
+    head: str
+    reply_count: int
+
+    @classmethod
+    def of(
+        cls, discussion: Discussion, reply_count: int | None = None
+    ) -> "EncodedDiscussion":
+        if reply_count is None:
+            reply_count = len(discussion.replies)
+        return cls(format_discussion(discussion)[:-1], reply_count)
+
+    @property
+    def params(self) -> str:
+        return self.head + ")"
+
+    def append(self, reply: Reply) -> "EncodedDiscussion":
+        separator = "," if self.reply_count else ""
+        return EncodedDiscussion(
+            self.head + separator + format_reply(reply), self.reply_count + 1
+        )
+
+
+def encoded_size(encoded: EncodedDiscussion) -> int:
+    """Rough number of bytes a cached encoded discussion holds"""
+    return 100 + len(encoded.head)
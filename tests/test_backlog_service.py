@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+from server.di import Container
+
+TEST_PEER = "127.0.0.1:8001"
+
+
+def _reply(index: int) -> dict[str, object]:
+    return {"client_id": "user2", "comment": "hi", "created_at": None, "index": index}
+
+
+@pytest.mark.asyncio
+async def test_acknowledge_keeps_notifications_stored_after_the_batch(
+    container: Container,
+) -> None:
+    notification_service = container.notification_service()
+    backlog_service = container.backlog_service()
+    pushed: list[str] = []
+    backlog_service.attach(TEST_PEER, pushed.append)
+    await notification_service.notify("abc1234", "user2", _reply(1), ["user1"])
+
+    backlog_service.start(TEST_PEER, "user1")
+    await asyncio.sleep(0.01)
+    assert pushed == ["NOTIFICATION_BACKLOG|1|(abc1234|reply|1)\n"]
+
+    # a reply comes in after the batch was pushed
+    await notification_service.notify("abc1234", "user2", _reply(2), ["user1"])
+    await backlog_service.acknowledge(TEST_PEER, 1)
+
+    (notification,) = await notification_service.get_notifications("user1")
+    assert notification.reply is not None and notification.reply.index == 2
+    backlog_service.detach(TEST_PEER)
@@ -0,0 +1,110 @@
+from server.cache import LruCache
+from server.di import Container
+from server.discussion_cache import DiscussionCacheInvalidator
+
+
+def test_evicts_least_recently_used_entry() -> None:
+    cache: LruCache[str, str] = LruCache(max_entries=2, max_bytes=100, sizeof=len)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+
+    cache.put("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.stats.evictions == 1
+    assert (cache.stats.hits, cache.stats.misses) == (2, 1)
+
+
+def test_evicts_until_under_byte_bound() -> None:
+    cache: LruCache[str, str] = LruCache(max_entries=10, max_bytes=10, sizeof=len)
+    cache.put("a", "xxxx")
+    cache.put("b", "xxxx")
+    cache.put("c", "xxxxxx")
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "xxxx"
+    assert cache.stats.bytes == 10
+    assert cache.put("d", "x" * 11) is False
+
+
+def test_put_ignores_value_read_before_an_invalidation() -> None:
+    cache: LruCache[str, str] = LruCache(max_entries=10, max_bytes=100, sizeof=len)
+    cache.put("a", "old")
+    version = cache.version
+
+    cache.invalidate("a")
+
+    assert cache.put("a", "old", version) is False
+    assert cache.get("a") is None
+    assert cache.stats.invalidations == 1
+
+
+async def test_encoded_discussion_is_appended_to_on_reply(
+    container: Container,
+) -> None:
+    discussion_service = container.discussion_service()
+    cache = container.discussion_cache()
+    discussion_id = await discussion_service.create_discussion(
+        "ref.30s", "Initial comment", "user1"
+    )
+
+    encoded = await discussion_service.get_encoded_discussion(discussion_id)
+    assert encoded == f"{discussion_id}|ref.30s|(user1|Initial comment)"
+    assert await discussion_service.get_encoded_discussion(discussion_id) == encoded
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+    await discussion_service.create_reply(discussion_id, "Reply, with comma", "user2")
+
+    assert await discussion_service.get_encoded_discussion(discussion_id) == (
+        f'{discussion_id}|ref.30s|(user1|Initial comment,user2|"Reply, with comma")'
+    )
+    assert (cache.stats.hits, cache.stats.misses) == (2, 1)
+
+
+async def test_out_of_order_append_invalidates(container: Container) -> None:
+    discussion_service = container.discussion_service()
+    cache = container.discussion_cache()
+    discussion_id = await discussion_service.create_discussion(
+        "ref.30s", "Initial comment", "user1"
+    )
+    await discussion_service.get_encoded_discussion(discussion_id)
+    await container.db().discussions.update_one(
+        {"discussion_id": discussion_id}, {"$inc": {"reply_count": 1}}
+    )
+
+    await discussion_service.create_reply(discussion_id, "Reply", "user2")
+
+    assert cache.peek(discussion_id) is None
+
+
+async def test_invalidator_evicts_outdated_discussions(container: Container) -> None:
+    cache = container.discussion_cache()
+    invalidator = DiscussionCacheInvalidator(container.db().discussions, cache)
+    discussion_service = container.discussion_service()
+    discussion_id = await discussion_service.create_discussion(
+        "ref.30s", "Initial comment", "user1"
+    )
+    await discussion_service.get_encoded_discussion(discussion_id)
+    other_id = await discussion_service.create_discussion(
+        "ref.30s", "Other comment", "user1"
+    )
+    await discussion_service.get_encoded_discussion(other_id)
+
+    # a reply this node has already appended
+    await invalidator.handle(
+        {"fullDocument": {"discussion_id": discussion_id, "reply_count": 1}}
+    )
+    assert cache.peek(discussion_id) is not None
+
+    # a reply written by another node
+    await invalidator.handle(
+        {"fullDocument": {"discussion_id": discussion_id, "reply_count": 2}}
+    )
+    assert cache.peek(discussion_id) is None
+    assert cache.peek(other_id) is not None
+
+    invalidator._history_lost()
+    assert cache.peek(other_id) is None
+    assert invalidator.stats.gaps == 1
@@ -0,0 +1,191 @@
+import asyncio
+from collections.abc import Callable
+from typing import Any, cast
+
+from pymongo.errors import OperationFailure
+
+from server.change_stream import (
+    CHANGE_STREAM_HISTORY_LOST,
+    Backoff,
+    ChangeStreamWatcher,
+    ResumeTokenStore,
+)
+from server.di import Container
+
+NO_DELAY = Backoff(initial=0, maximum=0)
+
+
+class FakeStream:
+    def __init__(self, events: list[dict[str, Any]], error: Exception | None) -> None:
+        self.events = events
+        self.error = error
+        self.alive = True
+        self.resume_token: Any = None
+
+    async def __aenter__(self) -> "FakeStream":
+        return self
+
+    async def __aexit__(self, *args: object) -> None:
+        pass
+
+    async def try_next(self) -> dict[str, Any] | None:
+        if not self.events:
+            if self.error is not None:
+                raise self.error
+            await asyncio.Event().wait()
+
+        event = self.events.pop(0)
+        if "postBatchResumeToken" in event:
+            # an empty batch: nothing matched, but the stream moved on
+            self.resume_token = event["postBatchResumeToken"]
+            return None
+        self.resume_token = event["_id"]
+        return event
+
+
+class FakeCollection:
+    """Replays one scripted (events, error) pair per opened stream"""
+
+    name = "notifications"
+
+    def __init__(self, scripts: list[tuple[list[dict[str, Any]], Exception | None]]):
+        self.scripts = scripts
+        self.opened_after: list[Any] = []
+        self.pipelines: list[list[dict[str, Any]]] = []
+
+    def watch(self, pipeline: list[dict[str, Any]], start_after: Any) -> FakeStream:
+        self.opened_after.append(start_after)
+        self.pipelines.append(pipeline)
+        events, error = self.scripts.pop(0) if self.scripts else ([], None)
+        return FakeStream(events, error)
+
+
+async def _eventually(predicate: Callable[[], bool]) -> None:
+    for _ in range(100):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+
+
+def _event(token: int) -> dict[str, Any]:
+    return {"_id": {"_data": str(token)}, "fullDocument": {"n": token}}
+
+
+def _empty_batch(token: int) -> dict[str, Any]:
+    return {"postBatchResumeToken": {"_data": str(token)}}
+
+
+async def _watch(
+    container: Container, collection: FakeCollection
+) -> tuple[ChangeStreamWatcher, list[int]]:
+    handled: list[int] = []
+
+    async def handle(change: dict[str, Any]) -> None:
+        handled.append(change["fullDocument"]["n"])
+
+    tokens = ResumeTokenStore(
+        container.db().change_stream_checkpoints, "notifications:test"
+    )
+    watcher = ChangeStreamWatcher(
+        cast(Any, collection), handle, tokens, backoff=NO_DELAY
+    )
+    task = asyncio.create_task(watcher.run())
+    await asyncio.sleep(0.05)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return watcher, handled
+
+
+async def test_watcher_resumes_after_last_handled_event(container: Container) -> None:
+    collection = FakeCollection(
+        [([_event(1), _event(2)], ConnectionError("primary stepped down"))]
+    )
+    watcher, handled = await _watch(container, collection)
+
+    assert handled == [1, 2]
+    assert collection.opened_after[:2] == [None, {"_data": "2"}]
+    assert watcher.stats.reconnects == 1
+    assert watcher.stats.events == 2
+
+
+async def test_watcher_resumes_past_filtered_out_changes(
+    container: Container,
+) -> None:
+    collection = FakeCollection(
+        [([_event(1), _empty_batch(5)], ConnectionError("primary stepped down"))]
+    )
+    watcher, handled = await _watch(container, collection)
+
+    assert handled == [1]
+    assert collection.opened_after[:2] == [None, {"_data": "5"}]
+    assert watcher.stats.events == 1
+
+    restarted = FakeCollection([])
+    await _watch(container, restarted)
+    assert restarted.opened_after[0] == {"_data": "5"}
+
+
+async def test_watcher_restarts_from_now_when_history_is_lost(
+    container: Container,
+) -> None:
+    collection = FakeCollection(
+        [
+            ([_event(1)], ConnectionError("primary stepped down")),
+            ([], OperationFailure("history lost", CHANGE_STREAM_HISTORY_LOST)),
+            ([_event(3)], None),
+        ]
+    )
+    watcher, handled = await _watch(container, collection)
+
+    assert handled == [1, 3]
+    assert collection.opened_after == [None, {"_data": "1"}, None]
+    assert watcher.stats.gaps == 1
+
+
+async def test_watcher_starts_from_persisted_token(container: Container) -> None:
+    await _watch(container, FakeCollection([([_event(1), _event(2)], None)]))
+
+    collection = FakeCollection([([_event(3)], None)])
+    watcher, handled = await _watch(container, collection)
+
+    assert collection.opened_after == [{"_data": "2"}]
+    assert handled == [3]
+    assert watcher.stats.checkpoints >= 1
+
+
+async def test_restart_reopens_with_current_pipeline(container: Container) -> None:
+    collection = FakeCollection([([_event(1)], None)])
+    recipients = ["user1"]
+
+    async def handle(change: dict[str, Any]) -> None:
+        pass
+
+    watcher = ChangeStreamWatcher(
+        cast(Any, collection),
+        handle,
+        ResumeTokenStore(container.db().change_stream_checkpoints, "test"),
+        pipeline=lambda: [{"$match": {"recipient_id": {"$in": list(recipients)}}}],
+        backoff=NO_DELAY,
+    )
+    watcher.restart_delay = 0
+    task = asyncio.create_task(watcher.run())
+    await _eventually(lambda: watcher.stats.events == 1)
+
+    recipients.append("user2")
+    watcher.restart()
+    await _eventually(lambda: len(collection.opened_after) == 2)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+    assert collection.opened_after == [None, {"_data": "1"}]
+    assert collection.pipelines[-1] == [
+        {"$match": {"recipient_id": {"$in": ["user1", "user2"]}}}
+    ]
+    assert watcher.stats.restarts == 1
+    assert watcher.stats.reconnects == 0
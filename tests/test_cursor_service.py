@@ -0,0 +1,50 @@
+import unittest
+from datetime import datetime
+
+from server.entities.page_cursor import PageCursor, PageKind
+from server.services.cursor_service import CursorService
+
+
+class TestCursorService(unittest.TestCase):
+    def test_round_trip(self) -> None:
+        cursors = [
+            PageCursor(kind=PageKind.DISCUSSIONS, page_size=10),
+            PageCursor(
+                kind=PageKind.DISCUSSIONS,
+                page_size=10,
+                reference_prefix="abc123",
+                created_at=datetime(2024, 5, 1, 12, 30, 15, 123000),
+                discussion_id="x1y2z3a",
+            ),
+            PageCursor(
+                kind=PageKind.REPLIES, page_size=5, discussion_id="x1y2z3a", offset=20
+            ),
+        ]
+        for cursor in cursors:
+            token = CursorService.encode(cursor)
+            self.assertNotIn("|", token)
+            self.assertNotIn(",", token)
+            self.assertEqual(CursorService.decode(token), cursor)
+
+    def test_decode_failures(self) -> None:
+        for token in ["", "not a cursor", "e30", "WzFd", "eyJrIjoieCIsIm4iOjF9"]:
+            with self.assertRaises(ValueError):
+                CursorService.decode(token)
+
+        oversized = CursorService.encode(
+            PageCursor(kind=PageKind.DISCUSSIONS, page_size=1000)
+        )
+        with self.assertRaises(ValueError):
+            CursorService.decode(oversized)
+
+    def test_parse_page_size(self) -> None:
+        self.assertEqual(CursorService.parse_page_size("1"), 1)
+        self.assertEqual(CursorService.parse_page_size("100"), 100)
+
+        for value in ["0", "101", "-1", "ten", ""]:
+            with self.assertRaises(ValueError):
+                CursorService.parse_page_size(value)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
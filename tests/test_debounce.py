@@ -0,0 +1,58 @@
+import asyncio
+
+from server.debounce import PushDebouncer
+
+
+async def test_pushes_within_window_are_collapsed() -> None:
+    delivered: list[tuple[str, str]] = []
+    debouncer = PushDebouncer(lambda *key: delivered.append(key), window=0.01)
+
+    debouncer.submit("user1", "abc1234")  # reply notification
+    debouncer.submit("user1", "abc1234")  # mention notification of the same reply
+    debouncer.submit("user2", "abc1234")
+    debouncer.submit("user1", "def5678")
+    assert delivered == []
+
+    await asyncio.sleep(0.02)
+
+    assert sorted(delivered) == [
+        ("user1", "abc1234"),
+        ("user1", "def5678"),
+        ("user2", "abc1234"),
+    ]
+    assert debouncer.stats.pushes == 3
+    assert debouncer.stats.collapsed == 1
+
+
+async def test_next_window_pushes_again() -> None:
+    delivered: list[tuple[str, str]] = []
+    debouncer = PushDebouncer(lambda *key: delivered.append(key), window=0.01)
+
+    debouncer.submit("user1", "abc1234")
+    await asyncio.sleep(0.02)
+    debouncer.submit("user1", "abc1234")
+    await asyncio.sleep(0.02)
+
+    assert delivered == [("user1", "abc1234"), ("user1", "abc1234")]
+    assert debouncer.stats.collapsed == 0
+
+
+async def test_zero_window_delivers_immediately() -> None:
+    delivered: list[tuple[str, str]] = []
+    debouncer = PushDebouncer(lambda *key: delivered.append(key), window=0)
+
+    debouncer.submit("user1", "abc1234")
+    debouncer.submit("user1", "abc1234")
+
+    assert delivered == [("user1", "abc1234"), ("user1", "abc1234")]
+
+
+async def test_close_drops_pending_pushes() -> None:
+    delivered: list[tuple[str, str]] = []
+    debouncer = PushDebouncer(lambda *key: delivered.append(key), window=0.01)
+
+    debouncer.submit("user1", "abc1234")
+    debouncer.close()
+    await asyncio.sleep(0.02)
+
+    assert delivered == []
@@ -1,4 +1,8 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
 import pytest
+from pymongo.errors import OperationFailure
 
 from server.di import Container
 
@@ -71,3 +75,280 @@ async def test_get_discussion(container: Container) -> None:
     assert discussion.time_marker == "30s"
     assert discussion.client_id == "user1"
     assert discussion.replies[0].comment == "test comment 3"
+
+
+@pytest.mark.asyncio
+async def test_create_reply_maintains_participants(container: Container) -> None:
+    discussion_service = container.discussion_service()
+    discussion_id = await discussion_service.create_discussion(
+        "ref.30s", "Initial comment", "user1"
+    )
+    await discussion_service.create_reply(discussion_id, "Reply 1", "user2")
+    await discussion_service.create_reply(discussion_id, "Reply 2", "user1")
+    await discussion_service.create_reply(discussion_id, "Reply 3", "user3")
+
+    discussion_doc = await container.db().discussions.find_one(
+        {"discussion_id": discussion_id}
+    )
+    assert discussion_doc is not None
+    assert discussion_doc["participants"] == ["user1", "user2", "user3"]
+    assert discussion_doc["reply_count"] == 4
+
+
+@pytest.mark.asyncio
+async def test_create_reply_backfills_participants(container: Container) -> None:
+    discussion_service = container.discussion_service()
+    notification_service = container.notification_service()
+    discussion_id = await discussion_service.create_discussion(
+        "ref.30s", "Initial comment", "user1"
+    )
+    await discussion_service.create_reply(discussion_id, "Reply 1", "user2")
+    await container.db().discussions.update_one(
+        {"discussion_id": discussion_id}, {"$unset": {"participants": ""}}
+    )
+
+    await discussion_service.create_reply(discussion_id, "Reply 2", "user3")
+
+    discussion_doc = await container.db().discussions.find_one(
+        {"discussion_id": discussion_id}
+    )
+    assert discussion_doc is not None
+    assert sorted(discussion_doc["participants"]) == ["user1", "user2", "user3"]
+    assert len(await notification_service.get_notifications("user2")) == 1
+
+
+@pytest.mark.asyncio
+async def test_backfill_time_markers(container: Container) -> None:
+    discussion_service = container.discussion_service()
+    discussion_id = await discussion_service.create_discussion(
+        reference="test.1m30s", comment="Initial comment", client_id="user1"
+    )
+    await container.db().discussions.update_one(
+        {"discussion_id": discussion_id}, {"$unset": {"time_marker_seconds": ""}}
+    )
+
+    assert await discussion_service.backfill_time_markers() == 1
+    assert await discussion_service.backfill_time_markers() == 0
+
+    doc = await container.db().discussions.find_one({"discussion_id": discussion_id})
+    assert doc is not None
+    assert doc["time_marker_seconds"] == 90
+
+
+@pytest.mark.asyncio
+async def test_replies_spill_into_new_buckets(container: Container) -> None:
+    discussion_service = container.discussion_service()
+    discussion_service.REPLY_BUCKET_SIZE = 2
+    discussion_id = await discussion_service.create_discussion(
+        "ref.30s", "Initial comment", "user1"
+    )
+    for i in range(4):
+        await discussion_service.create_reply(discussion_id, f"Reply {i}", "user2")
+
+    buckets = (
+        await container.db()
+        .reply_buckets.find({"discussion_id": discussion_id})
+        .to_list(length=None)
+    )
+    assert sorted(len(bucket["replies"]) for bucket in buckets) == [1, 2, 2]
+
+    discussion = await discussion_service.get_discussion(discussion_id)
+    assert [reply.comment for reply in discussion.replies] == [
+        "Initial comment",
+        "Reply 0",
+        "Reply 1",
+        "Reply 2",
+        "Reply 3",
+    ]
+
+    page, next_offset = await discussion_service.get_discussion_page(
+        discussion_id, 1, 2
+    )
+    assert [reply.index for reply in page.replies] == [1, 2]
+    assert next_offset == 3
+
+
+@pytest.mark.asyncio
+async def test_migrations_run_once(container: Container) -> None:
+    discussion_service = container.discussion_service()
+    await container.db().discussions.insert_one(
+        {"discussion_id": "legacy1", "time_marker": "30s", "first_comment": "c"}
+    )
+
+    await discussion_service.migrate()
+    doc = await container.db().discussions.find_one({"discussion_id": "legacy1"})
+    assert doc is not None and doc["time_marker_seconds"] == 30
+
+    with patch.object(
+        discussion_service, "backfill_time_markers", side_effect=AssertionError
+    ):
+        await discussion_service.migrate()
+
+
+@pytest.mark.asyncio
+async def test_migrate_reply_buckets(container: Container) -> None:
+    discussion_service = container.discussion_service()
+    discussion_service.REPLY_BUCKET_SIZE = 2
+    created_at = datetime.now()
+    await container.db().discussions.insert_one(
+        {
+            "discussion_id": "legacy1",
+            "reference_prefix": "ref",
+            "time_marker": "30s",
+            "client_id": "user1",
+            "created_at": created_at,
+            "replies": [
+                {"client_id": f"user{i}", "comment": f"c{i}", "created_at": created_at}
+                for i in range(3)
+            ],
+        }
+    )
+
+    assert await discussion_service.migrate_reply_buckets() == 1
+    assert await discussion_service.migrate_reply_buckets() == 0
+
+    doc = await container.db().discussions.find_one({"discussion_id": "legacy1"})
+    assert doc is not None
+    assert "replies" not in doc
+    assert doc["reply_count"] == 3
+
+    await discussion_service.create_reply("legacy1", "c3", "user3")
+    discussion = await discussion_service.get_discussion("legacy1")
+    assert [reply.comment for reply in discussion.replies] == ["c0", "c1", "c2", "c3"]
+
+
+@pytest.mark.asyncio
+async def test_backfill_summaries(container: Container) -> None:
+    discussion_service = container.discussion_service()
+    discussion_id = await discussion_service.create_discussion(
+        "ref.30s", "Initial comment", "user1"
+    )
+    await discussion_service.create_reply(discussion_id, "Reply", "user2")
+    expected = await container.db().discussions.find_one(
+        {"discussion_id": discussion_id}
+    )
+    assert expected is not None
+    await container.db().discussions.update_one(
+        {"discussion_id": discussion_id},
+        {"$unset": {"first_comment": "", "last_activity_at": ""}},
+    )
+
+    assert await discussion_service.backfill_summaries() == 1
+
+    (summary,) = [s async for s in discussion_service.iter_discussion_summaries()]
+    assert summary.first_comment == "Initial comment"
+    assert summary.reply_count == 2
+    assert summary.last_activity_at == expected["last_activity_at"]
+
+
+@pytest.mark.asyncio
+async def test_get_replies_since_stops_at_a_reply_being_appended(
+    container: Container,
+) -> None:
+    discussion_service = container.discussion_service()
+    discussion_service.REPLY_BUCKET_SIZE = 2
+    discussion_id = await discussion_service.create_discussion(
+        "ref.30s", "Initial comment", "user1"
+    )
+    await discussion_service.create_reply(discussion_id, "Reply 1", "user2")
+    await discussion_service.create_reply(discussion_id, "Reply 2", "user2")
+    # reply 3 reserved its index but has not reached its bucket yet
+    await container.db().discussions.update_one(
+        {"discussion_id": discussion_id}, {"$inc": {"reply_count": 1}}
+    )
+    await container.db().reply_buckets.update_one(
+        {"discussion_id": discussion_id, "bucket": 2},
+        {
+            "$push": {
+                "replies": {
+                    "client_id": "user2",
+                    "comment": "Reply 4",
+                    "created_at": datetime.now(),
+                    "index": 4,
+                }
+            }
+        },
+        upsert=True,
+    )
+
+    replies, next_index = await discussion_service.get_replies_since(discussion_id, 1)
+
+    assert [reply.comment for reply in replies] == ["Reply 1", "Reply 2"]
+    assert next_index == 3
+
+
+@pytest.mark.asyncio
+async def test_failed_reply_write_gives_its_index_back(container: Container) -> None:
+    discussion_service = container.discussion_service()
+    discussion_id = await discussion_service.create_discussion(
+        "ref.30s", "Initial comment", "user1"
+    )
+    reply_buckets = discussion_service.reply_buckets
+    with patch.object(
+        reply_buckets, "update_one", side_effect=OperationFailure("write failed")
+    ):
+        with pytest.raises(OperationFailure):
+            await discussion_service.create_reply(discussion_id, "Lost", "user2")
+    await discussion_service.create_reply(discussion_id, "Reply 1", "user2")
+
+    replies, next_index = await discussion_service.get_replies_since(discussion_id, 0)
+    assert [reply.comment for reply in replies] == ["Initial comment", "Reply 1"]
+    assert next_index == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_reply_write_behind_a_later_reply_leaves_a_tombstone(
+    container: Container,
+) -> None:
+    discussion_service = container.discussion_service()
+    discussion_id = await discussion_service.create_discussion(
+        "ref.30s", "Initial comment", "user1"
+    )
+    # another reply takes index 2 before the write of index 1 fails
+    await container.db().discussions.update_one(
+        {"discussion_id": discussion_id}, {"$inc": {"reply_count": 2}}
+    )
+    await discussion_service._release_reply_index(discussion_id, 1, datetime.now())
+    await container.db().reply_buckets.update_one(
+        {"discussion_id": discussion_id, "bucket": 0},
+        {"$push": {"replies": discussion_service._new_reply("user2", "Reply 2", 2)}},
+    )
+
+    replies, next_index = await discussion_service.get_replies_since(discussion_id, 1)
+    assert [reply.comment for reply in replies] == ["Reply 2"]
+    assert next_index == 3
+    params = await discussion_service.get_encoded_discussion(discussion_id)
+    assert params.endswith("|(user1|Initial comment,user2|Reply 2)")
+    assert discussion_service.cache is not None
+    assert discussion_service.cache.stats.entries == 1
+
+
+@pytest.mark.asyncio
+async def test_reply_lost_before_its_write_is_filled_on_read(
+    container: Container,
+) -> None:
+    discussion_service = container.discussion_service()
+    discussion_id = await discussion_service.create_discussion(
+        "ref.30s", "Initial comment", "user1"
+    )
+    # the process died between counting reply 1 and writing it
+    await container.db().discussions.update_one(
+        {"discussion_id": discussion_id},
+        {
+            "$inc": {"reply_count": 1},
+            "$set": {"last_activity_at": datetime.now() - timedelta(minutes=5)},
+        },
+    )
+    replies, next_index = await discussion_service.get_replies_since(discussion_id, 0)
+    assert [reply.comment for reply in replies] == ["Initial comment"]
+    assert next_index == 2
+
+    await discussion_service.create_reply(discussion_id, "Reply 2", "user2")
+    replies, next_index = await discussion_service.get_replies_since(discussion_id, 1)
+    assert [reply.comment for reply in replies] == ["Reply 2"]
+    assert next_index == 3
+    page, next_offset = await discussion_service.get_discussion_page(
+        discussion_id, 0, 2
+    )
+    assert [reply.comment for reply in page.replies] == ["Initial comment"]
+    assert next_offset == 2
@@ -1,3 +1,4 @@
+import re
 from collections.abc import AsyncGenerator
 
 import pytest
@@ -7,9 +8,16 @@ from server.commands.discussion_commands import (
     CreateDiscussionCommand,
     CreateReplyCommand,
     GetDiscussionCommand,
+    GetDiscussionPageCommand,
+    GetDiscussionSinceCommand,
     ListDiscussionsCommand,
+    ListDiscussionsPageCommand,
+    ListDiscussionsRangeCommand,
+    ListDiscussionsSummaryCommand,
+    NextPageCommand,
 )
 from server.di import Container
+from server.services.discussion_service import DiscussionService
 from server.services.validation_service import ValidationService
 from tests.conftest import TEST_PEER_ID
 
@@ -240,3 +248,251 @@ async def test_list_discussion_executes(container: Container) -> None:
     await ListDiscussionsCommand(
         CommandContext(container, "abcdefg", [], TEST_PEER_ID),
     ).execute()
+
+
+async def test_list_discussion_streams_every_discussion(
+    client_id: str, container: Container
+) -> None:
+    container.config.list_batch_size.from_value(2)
+    created_ids = []
+    for i in range(5):
+        created = CreateDiscussionCommand(
+            CommandContext(container, "abcdefg", [f"ref.{i}s", "hi"], TEST_PEER_ID),
+        )
+        created_ids.append((await created.execute()).strip("\n").split("|")[1])
+
+    command = ListDiscussionsCommand(
+        CommandContext(container, "xthbsuv", [], TEST_PEER_ID)
+    )
+    chunks = [chunk async for chunk in command.execute_stream()]
+
+    discussions = [
+        f"{created_id}|ref.{i}s|({client_id}|hi)"
+        for i, created_id in enumerate(created_ids)
+    ]
+    assert len(chunks) == len(discussions) + 2
+    assert "".join(chunks) == "xthbsuv|(" + ",".join(discussions) + ")\n"
+
+
+async def _create_discussions(container: Container, references: list[str]) -> list[str]:
+    created_ids = []
+    for reference in references:
+        created = CreateDiscussionCommand(
+            CommandContext(container, "abcdefg", [reference, "hi"], TEST_PEER_ID),
+        )
+        created_ids.append((await created.execute()).strip("\n").split("|")[1])
+    return created_ids
+
+
+async def test_list_discussions_filters_by_prefix_in_time_order(
+    client_id: str, container: Container
+) -> None:
+    first, _, second, third = await _create_discussions(
+        container, ["refa.1m5s", "refb.1s", "refa.30s", "refa.2m0s"]
+    )
+
+    response = await ListDiscussionsCommand(
+        CommandContext(container, "xthbsuv", ["refa"], TEST_PEER_ID)
+    ).execute()
+
+    discussions = [
+        f"{second}|refa.30s|({client_id}|hi)",
+        f"{first}|refa.1m5s|({client_id}|hi)",
+        f"{third}|refa.2m0s|({client_id}|hi)",
+    ]
+    assert response == "xthbsuv|(" + ",".join(discussions) + ")\n"
+
+
+async def test_list_discussions_rejects_invalid_prefix(container: Container) -> None:
+    with pytest.raises(ValueError, match="reference prefix must be alphanumeric"):
+        await ListDiscussionsCommand(
+            CommandContext(container, "xthbsuv", ["ref.1s"], TEST_PEER_ID)
+        ).execute()
+
+
+async def test_list_discussions_range_is_half_open(
+    client_id: str, container: Container
+) -> None:
+    _, inside, _, edge = await _create_discussions(
+        container, ["refa.59s", "refa.1m0s", "refb.1m30s", "refa.2m0s"]
+    )
+    inside_late, _ = await _create_discussions(container, ["refa.1m59s", "refa.0s"])
+
+    response = await ListDiscussionsRangeCommand(
+        CommandContext(container, "xthbsuv", ["refa", "60s", "2m0s"], TEST_PEER_ID)
+    ).execute()
+
+    assert response == (
+        f"xthbsuv|({inside}|refa.1m0s|({client_id}|hi),"
+        f"{inside_late}|refa.1m59s|({client_id}|hi))\n"
+    )
+    assert edge not in response
+
+
+async def test_list_discussions_range_rejects_invalid_markers(
+    container: Container,
+) -> None:
+    with pytest.raises(ValueError, match="time range must be two time markers"):
+        await ListDiscussionsRangeCommand(
+            CommandContext(container, "xthbsuv", ["refa", "60", "2m"], TEST_PEER_ID)
+        ).execute()
+
+
+async def test_list_discussions_summary_omits_replies(
+    client_id: str, container: Container
+) -> None:
+    discussion_id, _ = await _create_discussions(container, ["refa.1s", "refb.1s"])
+    for comment in ["first reply", "second reply"]:
+        await CreateReplyCommand(
+            CommandContext(
+                container, "abcdefg", [discussion_id, comment], TEST_PEER_ID
+            ),
+        ).execute()
+
+    response = await ListDiscussionsSummaryCommand(
+        CommandContext(container, "xthbsuv", ["refa"], TEST_PEER_ID)
+    ).execute()
+
+    doc = await container.db().discussions.find_one({"discussion_id": discussion_id})
+    assert doc is not None
+    last_activity_at = doc["last_activity_at"].isoformat(timespec="seconds")
+    assert response == f"xthbsuv|({discussion_id}|refa.1s|3|{last_activity_at}|hi)\n"
+    assert "reply" not in response
+
+
+async def test_get_discussion_since_returns_only_new_replies(
+    client_id: str, container: Container
+) -> None:
+    (discussion_id,) = await _create_discussions(container, ["ref.1s"])
+
+    async def since(index: str) -> str:
+        return await GetDiscussionSinceCommand(
+            CommandContext(container, "abcdefg", [discussion_id, index], TEST_PEER_ID)
+        ).execute()
+
+    assert await since("1") == f"abcdefg|{discussion_id}|1|()\n"
+
+    for comment in ["one", "two"]:
+        await CreateReplyCommand(
+            CommandContext(
+                container, "abcdefg", [discussion_id, comment], TEST_PEER_ID
+            ),
+        ).execute()
+
+    assert await since("1") == (
+        f"abcdefg|{discussion_id}|3|({client_id}|one,{client_id}|two)\n"
+    )
+    assert await since("2") == f"abcdefg|{discussion_id}|3|({client_id}|two)\n"
+
+    with pytest.raises(ValueError, match="reply index must be a non-negative"):
+        await since("-1")
+
+
+def _split_page(response: str) -> tuple[str, str | None]:
+    """Split a page response into its body and its next-page cursor"""
+    response = response.rstrip("\n")
+    if response.endswith(")"):
+        return response, None
+    body, token = response.rsplit("|", 1)
+    return body, token
+
+
+async def test_list_discussions_page_follows_cursor(container: Container) -> None:
+    created_ids = await _create_discussions(
+        container, [f"ref{i % 2}.{i}s" for i in range(5)]
+    )
+
+    pages = []
+    response = await ListDiscussionsPageCommand(
+        CommandContext(container, "abcdefg", ["2"], TEST_PEER_ID)
+    ).execute()
+    while True:
+        body, token = _split_page(response)
+        pages.append(re.findall(r"([a-z0-9]{7})\|ref", body))
+        if token is None:
+            break
+        response = await NextPageCommand(
+            CommandContext(container, "abcdefg", [token], TEST_PEER_ID)
+        ).execute()
+
+    expected = await (
+        container.db()
+        .discussions.find({}, {"discussion_id": 1})
+        .sort(DiscussionService.PAGE_SORT)
+        .to_list(length=None)
+    )
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [d for page in pages for d in page] == [
+        doc["discussion_id"] for doc in expected
+    ]
+    assert sorted(created_ids) == sorted(d for page in pages for d in page)
+
+
+async def test_list_discussions_page_filters_by_prefix(container: Container) -> None:
+    created_ids = await _create_discussions(
+        container, ["refa.1s", "refb.2s", "refa.3s", "refa.4s"]
+    )
+
+    first = await ListDiscussionsPageCommand(
+        CommandContext(container, "abcdefg", ["2", "refa"], TEST_PEER_ID)
+    ).execute()
+    body, token = _split_page(first)
+    listed = re.findall(r"([a-z0-9]{7})\|ref", body)
+    assert token is not None
+
+    second = await NextPageCommand(
+        CommandContext(container, "abcdefg", [token], TEST_PEER_ID)
+    ).execute()
+    body, token = _split_page(second)
+    listed += re.findall(r"([a-z0-9]{7})\|ref", body)
+    assert token is None
+
+    assert len(listed) == 3
+    assert set(listed) == {created_ids[0], created_ids[2], created_ids[3]}
+
+
+async def test_get_discussion_page_follows_cursor(
+    client_id: str, container: Container
+) -> None:
+    (discussion_id,) = await _create_discussions(container, ["ref.1s"])
+    for i in range(4):
+        await CreateReplyCommand(
+            CommandContext(
+                container, "abcdefg", [discussion_id, f"reply {i}"], TEST_PEER_ID
+            )
+        ).execute()
+
+    first = await GetDiscussionPageCommand(
+        CommandContext(container, "abcdefg", [discussion_id, "3"], TEST_PEER_ID)
+    ).execute()
+    body, token = _split_page(first)
+    assert token is not None
+    assert body == (
+        f"abcdefg|{discussion_id}|ref.1s|"
+        f"({client_id}|hi,{client_id}|reply 0,{client_id}|reply 1)"
+    )
+
+    second = await NextPageCommand(
+        CommandContext(container, "abcdefg", [token], TEST_PEER_ID)
+    ).execute()
+    assert second == (
+        f"abcdefg|{discussion_id}|ref.1s|"
+        f"({client_id}|reply 2,{client_id}|reply 3)\n"
+    )
+
+
+async def test_page_commands_validate_params(container: Container) -> None:
+    with pytest.raises(ValueError, match="page size"):
+        await ListDiscussionsPageCommand(
+            CommandContext(container, "abcdefg", ["0"], TEST_PEER_ID)
+        ).execute()
+
+    with pytest.raises(ValueError, match="action requires two parameters"):
+        await GetDiscussionPageCommand(
+            CommandContext(container, "abcdefg", ["abc1234"], TEST_PEER_ID)
+        ).execute()
+
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        await NextPageCommand(
+            CommandContext(container, "abcdefg", ["garbage"], TEST_PEER_ID)
+        ).execute()
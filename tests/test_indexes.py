@@ -0,0 +1,89 @@
+from typing import Any
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from server.di import Container
+from server.indexes import IndexedService, IndexManager, QueryShape
+
+COLLSCAN_PLAN = {
+    "queryPlanner": {
+        "winningPlan": {
+            "stage": "SORT",
+            "inputStage": {"stage": "COLLSCAN", "direction": "forward"},
+        },
+        "rejectedPlans": [],
+    }
+}
+IXSCAN_PLAN = {
+    "queryPlanner": {
+        "winningPlan": {
+            "stage": "FETCH",
+            "inputStage": {"stage": "IXSCAN", "indexName": "discussion_id_1"},
+        },
+        "rejectedPlans": [{"stage": "COLLSCAN"}],
+    }
+}
+
+
+class PlannedIndexManager(IndexManager):
+    """Answers explain with fixed plans, which mongomock cannot produce"""
+
+    def __init__(self, container: Container, plans: dict[str, Any], strict: bool):
+        super().__init__(container.db(), strict=strict)
+        self.plans = plans
+
+    async def _explain(self, query: QueryShape) -> dict[str, Any] | None:
+        return self.plans.get(query.collection)
+
+
+@pytest.mark.asyncio
+async def test_bootstrap_creates_declared_indexes(container: Container) -> None:
+    services: list[IndexedService] = [
+        container.session_service(),
+        container.discussion_service(),
+        container.notification_service(),
+    ]
+    await container.index_manager().bootstrap(services)
+    # running it again finds every index in place
+    await container.index_manager().bootstrap(services)
+
+    db = container.db()
+    for service in services:
+        for index in service.indexes():
+            keys = [
+                info["key"]
+                for info in (await db[index.collection].index_information()).values()
+            ]
+            assert index.keys in keys
+
+    await db.discussions.insert_one({"discussion_id": "abc1234"})
+    with pytest.raises(DuplicateKeyError):
+        await db.discussions.insert_one({"discussion_id": "abc1234"})
+
+
+@pytest.mark.asyncio
+async def test_collection_scan_is_detected(container: Container) -> None:
+    manager = PlannedIndexManager(
+        container, {"sessions": COLLSCAN_PLAN, "discussions": IXSCAN_PLAN}, False
+    )
+
+    assert await manager.scans_collection(QueryShape("sessions", {"peer_id": ""}))
+    assert not await manager.scans_collection(
+        QueryShape("discussions", {"discussion_id": ""})
+    )
+    # queries without a plan are not treated as scans
+    assert not await manager.scans_collection(QueryShape("notifications", {}))
+
+
+@pytest.mark.asyncio
+async def test_strict_bootstrap_refuses_collection_scans(container: Container) -> None:
+    services = [container.session_service()]
+    await PlannedIndexManager(container, {"sessions": COLLSCAN_PLAN}, False).bootstrap(
+        services
+    )
+
+    with pytest.raises(RuntimeError, match="sessions"):
+        await PlannedIndexManager(
+            container, {"sessions": COLLSCAN_PLAN}, True
+        ).bootstrap(services)
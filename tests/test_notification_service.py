@@ -5,6 +5,7 @@ import pytest
 
 from server.di import Container
 from server.entities.notification import NotificationType
+from server.services.notification_service import NotificationService
 
 # Test data
 TEST_PEER_1 = "127.0.0.1:8001"
@@ -359,3 +360,297 @@ async def test_notification_after_mark_as_read(container: Container) -> None:
     # Verify new notifications are created after mark as read
     user2_notifications = await notification_service.get_notifications("user2")
     assert len(user2_notifications) == 1
+
+
+@pytest.mark.asyncio
+async def test_notifications_carry_their_reply(container: Container) -> None:
+    discussion_service = container.discussion_service()
+    notification_service = container.notification_service()
+    discussion_id = await discussion_service.create_discussion(
+        reference="test.33s", comment="Hey @user3", client_id="user1"
+    )
+    await discussion_service.create_reply(
+        discussion_id=discussion_id, comment="Hi, @user3", client_id="user2"
+    )
+
+    (reply,) = await notification_service.get_notifications("user1")
+    assert reply.reply is not None
+    assert (reply.reply.index, reply.reply.client_id) == (1, "user2")
+    assert reply.reply.comment == '"Hi, @user3"'
+
+    mentions = await notification_service.get_notifications("user3")
+    assert sorted(m.reply.index for m in mentions if m.reply is not None) == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_mentioned_participant_gets_one_notification(
+    container: Container,
+) -> None:
+    discussion_service = container.discussion_service()
+    notification_service = container.notification_service()
+    discussion_id = await discussion_service.create_discussion(
+        reference="test.33s", comment="Initial discussion", client_id="user1"
+    )
+
+    await discussion_service.create_reply(
+        discussion_id=discussion_id,
+        comment="What do you think @user1?",
+        client_id="user2",
+    )
+
+    (notification,) = await notification_service.get_notifications("user1")
+    assert notification.notification_type == NotificationType.MENTION
+
+
+@pytest.mark.asyncio
+async def test_close_writes_queued_notifications(container: Container) -> None:
+    notification_service = container.notification_service()
+    reply = {"client_id": "user1", "comment": "hi", "created_at": None, "index": 1}
+    for discussion_id in ["abc1234", "def5678"]:
+        await notification_service.notify(
+            discussion_id, "user1", reply, recipient_ids=["user2", "user3"]
+        )
+
+    await notification_service.close()
+
+    assert await container.db().notifications.count_documents({}) == 4
+
+
+@pytest.mark.asyncio
+async def test_large_thread_is_notified_on_read(container: Container) -> None:
+    discussion_service = container.discussion_service()
+    discussion_service.fanout_on_read_participants = 2
+    notification_service = container.notification_service()
+    discussion_id = await discussion_service.create_discussion(
+        reference="test.33s", comment="Initial discussion", client_id="user1"
+    )
+    await discussion_service.create_reply(discussion_id, "Reply", "user2")
+    await notification_service.mark_as_read("user1", discussion_id)
+
+    # user1 and user2 are the participants to notify from here on
+    await discussion_service.create_reply(discussion_id, "Hi @user4", "user3")
+    await discussion_service.create_reply(discussion_id, "Welcome", "user2")
+
+    await notification_service.flush()
+    db = container.db()
+    assert await db.discussion_events.count_documents({}) == 2
+    assert await db.notifications.count_documents({}) == 1  # the mention
+
+    user1_notifications = await notification_service.get_notifications("user1")
+    assert [(n.sender_id, n.reply.index) for n in user1_notifications if n.reply] == [
+        ("user2", 3),
+        ("user3", 2),
+    ]
+    # user3 joined with their reply, so only what came after it is unread
+    user3_notifications = await notification_service.get_notifications("user3")
+    assert [n.sender_id for n in user3_notifications] == ["user2"]
+    user4_notifications = await notification_service.get_notifications("user4")
+    assert [n.notification_type for n in user4_notifications] == [
+        NotificationType.MENTION
+    ]
+
+    await notification_service.mark_as_read("user1", discussion_id)
+    assert await notification_service.get_notifications("user1") == []
+
+
+@pytest.mark.asyncio
+async def test_backlog_is_collapsed_per_discussion(container: Container) -> None:
+    notification_service = container.notification_service()
+    reply = {"client_id": "user2", "comment": "hi", "created_at": None, "index": 1}
+    for discussion_id in ["ccc3333", "aaa1111", "bbb2222", "aaa1111"]:
+        await notification_service.notify(discussion_id, "user2", reply, ["user1"])
+    await notification_service.notify(
+        "bbb2222", "user3", reply, ["user1"], mentioned_ids=["user1"]
+    )
+
+    first = await notification_service.get_backlog("user1", 2)
+    assert [(e.discussion_id, e.notification_type, e.count) for e in first] == [
+        ("aaa1111", NotificationType.REPLY, 2),
+        ("bbb2222", NotificationType.MENTION, 2),
+    ]
+    second = await notification_service.get_backlog("user1", 2, after="bbb2222")
+    assert [e.discussion_id for e in second] == ["ccc3333"]
+
+    await notification_service.mark_many_as_read(
+        "user1", dict.fromkeys(["aaa1111", "bbb2222"])
+    )
+    assert [
+        n.discussion_id for n in await notification_service.get_notifications("user1")
+    ] == ["ccc3333"]
+
+
+@pytest.mark.asyncio
+async def test_compact_merges_notifications_per_discussion(
+    container: Container,
+) -> None:
+    notification_service = container.notification_service()
+    for index, mentioned_ids in enumerate([[], ["user1"], [], []]):
+        reply = {
+            "client_id": "user2",
+            "comment": "hi",
+            "created_at": None,
+            "index": index,
+        }
+        await notification_service.notify(
+            "abc1234", "user2", reply, ["user1", "user3"], mentioned_ids=mentioned_ids
+        )
+    await notification_service.notify("def5678", "user2", reply, ["user1"])
+
+    assert await notification_service.compact() == 6
+    assert await notification_service.compact() == 0
+
+    notifications = await notification_service.get_notifications("user1")
+    assert [
+        (n.discussion_id, n.notification_type, n.count, n.reply and n.reply.index)
+        for n in sorted(notifications, key=lambda n: n.discussion_id)
+    ] == [
+        ("abc1234", NotificationType.MENTION, 4, 3),
+        ("def5678", NotificationType.REPLY, 1, 3),
+    ]
+    (backlog,) = await notification_service.get_backlog("user3", 10)
+    assert backlog.count == 4
+
+
+@pytest.mark.asyncio
+async def test_compact_skips_threads_notified_on_read(container: Container) -> None:
+    discussion_service = container.discussion_service()
+    discussion_service.fanout_on_read_participants = 2
+    notification_service = container.notification_service()
+    discussion_id = await discussion_service.create_discussion(
+        reference="test.33s", comment="Initial discussion", client_id="user1"
+    )
+    await discussion_service.create_reply(discussion_id, "Reply", "user2")
+    await notification_service.mark_as_read("user1", discussion_id)
+    await discussion_service.create_reply(discussion_id, "Hi @user1", "user3")
+    await discussion_service.create_reply(discussion_id, "Again @user1", "user3")
+    for index in [1, 2]:
+        reply = {"client_id": "user2", "comment": "hi", "created_at": None}
+        await notification_service.notify(
+            "def5678", "user2", {**reply, "index": index}, ["user1"]
+        )
+
+    assert await notification_service.compact() == 1
+
+    notifications = await notification_service.get_notifications("user1")
+    assert {
+        (n.discussion_id, n.notification_type, n.reply and n.reply.index)
+        for n in notifications
+    } == {
+        (discussion_id, NotificationType.MENTION, 2),
+        (discussion_id, NotificationType.MENTION, 3),
+        ("def5678", NotificationType.REPLY, 2),
+    }
+    assert len(notifications) == 3
+
+
+@pytest.mark.asyncio
+async def test_ttl_index_is_declared(container: Container) -> None:
+    container.config.notification_ttl.from_value(3600)
+    notification_service = container.notification_service()
+    await container.index_manager().bootstrap([notification_service])
+
+    indexes = await container.db().notifications.index_information()
+    assert indexes[notification_service.TTL_INDEX]["expireAfterSeconds"] == 3600
+    assert [("recipient_id", 1), ("discussion_id", 1)] in [
+        index["key"] for index in indexes.values()
+    ]
+
+
+@pytest.mark.asyncio
+async def test_ttl_index_is_dropped_when_expiry_is_disabled(
+    container: Container,
+) -> None:
+    db = container.db()
+    index_manager = container.index_manager()
+    await index_manager.bootstrap([NotificationService(db, ttl=3600)])
+    assert NotificationService.TTL_INDEX in await db.notifications.index_information()
+
+    await index_manager.bootstrap([NotificationService(db, ttl=0)])
+    await index_manager.bootstrap([NotificationService(db, ttl=0)])
+
+    for collection in (db.notifications, db.discussion_events):
+        assert NotificationService.TTL_INDEX not in await collection.index_information()
+
+
+@pytest.mark.asyncio
+async def test_backlog_includes_threads_notified_on_read(container: Container) -> None:
+    discussion_service = container.discussion_service()
+    discussion_service.fanout_on_read_participants = 2
+    notification_service = container.notification_service()
+    discussion_id = await discussion_service.create_discussion(
+        reference="test.33s", comment="Initial discussion", client_id="user1"
+    )
+    await discussion_service.create_reply(discussion_id, "Reply", "user2")
+    await notification_service.mark_as_read("user1", discussion_id)
+    await discussion_service.create_reply(discussion_id, "Hi @user1", "user3")
+    await discussion_service.create_reply(discussion_id, "Welcome", "user2")
+
+    # the mention and its event count as one
+    (entry,) = await notification_service.get_backlog("user1", 10)
+    assert (entry.discussion_id, entry.notification_type, entry.count) == (
+        discussion_id,
+        NotificationType.MENTION,
+        2,
+    )
+    assert entry.read_index == 3
+
+    await notification_service.mark_many_as_read("user1", {discussion_id: 3})
+    assert await notification_service.get_backlog("user1", 10) == []
+
+
+@pytest.mark.asyncio
+async def test_delivered_notifications_stay_out_of_the_backlog(
+    container: Container,
+) -> None:
+    discussion_service = container.discussion_service()
+    discussion_service.fanout_on_read_participants = 2
+    notification_service = container.notification_service()
+    discussion_id = await discussion_service.create_discussion(
+        reference="test.33s", comment="Initial discussion", client_id="user1"
+    )
+    await discussion_service.create_reply(discussion_id, "Reply", "user2")
+    await discussion_service.create_reply(discussion_id, "Welcome", "user3")
+    reply = {"client_id": "user2", "comment": "hi", "created_at": None}
+    for index in [1, 2]:
+        await notification_service.notify(
+            "def5678", "user2", {**reply, "index": index}, ["user1"]
+        )
+
+    await notification_service.mark_delivered(
+        "user1", discussion_id, 2, fanout_on_read=True
+    )
+    await notification_service.mark_delivered("user1", "def5678", 1)
+
+    backlog = await notification_service.get_backlog("user1", 10)
+    assert [(e.discussion_id, e.count, e.read_index) for e in backlog] == [
+        ("def5678", 1, 2)
+    ]
+    # delivered is not read
+    assert len(await notification_service.get_notifications("user1")) == 4
+
+
+@pytest.mark.asyncio
+async def test_mark_as_read_keeps_replies_not_notified_yet(
+    container: Container,
+) -> None:
+    discussion_service = container.discussion_service()
+    discussion_service.fanout_on_read_participants = 1
+    notification_service = container.notification_service()
+    discussion_id = await discussion_service.create_discussion(
+        reference="test.33s", comment="Initial discussion", client_id="user1"
+    )
+    await discussion_service.create_reply(discussion_id, "Reply", "user2")
+    # reply 2 is counted, but its event is still on its way
+    await container.db().discussions.update_one(
+        {"discussion_id": discussion_id}, {"$inc": {"reply_count": 1}}
+    )
+
+    await notification_service.mark_as_read("user1", discussion_id)
+    reply = {"client_id": "user3", "comment": "Late", "created_at": None, "index": 2}
+    await notification_service.notify_discussion(discussion_id, "user3", reply)
+
+    (notification,) = await notification_service.get_notifications("user1")
+    assert notification.reply is not None and notification.reply.index == 2
+
+    await notification_service.mark_as_read("user1", discussion_id, read_index=2)
+    assert await notification_service.get_notifications("user1") == []
@@ -0,0 +1,209 @@
+import asyncio
+from typing import Any, cast
+
+from server.outbound import OutboundBuffer, OutboundStats, OverflowPolicy
+
+
+class FakeTransport:
+    def __init__(self) -> None:
+        self.aborted = False
+
+    def abort(self) -> None:
+        self.aborted = True
+
+
+class FakeWriter:
+    def __init__(self) -> None:
+        self.writes: list[bytes] = []
+        self.closed = False
+        self.transport = FakeTransport()
+
+    def write(self, data: bytes) -> None:
+        self.writes.append(data)
+
+    async def drain(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def _buffer(
+    writer: FakeWriter,
+    stats: OutboundStats,
+    max_pushes: int = 256,
+    overflow: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+) -> OutboundBuffer:
+    return OutboundBuffer(cast(Any, writer), stats, max_pushes, overflow)
+
+
+async def test_messages_in_one_tick_are_flushed_together() -> None:
+    writer = FakeWriter()
+    stats = OutboundStats()
+    outbound = _buffer(writer, stats)
+
+    outbound.write("abcdefg\n")
+    outbound.write("DISCUSSION_UPDATED|abc1234\n")
+    await outbound.send("hijklmn|user\n")
+    assert writer.writes == []
+
+    await asyncio.sleep(0)
+
+    assert writer.writes == [b"abcdefg\nDISCUSSION_UPDATED|abc1234\nhijklmn|user\n"]
+    assert stats == OutboundStats(messages=3, bytes=len(writer.writes[0]), flushes=1)
+
+
+async def test_separate_ticks_are_separate_flushes() -> None:
+    writer = FakeWriter()
+    stats = OutboundStats()
+    outbound = _buffer(writer, stats)
+
+    outbound.write("abcdefg\n")
+    await asyncio.sleep(0)
+    outbound.write("hijklmn\n")
+    await asyncio.sleep(0)
+
+    assert writer.writes == [b"abcdefg\n", b"hijklmn\n"]
+    assert stats.flushes == 2
+    assert stats.messages == 2
+
+
+async def test_close_flushes_pending_messages() -> None:
+    writer = FakeWriter()
+    outbound = _buffer(writer, OutboundStats())
+
+    outbound.write("Invalid format")
+    outbound.close()
+
+    assert writer.writes == [b"Invalid format"]
+    assert writer.closed
+
+
+async def test_full_queue_drops_oldest_push() -> None:
+    writer = FakeWriter()
+    stats = OutboundStats()
+    outbound = _buffer(writer, stats, max_pushes=2)
+
+    outbound.push("DISCUSSION_UPDATED|aaaaaaa\n")
+    outbound.write("abcdefg\n")
+    outbound.push("DISCUSSION_UPDATED|bbbbbbb\n")
+    assert outbound.push("DISCUSSION_UPDATED|ccccccc\n")
+    await asyncio.sleep(0)
+
+    assert writer.writes == [
+        b"abcdefg\nDISCUSSION_UPDATED|bbbbbbb\nDISCUSSION_UPDATED|ccccccc\n"
+    ]
+    assert stats.dropped == 1
+
+
+async def test_full_queue_coalesces_duplicate_push() -> None:
+    writer = FakeWriter()
+    stats = OutboundStats()
+    outbound = _buffer(writer, stats, max_pushes=2, overflow=OverflowPolicy.COALESCE)
+
+    outbound.push("DISCUSSION_UPDATED|aaaaaaa\n")
+    outbound.push("DISCUSSION_UPDATED|bbbbbbb\n")
+    assert not outbound.push("DISCUSSION_UPDATED|aaaaaaa\n")
+    assert outbound.push("DISCUSSION_UPDATED|ccccccc\n")
+    await asyncio.sleep(0)
+
+    assert writer.writes == [
+        b"DISCUSSION_UPDATED|bbbbbbb\nDISCUSSION_UPDATED|ccccccc\n"
+    ]
+    assert stats.coalesced == 1
+    assert stats.dropped == 1
+
+
+async def test_full_queue_disconnects_slow_consumer() -> None:
+    writer = FakeWriter()
+    stats = OutboundStats()
+    outbound = _buffer(writer, stats, max_pushes=1, overflow=OverflowPolicy.DISCONNECT)
+
+    outbound.push("DISCUSSION_UPDATED|aaaaaaa\n")
+    assert not outbound.push("DISCUSSION_UPDATED|bbbbbbb\n")
+    await asyncio.sleep(0)
+
+    assert writer.transport.aborted
+    assert writer.writes == []
+    assert stats.disconnects == 1
+    assert not outbound.push("DISCUSSION_UPDATED|ccccccc\n")
+
+
+async def test_stalled_peer_does_not_block_push() -> None:
+    writer = FakeWriter()
+    stalled = asyncio.Event()
+
+    async def drain() -> None:
+        await stalled.wait()
+
+    writer.drain = drain  # type: ignore[method-assign]
+    stats = OutboundStats()
+    outbound = _buffer(writer, stats, max_pushes=1)
+
+    outbound.push("DISCUSSION_UPDATED|aaaaaaa\n")
+    await asyncio.sleep(0)
+    outbound.push("DISCUSSION_UPDATED|bbbbbbb\n")
+    outbound.push("DISCUSSION_UPDATED|ccccccc\n")
+    await asyncio.sleep(0)
+
+    assert writer.writes == [b"DISCUSSION_UPDATED|aaaaaaa\n"]
+    assert stats.dropped == 1
+
+    stalled.set()
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert writer.writes[-1] == b"DISCUSSION_UPDATED|ccccccc\n"
+    outbound.close()
+
+
+async def test_pushes_wait_for_the_end_of_a_chunked_response() -> None:
+    writer = FakeWriter()
+    outbound = _buffer(writer, OutboundStats())
+
+    outbound.begin_response()
+    await outbound.send("xthbsuv|(a,")
+    await asyncio.sleep(0)
+    outbound.push("DISCUSSION_UPDATED|abc1234\n")
+    await outbound.send("b)\n")
+    await asyncio.sleep(0)
+    outbound.end_response()
+    await asyncio.sleep(0)
+
+    assert b"".join(writer.writes) == b"xthbsuv|(a,b)\nDISCUSSION_UPDATED|abc1234\n"
+
+
+async def test_held_pushes_count_against_max_pushes() -> None:
+    writer = FakeWriter()
+    stats = OutboundStats()
+    outbound = _buffer(writer, stats, max_pushes=1)
+
+    outbound.begin_response()
+    outbound.push("DISCUSSION_UPDATED|aaaaaaa\n")
+    outbound.push("DISCUSSION_UPDATED|bbbbbbb\n")
+    outbound.end_response()
+    await asyncio.sleep(0)
+
+    assert writer.writes == [b"DISCUSSION_UPDATED|bbbbbbb\n"]
+    assert stats.dropped == 1
+
+
+async def test_notices_are_held_back_but_never_dropped() -> None:
+    writer = FakeWriter()
+    stats = OutboundStats()
+    outbound = _buffer(writer, stats, max_pushes=2)
+
+    outbound.begin_response()
+    outbound.notice("NOTIFICATION_BACKLOG|1|(abc1234|reply|1)\n")
+    for discussion_id in ["aaaaaaa", "bbbbbbb", "ccccccc"]:
+        outbound.push(f"DISCUSSION_UPDATED|{discussion_id}\n")
+    await outbound.send("xthbsuv|()\n")
+    outbound.end_response()
+    await asyncio.sleep(0)
+
+    assert b"".join(writer.writes) == (
+        b"xthbsuv|()\n"
+        b"NOTIFICATION_BACKLOG|1|(abc1234|reply|1)\n"
+        b"DISCUSSION_UPDATED|bbbbbbb\n"
+        b"DISCUSSION_UPDATED|ccccccc\n"
+    )
+    assert stats.dropped == 1
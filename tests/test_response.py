@@ -1,4 +1,5 @@
 import unittest
+from collections.abc import AsyncIterator
 
 from server.response import Response
 
@@ -22,5 +23,27 @@ class TestResponse(unittest.TestCase):
             Response(request_id="ABCDEFG").serialize()
 
 
+class TestResponseStream(unittest.IsolatedAsyncioTestCase):
+    async def _serialize(self, response: Response, params: list[str]) -> str:
+        async def produce() -> AsyncIterator[str]:
+            for param in params:
+                yield param
+
+        return "".join(
+            [chunk async for chunk in response.serialize_list_stream(produce())]
+        )
+
+    async def test_matches_serialize_list(self) -> None:
+        for params in ([], ["a|b|(c|d)"], ["a|b|()", "c|d|(e|f,g|h)"]):
+            response = Response(request_id="abcdefg", params=params)
+            self.assertEqual(
+                await self._serialize(response, params), response.serialize_list()
+            )
+
+    async def test_stream_failures(self) -> None:
+        with self.assertRaises(ValueError):
+            await self._serialize(Response(request_id="abc"), [])
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -1,18 +1,51 @@
 """Integration Test for the TCP Echo Server."""
 
 import asyncio
+import logging
 from asyncio.base_events import Server as AsyncioServer
 from collections.abc import AsyncGenerator
+from datetime import datetime
+from typing import Any
+from unittest.mock import patch
 
 import pytest
 
 from server import Server
 from server.di import Container
+from server.notification_bus import ChangeStreamNotificationBus
 
 
 @pytest.fixture
 async def server(container: Container) -> AsyncGenerator[Server, None]:
+    async for running in _running_server(Server(container=container, port=0)):
+        yield running
+
+
+@pytest.fixture
+async def pipelined_server(container: Container) -> AsyncGenerator[Server, None]:
+    container.config.max_in_flight.from_value(8)
+    server = Server(container=container, port=0)
+    async for running in _running_server(server):
+        yield running
+
+
+@pytest.fixture
+async def unordered_server(container: Container) -> AsyncGenerator[Server, None]:
+    container.config.from_dict({"max_in_flight": 8, "ordered_responses": False})
+    server = Server(container=container, port=0)
+    async for running in _running_server(server):
+        yield running
+
+
+@pytest.fixture
+async def single_node_server(container: Container) -> AsyncGenerator[Server, None]:
+    container.config.notification_bus.from_value("in_process")
     server = Server(container=container, port=0)
+    async for running in _running_server(server):
+        yield running
+
+
+async def _running_server(server: Server) -> AsyncGenerator[Server, None]:
     task = asyncio.create_task(server.start())
     await asyncio.sleep(0.1)
     try:
@@ -49,3 +82,419 @@ async def test_server_echo(server: Server) -> None:
         assert response.decode().replace("_id", "") == expected_responses[i]
 
     writer.close()
+
+
+async def _connect(
+    server: Server,
+) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    assert isinstance(server._server, AsyncioServer)
+    port = server._server.sockets[0].getsockname()[1]
+    return await asyncio.open_connection("127.0.0.1", port)
+
+
+async def test_pipelined_responses_keep_request_order(
+    pipelined_server: Server,
+) -> None:
+    reader, writer = await _connect(pipelined_server)
+
+    discussions = [f"abcdef{chr(ord('a') + i)}" for i in range(10)]
+    lines = ["hijklmn|SIGN_IN|testuser"]
+    lines += [
+        f"{request_id}|CREATE_DISCUSSION|ref.{i}s|c"
+        for i, request_id in enumerate(discussions)
+    ]
+    lines += ["opqrstu|WHOAMI"]
+    writer.write("".join(line + "\n" for line in lines).encode())
+    await writer.drain()
+
+    responses = [(await reader.readline()).decode() for _ in lines]
+
+    assert responses[0] == "hijklmn\n"
+    assert [r.split("|")[0] for r in responses[1:-1]] == discussions
+    assert responses[-1] == "opqrstu|testuser\n"
+
+    stats = pipelined_server.outbound_stats
+    assert stats.messages == len(lines)
+    assert stats.flushes <= stats.messages
+    assert stats.bytes == sum(len(response) for response in responses)
+
+    writer.close()
+
+
+async def test_pipelined_error_closes_after_earlier_responses(
+    pipelined_server: Server,
+) -> None:
+    reader, writer = await _connect(pipelined_server)
+
+    writer.write(b"hijklmn|SIGN_IN|testuser\nabcdefg|WHOAMI\nbad\nopqrstu|WHOAMI\n")
+    await writer.drain()
+
+    assert await reader.readline() == b"hijklmn\n"
+    assert await reader.readline() == b"abcdefg|testuser\n"
+    assert (await reader.read()).startswith(b"Invalid format")
+
+    writer.close()
+
+
+async def test_pipelined_error_lets_running_commands_finish(
+    pipelined_server: Server,
+) -> None:
+    reader, writer = await _connect(pipelined_server)
+    writer.write(b"hijklmn|SIGN_IN|testuser\nabcdefg|CREATE_DISCUSSION|ref.0s|c\n")
+    await writer.drain()
+    assert await reader.readline() == b"hijklmn\n"
+    discussion_id = (await reader.readline()).decode().strip().split("|")[1]
+
+    discussion_service = pipelined_server.discussion_service
+    update_one = discussion_service.reply_buckets.update_one
+
+    async def slow_update_one(*args: Any, **kwargs: Any) -> Any:
+        # the reply is counted, its bucket write is still on its way
+        await asyncio.sleep(0.1)
+        return await update_one(*args, **kwargs)
+
+    with patch.object(discussion_service.reply_buckets, "update_one", slow_update_one):
+        writer.write(f"bad\nopqrstu|CREATE_REPLY|{discussion_id}|late\n".encode())
+        await writer.drain()
+        assert (await reader.read()).startswith(b"Invalid format")
+
+    discussion = await discussion_service.get_discussion(discussion_id)
+    assert discussion is not None
+    assert [reply.comment for reply in discussion.replies] == ["c", "late"]
+    writer.close()
+
+
+async def test_unordered_responses_carry_request_id(unordered_server: Server) -> None:
+    reader, writer = await _connect(unordered_server)
+
+    discussions = [f"abcdef{chr(ord('a') + i)}" for i in range(10)]
+    lines = ["hijklmn|SIGN_IN|testuser"]
+    lines += [
+        f"{request_id}|CREATE_DISCUSSION|ref.{i}s|c"
+        for i, request_id in enumerate(discussions)
+    ]
+    writer.write("".join(line + "\n" for line in lines).encode())
+    await writer.drain()
+
+    responses = [(await reader.readline()).decode() for _ in lines]
+
+    assert responses[0] == "hijklmn\n"
+    assert {r.split("|")[0] for r in responses[1:]} == set(discussions)
+
+    writer.close()
+
+
+async def test_notification_reaches_every_connection_of_user(server: Server) -> None:
+    connections = [await _connect(server) for _ in range(2)]
+    for reader, writer in connections:
+        writer.write(b"hijklmn|SIGN_IN|testuser\n")
+        await writer.drain()
+        assert await reader.readline() == b"hijklmn\n"
+
+    server.deliver({"recipient_id": "testuser", "discussion_id": "abc1234"})
+
+    for reader, writer in connections:
+        assert await reader.readline() == b"DISCUSSION_UPDATED|abc1234\n"
+        writer.close()
+
+
+async def test_notification_stream_is_scoped_to_local_users(server: Server) -> None:
+    reader, writer = await _connect(server)
+    writer.write(b"hijklmn|SIGN_IN|testuser\n")
+    await writer.drain()
+    assert await reader.readline() == b"hijklmn\n"
+
+    bus = server.notification_bus
+    assert isinstance(bus, ChangeStreamNotificationBus)
+    match = bus._notification_pipeline()[0]["$match"]
+    assert match["fullDocument.recipient_id"] == {"$in": ["testuser"]}
+
+    writer.close()
+
+
+async def test_reply_and_mention_arrive_as_one_push(server: Server) -> None:
+    reader, writer = await _connect(server)
+    writer.write(b"hijklmn|SIGN_IN|testuser\nabcdefg|WHOAMI\n")
+    await writer.drain()
+    assert await reader.readline() == b"hijklmn\n"
+
+    for notification_type in ("reply", "mention"):
+        server.deliver(
+            {
+                "recipient_id": "testuser",
+                "discussion_id": "abc1234",
+                "notification_type": notification_type,
+            }
+        )
+    writer.write(b"opqrstu|WHOAMI\n")
+    await writer.drain()
+
+    assert await reader.readline() == b"abcdefg|testuser\n"
+    assert await reader.readline() == b"opqrstu|testuser\n"
+    assert await reader.readline() == b"DISCUSSION_UPDATED|abc1234\n"
+    assert server.push_debouncer.stats.collapsed == 1
+
+    writer.close()
+
+
+async def test_rich_push_carries_the_replies(server: Server) -> None:
+    basic_reader, basic_writer = await _connect(server)
+    rich_reader, rich_writer = await _connect(server)
+    basic_writer.write(b"hijklmn|SIGN_IN|testuser\n")
+    rich_writer.write(b"hijklmn|SIGN_IN|testuser\nabcdefg|SET_PUSH_FORMAT|rich\n")
+    await basic_writer.drain()
+    await rich_writer.drain()
+    assert await basic_reader.readline() == b"hijklmn\n"
+    assert await rich_reader.readline() == b"hijklmn\n"
+    assert await rich_reader.readline() == b"abcdefg\n"
+
+    for index, notification_type in [(2, "reply"), (1, "reply"), (2, "mention")]:
+        server.deliver(
+            {
+                "recipient_id": "testuser",
+                "discussion_id": "abc1234",
+                "notification_type": notification_type,
+                "reply": {
+                    "client_id": "other",
+                    "comment": f"reply {index}",
+                    "created_at": datetime.now(),
+                    "index": index,
+                },
+            }
+        )
+
+    assert await basic_reader.readline() == b"DISCUSSION_UPDATED|abc1234\n"
+    assert await rich_reader.readline() == b"DISCUSSION_REPLY|abc1234|1|other|reply 1\n"
+    assert await rich_reader.readline() == b"DISCUSSION_REPLY|abc1234|2|other|reply 2\n"
+
+    basic_writer.close()
+    rich_writer.close()
+
+
+async def test_rich_push_falls_back_without_reply(server: Server) -> None:
+    reader, writer = await _connect(server)
+    writer.write(b"hijklmn|SIGN_IN|testuser\nabcdefg|SET_PUSH_FORMAT|rich\n")
+    await writer.drain()
+    assert await reader.readline() == b"hijklmn\n"
+    assert await reader.readline() == b"abcdefg\n"
+
+    server.deliver({"recipient_id": "testuser", "discussion_id": "abc1234"})
+
+    assert await reader.readline() == b"DISCUSSION_UPDATED|abc1234\n"
+    writer.close()
+
+
+async def test_discussion_event_reaches_local_participants(server: Server) -> None:
+    reader, writer = await _connect(server)
+    writer.write(b"hijklmn|SIGN_IN|testuser\n")
+    await writer.drain()
+    assert await reader.readline() == b"hijklmn\n"
+    await server.db.discussions.insert_one(
+        {"discussion_id": "abc1234", "participants": ["other", "testuser", "offline"]}
+    )
+
+    await server.deliver_discussion_event(
+        {
+            "discussion_id": "abc1234",
+            "sender_id": "other",
+            "reply": {
+                "client_id": "other",
+                "comment": "hi",
+                "created_at": datetime.now(),
+                "index": 3,
+            },
+        }
+    )
+
+    assert await reader.readline() == b"DISCUSSION_UPDATED|abc1234\n"
+    writer.close()
+
+
+async def test_stats_are_logged_periodically(
+    container: Container, caplog: pytest.LogCaptureFixture
+) -> None:
+    container.config.stats_log_interval.from_value(0.01)
+    caplog.set_level(logging.INFO, logger="server.server")
+
+    async for server in _running_server(Server(container=container, port=0)):
+        reader, writer = await _connect(server)
+        writer.write(b"hijklmn|SIGN_IN|testuser\n")
+        await writer.drain()
+        await reader.readline()
+        await asyncio.sleep(0.05)
+        writer.close()
+
+    logged = caplog.text
+    assert "stats outbound: messages=1 bytes=8 flushes=1" in logged
+    for component in [
+        "push_debouncer",
+        "discussion_cache",
+        "discussion_cache_stream",
+        "notification_stream",
+        "discussion_event_stream",
+    ]:
+        assert f"stats {component}: " in logged
+
+
+async def test_in_process_bus_pushes_replies(single_node_server: Server) -> None:
+    author_reader, author_writer = await _connect(single_node_server)
+    replier_reader, replier_writer = await _connect(single_node_server)
+    author_writer.write(
+        b"hijklmn|SIGN_IN|author\nabcdefg|CREATE_DISCUSSION|ref.0s|first\n"
+    )
+    await author_writer.drain()
+    assert await author_reader.readline() == b"hijklmn\n"
+    discussion_id = (await author_reader.readline()).decode().strip().split("|")[1]
+
+    replier_writer.write(
+        f"hijklmn|SIGN_IN|replier\nopqrstu|CREATE_REPLY|{discussion_id}|second\n".encode()
+    )
+    await replier_writer.drain()
+    assert await replier_reader.readline() == b"hijklmn\n"
+    assert await replier_reader.readline() == b"opqrstu\n"
+
+    pushed = await asyncio.wait_for(author_reader.readline(), 1)
+    assert pushed == f"DISCUSSION_UPDATED|{discussion_id}\n".encode()
+
+    author_writer.close()
+    replier_writer.close()
+
+
+async def test_pushed_notifications_are_left_out_of_the_backlog(
+    single_node_server: Server,
+) -> None:
+    author_reader, author_writer = await _connect(single_node_server)
+    author_writer.write(
+        b"hijklmn|SIGN_IN|author\nabcdefg|CREATE_DISCUSSION|ref.0s|first\n"
+    )
+    await author_writer.drain()
+    assert await author_reader.readline() == b"hijklmn\n"
+    discussion_id = (await author_reader.readline()).decode().strip().split("|")[1]
+    await single_node_server.discussion_service.create_reply(
+        discussion_id, "second", "replier"
+    )
+    pushed = await asyncio.wait_for(author_reader.readline(), 1)
+    assert pushed == f"DISCUSSION_UPDATED|{discussion_id}\n".encode()
+
+    notification_service = single_node_server.notification_service
+    for _ in range(100):
+        if not await notification_service.get_backlog("author", 10):
+            break
+        await asyncio.sleep(0.01)
+    assert await notification_service.get_backlog("author", 10) == []
+    assert len(await notification_service.get_notifications("author")) == 1
+    author_writer.close()
+
+
+async def test_backlog_is_replayed_on_request(container: Container) -> None:
+    container.config.backlog_batch_size.from_value(1)
+    notification_service = container.notification_service()
+    reply = {"client_id": "other", "comment": "hi", "created_at": None, "index": 1}
+    for discussion_id in ["abc1234", "abc1234", "def5678"]:
+        await notification_service.notify(discussion_id, "other", reply, ["testuser"])
+
+    async for server in _running_server(Server(container=container, port=0)):
+        reader, writer = await _connect(server)
+        # signing in alone replays nothing
+        writer.write(b"hijklmn|SIGN_IN|testuser\nklmnopq|WHOAMI\n")
+        await writer.drain()
+        assert await reader.readline() == b"hijklmn\n"
+        assert await reader.readline() == b"klmnopq|testuser\n"
+
+        writer.write(b"bcdefgh|REPLAY_BACKLOG\n")
+        await writer.drain()
+        assert await reader.readline() == b"bcdefgh\n"
+        assert await reader.readline() == b"NOTIFICATION_BACKLOG|1|(abc1234|reply|2)\n"
+
+        writer.write(b"abcdefg|ACK_BACKLOG|1\n")
+        await writer.drain()
+        assert await reader.readline() == b"abcdefg\n"
+        assert await reader.readline() == b"NOTIFICATION_BACKLOG|2|(def5678|reply|1)\n"
+
+        writer.write(b"opqrstu|ACK_BACKLOG|2\n")
+        await writer.drain()
+        assert await reader.readline() == b"opqrstu\n"
+
+        writer.write(b"vwxyzab|ACK_BACKLOG|2\n")
+        await writer.drain()
+        assert await reader.readline() == b"no backlog batch 2 to acknowledge"
+        writer.close()
+
+    assert await notification_service.get_notifications("testuser") == []
+
+
+async def test_streamed_list_keeps_its_place_in_the_pipeline(
+    pipelined_server: Server,
+) -> None:
+    reader, writer = await _connect(pipelined_server)
+
+    lines = ["hijklmn|SIGN_IN|testuser"]
+    lines += [
+        f"abcdef{chr(ord('a') + i)}|CREATE_DISCUSSION|ref.{i}s|c" for i in range(3)
+    ]
+    lines += ["xthbsuv|LIST_DISCUSSIONS", "opqrstu|WHOAMI"]
+    writer.write("".join(line + "\n" for line in lines).encode())
+    await writer.drain()
+
+    responses = [(await reader.readline()).decode() for _ in lines]
+
+    assert responses[4].startswith("xthbsuv|(")
+    assert responses[4].count("|ref.") == 3
+    assert responses[5] == "opqrstu|testuser\n"
+
+    writer.close()
+
+
+async def test_push_does_not_split_a_streamed_list(container: Container) -> None:
+    container.config.list_batch_size.from_value(1)
+    server = Server(container=container, port=0)
+    with_replies = server.discussion_service._with_replies
+
+    async def with_replies_and_push(docs: list[Any]) -> list[Any]:
+        # a push comes in while the list is between two cursor batches
+        for outbound in server._peer_buffers.values():
+            outbound.push("DISCUSSION_UPDATED|abc1234\n")
+        return await with_replies(docs)
+
+    async for running in _running_server(server):
+        reader, writer = await _connect(running)
+        lines = ["hijklmn|SIGN_IN|testuser"]
+        lines += [
+            f"abcdef{chr(ord('a') + i)}|CREATE_DISCUSSION|ref.{i}s|c" for i in range(3)
+        ]
+        writer.write("".join(line + "\n" for line in lines).encode())
+        await writer.drain()
+        for _ in lines:
+            await reader.readline()
+
+        running.discussion_service._with_replies = with_replies_and_push  # type: ignore[method-assign]
+        writer.write(b"xthbsuv|LIST_DISCUSSIONS\n")
+        await writer.drain()
+
+        listed = (await reader.readline()).decode()
+        assert listed.startswith("xthbsuv|(") and listed.count("|ref.") == 3
+        assert await reader.readline() == b"DISCUSSION_UPDATED|abc1234\n"
+        writer.close()
+
+
+async def test_streamed_list_is_not_interleaved(unordered_server: Server) -> None:
+    reader, writer = await _connect(unordered_server)
+
+    lines = ["hijklmn|SIGN_IN|testuser"]
+    lines += [
+        f"abcdef{chr(ord('a') + i)}|CREATE_DISCUSSION|ref.{i}s|c" for i in range(3)
+    ]
+    writer.write("".join(line + "\n" for line in lines).encode())
+    await writer.drain()
+    for _ in lines:
+        await reader.readline()
+
+    writer.write(b"xthbsuv|LIST_DISCUSSIONS\nopqrstu|WHOAMI\n")
+    await writer.drain()
+    responses = {(await reader.readline()).decode() for _ in range(2)}
+
+    assert "opqrstu|testuser\n" in responses
+    (listed,) = responses - {"opqrstu|testuser\n"}
+    assert listed.startswith("xthbsuv|(") and listed.count("|ref.") == 3
+
+    writer.close()
@@ -0,0 +1,70 @@
+import pytest
+
+from server.di import Container
+
+TEST_PEER_1 = "127.0.0.1:8001"
+TEST_PEER_2 = "127.0.0.1:8002"
+
+
+@pytest.mark.asyncio
+async def test_presence_tracks_every_connection(container: Container) -> None:
+    session_service = container.session_service()
+    await session_service.set(TEST_PEER_1, "user1")
+    await session_service.set(TEST_PEER_2, "user1")
+
+    assert session_service.get_peer_ids("user1") == {TEST_PEER_1, TEST_PEER_2}
+    assert session_service.get_peer_ids("user2") == set()
+
+    await session_service.delete(TEST_PEER_1)
+    assert session_service.get_peer_ids("user1") == {TEST_PEER_2}
+
+    await session_service.delete(TEST_PEER_2)
+    assert session_service.get_peer_ids("user1") == set()
+
+
+@pytest.mark.asyncio
+async def test_presence_follows_sign_in_as_another_user(container: Container) -> None:
+    session_service = container.session_service()
+    await session_service.set(TEST_PEER_1, "user1")
+    await session_service.set(TEST_PEER_1, "user2")
+
+    assert session_service.get_peer_ids("user1") == set()
+    assert session_service.get_peer_ids("user2") == {TEST_PEER_1}
+    assert await session_service.get_client_id(TEST_PEER_1) == "user2"
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_written_through_and_read_locally(
+    container: Container,
+) -> None:
+    session_service = container.session_service()
+    await session_service.set(TEST_PEER_1, "user1")
+
+    session_doc = await container.db().sessions.find_one({"peer_id": TEST_PEER_1})
+    assert session_doc is not None
+    assert session_doc["user_id"] == "user1"
+
+    # lookups never go back to the database
+    await container.db().sessions.delete_many({})
+    assert await session_service.get_client_id(TEST_PEER_1) == "user1"
+    assert await session_service.get_by_user_id("user1") == TEST_PEER_1
+
+    await session_service.delete(TEST_PEER_1)
+    assert await session_service.get_client_id(TEST_PEER_1) is None
+    assert await session_service.get_session(TEST_PEER_1) is None
+
+
+@pytest.mark.asyncio
+async def test_presence_listeners_see_users_come_and_go(container: Container) -> None:
+    session_service = container.session_service()
+    changes: list[frozenset[str]] = []
+    session_service.add_presence_listener(
+        lambda: changes.append(session_service.get_present_user_ids())
+    )
+
+    await session_service.set(TEST_PEER_1, "user1")
+    await session_service.set(TEST_PEER_2, "user1")
+    await session_service.delete(TEST_PEER_1)
+    await session_service.delete(TEST_PEER_2)
+
+    assert changes == [frozenset({"user1"}), frozenset()]
@@ -50,3 +50,11 @@ class TestValidator(unittest.TestCase):
         self.assertFalse(
             ValidationService.validate_reference("abc.def ghi")
         )  # spaces not allowed
+
+    def test_time_marker_seconds(self) -> None:
+        self.assertEqual(ValidationService.time_marker_seconds("30s"), 30)
+        self.assertEqual(ValidationService.time_marker_seconds("1m30s"), 90)
+        self.assertEqual(ValidationService.time_marker_seconds("10m0s"), 600)
+
+        with self.assertRaises(ValueError):
+            ValidationService.time_marker_seconds("1m")